@@ -7,6 +7,8 @@ from conf.ConfigWrapper import ConfigWrapper
 from webapp.Env import Env
 
 from modules.db.DBManager import DBManager
+from modules.irwin.Irwin import Irwin
+from modules.irwin.InferencePool import InferencePool
 
 from flask import Flask
 
@@ -29,6 +31,9 @@ logging.getLogger("requests.packages.urllib3").setLevel(logging.WARNING)
 logging.getLogger("chess.uci").setLevel(logging.WARNING)
 logging.getLogger("modules.fishnet.fishnet").setLevel(logging.INFO)
 
+## Inference workers, forked before the database clients start their threads
+InferencePool.prefork(config, [Irwin.basicModelClass(config)])
+
 ## Database
 dbManager = DBManager(config)
 
@@ -1,15 +1,21 @@
 from default_imports import *
 
 import argparse
+import os
 import sys
 import time
 import json
+import queue
+import threading
+
+from chess import Board
 
 from conf.ConfigWrapper import ConfigWrapper
 
 from modules.game.Game import Game, GameDB
 from modules.game.AnalysedPosition import AnalysedPositionDB
 from modules.game.AnalysedGame import AnalysedGame
+from modules.game.AnalysedMove import AnalysisBSONHandler
 from modules.game.EngineTools import EngineTools
 
 from modules.db.DBManager import DBManager
@@ -24,6 +30,8 @@ parser = argparse.ArgumentParser(description=__doc__)
 ## Training
 parser.add_argument("--token", dest="token", nargs="?",
                 default=None, help="token to use with webserver")
+parser.add_argument("--positions", dest="positions", action="store_true",
+                default=False, help="analyse batches of positions for the position scheduler instead of player jobs")
 
 loglevels = {
     'CRITICAL': logging.CRITICAL,
@@ -44,9 +52,9 @@ args = parser.parse_args()
 env = Env(conf, token = args.token)
 api = Api(env)
 
-def analyseGames(games: List[Game], playerId: str) -> Iterable[AnalysedGame]:
+def analyseGames(games: List[Game], playerId: str) -> Iterable[Tuple[AnalysedGame, int]]:
     """
-    Iterate through list of games and return analysed games
+    Iterate through list of games and return analysed games, with the number of games left to analyse
     """
 
     count = len(games)
@@ -54,20 +62,80 @@ def analyseGames(games: List[Game], playerId: str) -> Iterable[AnalysedGame]:
         logging.warning(f'{playerId}: Analysing Game #{i+1} / {count}: {game.id}')
         analysedGame = env.engineTools.analyseGame(game, game.white == playerId, conf['stockfish nodes'])
         if analysedGame is not None:
-            yield analysedGame
-
-while True:
-    logging.info('getting new job')
-    job = api.requestJob()
-
-    if job is not None:
-        logging.warning(f'Analysing Player: {job.playerId}')
-        gameIds = [g.id for g in job.games]
-        logging.warning(f'Analysing Games: {gameIds}')
-
-        analysedGames = list(analyseGames(job.games, job.playerId))
-
-        response = api.completeJob(job, analysedGames)
+            yield analysedGame, count - i - 1
+
+logging.warning('Benchmarking engine')
+hardware = {
+    'cores': os.cpu_count(),
+    'engines': 1,
+    'threads': conf['stockfish threads'],
+    'nps': env.engineTools.benchmark(conf['stockfish nodes']),
+    'nodes': conf['stockfish nodes']
+}
+logging.warning(f'Registering client: {hardware}')
+api.registerClient(hardware)
+
+def analysePositions():
+    """work for the position scheduler. Never returns"""
+    while True:
+        positions = api.requestPositions()
+        if len(positions) == 0:
+            logging.warning('No positions. Pausing')
+            time.sleep(10)
+            continue
+
+        logging.warning(f'Analysing {len(positions)} positions')
+        env.engineTools.engine.ucinewgame()
+        results = [{
+            'id': p['id'],
+            'multipv': p['multipv'],
+            'analyses': [AnalysisBSONHandler.writes(a) for a in env.engineTools.analysePosition(Board(p['fen']), p['multipv'], conf['stockfish nodes'])]
+        } for p in positions]
+        if not api.completePositions(results):
+            logging.warning('Failed to post positions')
+
+if args.positions:
+    analysePositions()
+
+# seconds the server may hold a job request open. Without long polling, idle clients sleep between requests
+wait = conf['server wait'] or 0
+
+# engine searches per second. Starts at the declared speed (if any) and tracks the measured speed
+speed = conf['stockfish speed']
+
+# post each game as it is analysed, and stop once the server says the verdict cannot change. Off by default
+earlyStop = conf['client early_stop'] or False
+
+# jobs that may be fetched ahead of the one being analysed
+prefetch = conf['client prefetch'] or 1
+
+jobs = queue.Queue() # fetched and waiting for the engine
+uploads = queue.Queue() # analysed and waiting to be posted
+held = set() # playerIds of jobs fetched and not yet posted
+slots = threading.BoundedSemaphore(1 + prefetch) # jobs being analysed + prefetched. Released once posted
+
+def fetchJobs():
+    """keep the jobs queue topped up, so the engine never waits on the server"""
+    while True:
+        slots.acquire()
+        logging.info('getting new job')
+        job = api.requestJob(speed, wait, list(held))
+        if job is not None:
+            held.add(job.playerId)
+            jobs.put(job)
+        else:
+            slots.release()
+            if wait == 0:
+                logging.warning('Job is None. Pausing')
+                time.sleep(10)
+            else:
+                logging.info('Job is None. Requesting again')
+
+def uploadJobs():
+    """post completed jobs in the background, so the engine can go straight on to the next job"""
+    while True:
+        job, analysedGames, elapsed, searches = uploads.get()
+        response = api.completeJob(job, analysedGames, elapsed, searches)
 
         if response is not None:
             try:
@@ -78,6 +146,38 @@ while True:
                     logging.warning('SOFT FAILURE. Failed to post completed job. Message: {}'.format(resJson.get('message')))
             except json.decoder.JSONDecodeError:
                 logging.warning(f'HARD FAILURE. Failed to post job. Bad response from server.')
-    else:
-        logging.warning('Job is None. Pausing')
-        time.sleep(10)
+
+        held.discard(job.playerId)
+        slots.release()
+
+threading.Thread(target=fetchJobs, name='fetchJobs', daemon=True).start()
+threading.Thread(target=uploadJobs, name='uploadJobs', daemon=True).start()
+
+while True:
+    job = jobs.get()
+
+    logging.warning(f'Analysing Player: {job.playerId}')
+    gameIds = [g.id for g in job.games]
+    logging.warning(f'Analysing Games: {gameIds}')
+
+    start = time.time()
+    analysedGames = []
+    unposted = [] # analysed games the server has not accepted yet
+    for analysedGame, remaining in analyseGames(job.games, job.playerId):
+        analysedGames.append(analysedGame)
+        unposted.append(analysedGame)
+        if earlyStop and remaining > 0:
+            settled = api.progressJob(job, unposted, remaining)
+            if settled is not None:
+                unposted = []
+            if settled:
+                logging.warning(f'{job.playerId}: Verdict is settled. Skipping {remaining} games')
+                break
+    elapsed = time.time() - start
+
+    searches = sum(2*ag.length() for ag in analysedGames)
+    if searches > 0 and elapsed > 0:
+        speed = searches/elapsed if speed is None else 0.7*speed + 0.3*searches/elapsed
+        logging.info(f'Engine speed: {speed:.2f} searches/sec')
+
+    uploads.put((job, unposted, elapsed, searches))
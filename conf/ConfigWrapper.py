@@ -17,12 +17,14 @@ class ConfigWrapper:
     def __getitem__(self, key: str):
         """
         allows for accessing like, conf["index items like this"]
+        None if the key, or any section on the way to it, is missing
         """
         try:
             head, tail = key.split(' ', 1)
-            return self.__getattr__(head)[tail]
         except ValueError:
             return self.__getattr__(key)
+        section = self.__getattr__(head)
+        return section[tail] if isinstance(section, ConfigWrapper) else None
 
     def __getattr__(self, key: str):
         """
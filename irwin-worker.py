@@ -0,0 +1,125 @@
+"""Report worker for Irwin. Builds player reports for players on the irwin queue and posts them to lichess,
+and checks whether the verdict on players being analysed is settled.
+Entries are claimed atomically and removed once their report is posted, so as many workers as needed can be run
+against the same database, and the entries of a worker that dies are taken by another."""
+from default_imports import *
+
+from conf.ConfigWrapper import ConfigWrapper
+
+from webapp.Env import Env
+
+from modules.irwin.InferencePool import InferencePool
+from modules.irwin.DilatedAnalysedGameModel import analysedGameModelClass
+
+import argparse
+import logging
+import os
+import socket
+import sys
+from time import sleep
+
+parser = argparse.ArgumentParser(description=__doc__)
+
+parser.add_argument("--quiet", dest="loglevel",
+                    default=logging.DEBUG, action="store_const", const=logging.INFO,
+                    help="reduce the number of logged messages")
+settings = parser.parse_args()
+
+logging.basicConfig(format="%(message)s", level=settings.loglevel, stream=sys.stdout)
+logging.getLogger("requests.packages.urllib3").setLevel(logging.WARNING)
+logging.getLogger("chess.uci").setLevel(logging.WARNING)
+
+config = ConfigWrapper.new('conf/server_config.json')
+
+# forked before Env starts any threads
+InferencePool.prefork(config, [analysedGameModelClass(config)])
+
+env = Env(config)
+
+# entries are claimed under this name until their report is posted
+worker = f'{socket.gethostname()}-{os.getpid()}'
+
+def reportRequest(irwinQueue):
+    player = env.gameApi.playerById(irwinQueue.id)
+    if player is None:
+        logging.warning(f'{irwinQueue.id} is not in the player database. Skipping')
+        return None
+    return (player, env.gameApi.analysedGamesByPlayerId(player.id), irwinQueue.owner)
+
+def createReports(reportRequests):
+    """the reports of reportRequests. If the batch fails, reports are made one player at a time so one bad player only loses its own"""
+    try:
+        return env.irwin.createReports(reportRequests)
+    except Exception:
+        if len(reportRequests) == 1:
+            logging.exception(f'Failed to build a report for {reportRequests[0][0].id}. Skipping')
+            return []
+        logging.exception('Failed to build reports for the batch. Building them one player at a time')
+        return [playerReport for r in reportRequests for playerReport in createReports([r])]
+
+def postReport(playerReport):
+    """
+    post playerReport to lichess and complete its entry. Only reports lichess accepted are recorded,
+    as recorded reports suppress new requests for the player. postReport already retries, so a rejected
+    report is not queued again
+    """
+    logging.warning(f'Sending player report for {playerReport.playerId}, activation {playerReport.activation}% (model {playerReport.modelVersion})')
+    if env.lichessApi.postReport(playerReport):
+        env.irwinEnv.playerReportDB.write(playerReport)
+    else:
+        logging.warning(f'Lichess did not accept the report for {playerReport.playerId}')
+    env.queue.completeIrwinAnalysis(worker, playerReport.playerId)
+
+def handleBatch(irwinQueues):
+    """
+    failures are logged and skipped per player, so no entry can stop the worker. Entries that fail
+    stay claimed, and are retried once the claim times out
+    """
+    reportRequests = []
+    for irwinQueue in irwinQueues:
+        try:
+            request = reportRequest(irwinQueue)
+        except Exception:
+            logging.exception(f'Failed to load {irwinQueue.id}. Skipping')
+            continue
+        if request is None:
+            env.queue.completeIrwinAnalysis(worker, irwinQueue.id)
+        else:
+            reportRequests.append(request)
+
+    for playerReport in createReports(reportRequests):
+        try:
+            postReport(playerReport)
+        except Exception:
+            logging.exception(f'Failed to post or record the report for {playerReport.playerId}')
+
+def settleCheck(playerId, remaining):
+    """
+    mark the engine queue entry of playerId as settled if analysing `remaining` more games can't change its verdict.
+    remaining is as it was when the check was requested, so it is never less than the games actually left
+    """
+    player = env.gameApi.playerById(playerId)
+    if player is not None and env.irwin.verdictSettled(player, env.gameApi.analysedGamesByPlayerId(playerId), remaining):
+        logging.warning(f'Verdict on {playerId} is settled with {remaining} games remaining')
+        env.queue.settle(playerId)
+
+def handleSettleChecks(checks):
+    for playerId, remaining in checks:
+        try:
+            settleCheck(playerId, remaining)
+        except Exception:
+            logging.exception(f'Failed to check the verdict on {playerId}')
+
+while True:
+    # verdict checks come first, as clients are waiting on them
+    checks = env.queue.nextSettleChecks(config['irwin worker batch_size'] or 16)
+    handleSettleChecks(checks)
+
+    irwinQueues = env.queue.nextIrwinAnalyses(worker, config['irwin worker batch_size'] or 16)
+    if len(irwinQueues) == 0:
+        if len(checks) == 0:
+            sleep(config['irwin worker sleep'] or 5)
+        continue
+
+    logging.info(f'Building reports for {[iq.id for iq in irwinQueues]}')
+    handleBatch(irwinQueues)
@@ -11,9 +11,11 @@ from socket import gaierror
 
 from webapp.Env import Env
 
+from modules.irwin.Irwin import Irwin
+from modules.irwin.InferencePool import InferencePool
+
 from modules import http
 from modules.lichess.Request import Request
-from modules.queue.EngineQueue import EngineQueue
 
 import json
 import argparse
@@ -37,6 +39,9 @@ logging.getLogger("modules.fishnet.fishnet").setLevel(logging.WARNING)
 
 config = ConfigWrapper.new('conf/server_config.json')
 
+# forked before Env starts any threads
+InferencePool.prefork(config, [Irwin.basicModelClass(config)])
+
 env = Env(config)
 
 """
@@ -47,27 +52,9 @@ Possible messages that lichess will emit
 
 def handleLine(payload: Dict):
     request = Request.fromJson(payload)
-    playerId = request.player.id
     if request is not None:
         logging.info(f'Processing request for {request.player}')
-        # store user
-        env.gameApi.writePlayer(request.player)
-        # store games
-        env.gameApi.writeGames(request.games)
-
-        existingEngineQueue = env.queue.engineQueueById(playerId)
-
-        newEngineQueue = EngineQueue.new(
-            playerId=playerId,
-            origin=request.origin,
-            gamesAndPredictions=list(zip(request.games, env.irwin.basicGameModel.predict(playerId, request.games))))
-
-        if existingEngineQueue is not None and not existingEngineQueue.completed:
-            newEngineQueue = EngineQueue.merge(existingEngineQueue, newEngineQueue)
-
-        requiredGames = env.gameApi.gamesForAnalysis(playerId, newEngineQueue.requiredGameIds)
-        if len(requiredGames) > 0:
-            env.queue.queueEngineAnalysis(newEngineQueue)
+        env.enqueue.request(request)
 
 
 session = http.get_requests_session_with_keepalive()
@@ -14,21 +14,95 @@ from requests.models import Response
 class Api(NamedTuple('Api', [
         ('env', Env)
     ])):
-    def requestJob(self) -> Opt[Dict]:
+    def requestJob(self, speed: Opt[Number] = None, wait: Number = 0, holding: List[str] = []) -> Opt[Dict]:
+        """
+        speed: engine searches per second. Lets the server hand out jobs sized to this client.
+        wait: seconds the server may hold the request open waiting for work.
+        holding: playerIds of jobs this client has already been given and not yet completed.
+        """
+        payload = {
+            'auth': self.env.auth,
+            'speed': speed,
+            'wait': wait,
+            'holding': holding
+        }
         for i in range(5):
             try:
-                result = requests.get(f'{self.env.url}/api/request_job', json={'auth': self.env.auth})
+                result = requests.get(f'{self.env.url}/api/request_job', json=payload, timeout=wait+30)
                 return Job.fromJson(result.json())
-            except (json.decoder.JSONDecodeError, requests.ConnectionError, requests.exceptions.SSLError):
-                logging.warning(f"Error in request job. Trying again in 10 sec. Received: {result.text}")
+            except (json.decoder.JSONDecodeError, requests.ConnectionError, requests.exceptions.SSLError, requests.exceptions.Timeout):
+                logging.warning(f"Error in request job. Trying again in 10 sec.")
+                time.sleep(10)
+        return None
+
+    def requestPositions(self) -> List[Dict]:
+        """a batch of positions to analyse: [{'id', 'fen', 'multipv'}]"""
+        for i in range(5):
+            try:
+                result = requests.get(f'{self.env.url}/api/request_positions', json={'auth': self.env.auth}, timeout=30)
+                return result.json().get('positions', []) if result.status_code == 200 else []
+            except (json.decoder.JSONDecodeError, requests.ConnectionError, requests.exceptions.SSLError, requests.exceptions.Timeout):
+                logging.warning('Error in request positions. Trying again in 10 sec.')
+                time.sleep(10)
+        return []
+
+    def completePositions(self, positions: List[Dict]) -> bool:
+        """
+        positions: [{'id', 'multipv', 'analyses'}]
+        """
+        for i in range(5):
+            try:
+                result = requests.post(f'{self.env.url}/api/complete_positions', json={'auth': self.env.auth, 'positions': positions})
+                return result.status_code == 200
+            except (requests.ConnectionError, requests.exceptions.SSLError):
+                logging.warning('Error in completing positions. Trying again in 10 sec')
+                time.sleep(10)
+        return False
+
+    def registerClient(self, hardware: Dict) -> bool:
+        """
+        hardware: {'cores', 'engines', 'threads', 'nps', 'nodes'}
+        """
+        for i in range(5):
+            try:
+                result = requests.post(f'{self.env.url}/api/register_client', json={'auth': self.env.auth, 'hardware': hardware})
+                return result.status_code == 200
+            except (requests.ConnectionError, requests.exceptions.SSLError):
+                logging.warning('Error registering client. Trying again in 10 sec')
                 time.sleep(10)
+        return False
+
+    def progressJob(self, job: Job, analysedGames: List[AnalysedGame], remaining: int) -> Opt[bool]:
+        """
+        Post games analysed so far. Returns True if the server says the remaining games
+        can no longer change the verdict, None if the games could not be posted.
+        """
+        payload = {
+            'auth': self.env.auth,
+            'job': job.toJson(),
+            'analysedGames': [ag.toJson() for ag in analysedGames],
+            'remaining': remaining
+        }
+        try:
+            result = requests.post(f'{self.env.url}/api/progress_job', json=payload)
+            if result.status_code == 200:
+                return result.json().get('settled', False)
+        except (json.decoder.JSONDecodeError, requests.ConnectionError, requests.exceptions.SSLError):
+            logging.warning('Error in posting job progress')
         return None
 
-    def completeJob(self, job: Job, analysedGames: List[AnalysedGame]) -> Opt[Response]:
+    def completeJob(self, job: Job, analysedGames: List[AnalysedGame], elapsed: Opt[Number] = None, searches: Opt[int] = None) -> Opt[Response]:
+        """
+        analysedGames: games not already posted with progressJob
+        elapsed: seconds spent analysing the job
+        searches: engine searches performed for the whole job
+        """
         payload = {
             'auth': self.env.auth,
             'job': job.toJson(),
-            'analysedGames': [ag.toJson() for ag in analysedGames] 
+            'analysedGames': [ag.toJson() for ag in analysedGames],
+            'elapsed': elapsed,
+            'searches': searches
         }
         for i in range(5):
             try:
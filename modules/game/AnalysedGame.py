@@ -233,6 +233,12 @@ class AnalysedGameDB(NamedTuple('AnalysedGameDB', [
         """
         return [AnalysedGameBSONHandler.reads(ga) for ga in self.analysedGameColl.find(skip=batch*batchSize, limit=batchSize)]
 
+    def analysedPairs(self, playerIds: List[PlayerID], gameIds: List[GameID]) -> List[Tuple[PlayerID, GameID]]:
+        """(playerId, gameId) of each analysed game among playerIds and gameIds. Only ids are loaded"""
+        return [(bson['userId'], bson['gameId']) for bson in self.analysedGameColl.find(
+            {'userId': {'$in': list(playerIds)}, 'gameId': {'$in': list(gameIds)}},
+            {'userId': 1, 'gameId': 1})]
+
     def byGameIdAndUserId(self, gameId: GameID, playerId: PlayerID) -> Opt[AnalysedGame]:
         bson = self.analysedGameColl.find_one({'gameId': gameId, 'userId': playerId})
         return None if bson is None else AnalysedGameBSONHandler.reads(bson)
\ No newline at end of file
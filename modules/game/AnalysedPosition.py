@@ -54,6 +54,9 @@ class AnalysedPositionDB(NamedTuple('AnalysedPositionDB', [
     def writeMany(self, analysedPositions: List[AnalysedPosition]):
         [self.write(analysedPosition) for analysedPosition in analysedPositions]
 
+    def byIds(self, ids: List[AnalysedPositionID]) -> List[AnalysedPosition]:
+        return [AnalysedPositionBSONHandler.reads(bson) for bson in self.analysedPositionColl.find({'_id': {'$in': list(ids)}})]
+
     def byBoard(self, board: Board) -> Opt[AnalysedPosition]:
         analysedPositionBSON = self.analysedPositionColl.find_one({'_id': AnalysedPosition.idFromBoard(board)})
         return None if analysedPositionBSON is None else AnalysedPositionBSONHandler.reads(analysedPositionBSON)
\ No newline at end of file
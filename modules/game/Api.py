@@ -1,7 +1,9 @@
 from default_imports import *
 import logging
 
-from modules.game.AnalysedGame import AnalysedGameBSONHandler
+from modules.game.AnalysedGame import AnalysedGame, AnalysedGameBSONHandler
+from modules.game.AnalysedPosition import AnalysedPosition, AnalysedPositionID
+from modules.game.EngineTools import EngineTools
 
 from modules.game.Env import Env
 
@@ -39,17 +41,88 @@ class Api(NamedTuple('Api', [
 
         return games
 
+    def gamesForAnalysisMany(self, playerIdsAndRequired: List[Tuple[PlayerID, List[GameID]]]) -> List[List[Game]]:
+        """
+        gamesForAnalysis for many players, with one query for the games and one for the analysed games.
+        Only the required games are loaded.
+        """
+        requiredIds = {gid for _, required in playerIdsAndRequired for gid in required}
+        games = {g.id: g for g in self.env.gameDB.byIdsUnordered(requiredIds)}
+        return self.unanalysedGames([(playerId, [games[gid] for gid in required if gid in games])
+            for playerId, required in playerIdsAndRequired])
+
+    def completeSnapshot(self, playerId: PlayerID, snapshot: List[Game], required: List[GameID]) -> List[Game]:
+        """
+        the games stored on an engine queue entry, with the required games missing from them
+        loaded as gamesForAnalysisMany would. Entries queued before games were stored on them,
+        and merged into since, only have a snapshot of the later games.
+        """
+        snapshotIds = {g.id for g in snapshot}
+        missing = [gid for gid in required if gid not in snapshotIds]
+        if len(missing) == 0:
+            return snapshot
+        return snapshot + self.gamesForAnalysisMany([(playerId, missing)])[0]
+
+    def unanalysedGames(self, playerIdsAndGames: List[Tuple[PlayerID, List[Game]]]) -> List[List[Game]]:
+        """
+        gamesForAnalysis when the games are already in hand. One query for the analysed games.
+        """
+        playerIds = {playerId for playerId, _ in playerIdsAndGames}
+        gameIds = {g.id for _, games in playerIdsAndGames for g in games}
+        analysed = set(self.env.analysedGameDB.analysedPairs(playerIds, gameIds))
+
+        correct_length = lambda g: len(g.pgn) >= 40 and len(g.pgn) <= 120
+        return [[g for g in games if (playerId, g.id) not in analysed and correct_length(g)]
+            for playerId, games in playerIdsAndGames]
+
+    def analysisCosts(self, playerIdsAndGames: List[Tuple[PlayerID, List[Game]]]) -> List[int]:
+        """
+        Number of engine searches still needed to analyse the games of each player, leaving out
+        positions that are already analysed with enough lines. One query for the analysed positions.
+        """
+        positions = [[position for g in games for position in EngineTools.positions(g, g.white == playerId)]
+            for playerId, games in playerIdsAndGames]
+        analysed = self.analysedPositionsByIds(list({pid for ps in positions for pid, _, _ in ps}))
+        return [sum(1 for pid, board, multipv in ps if not EngineTools.sufficient(analysed.get(pid), board, multipv))
+            for ps in positions]
+
+    def analysedGamesByPlayerId(self, playerId: PlayerID) -> List[AnalysedGame]:
+        """
+        The analysed games of a player that the analysed game model can take
+        """
+        return [ag for ag in self.env.analysedGameDB.byPlayerId(playerId) if ag.gameLength() <= 60]
+
+    def analysedPositionsByIds(self, ids: List[AnalysedPositionID]) -> Dict[AnalysedPositionID, AnalysedPosition]:
+        return {ap.id: ap for ap in self.env.analysedPositionDB.byIds(ids)}
+
+    def writeAnalysedPositions(self, analysedPositions: List[AnalysedPosition]):
+        """
+        store analysed positions, keeping whichever analysis of a position has more lines
+        """
+        existing = self.analysedPositionsByIds([ap.id for ap in analysedPositions])
+        self.env.analysedPositionDB.writeMany([ap for ap in analysedPositions
+            if ap.id not in existing or len(ap.analyses) >= len(existing[ap.id].analyses)])
+
     def gamesByIds(self, gameIds: List[GameID]):
         return self.env.gameDB.byIds(gameIds)
 
+    def existingGameIds(self, gameIds: List[GameID]) -> List[GameID]:
+        return self.env.gameDB.existingIds(gameIds)
+
     def writeGames(self, games: List[Game]):
         """
         Store games from lichess
         """
         self.env.gameDB.writeMany(games)
 
+    def playerById(self, playerId: PlayerID) -> Opt[Player]:
+        return self.env.playerDB.byId(playerId)
+
     def writePlayer(self, player: Player):
         """
         Upsert a new player to the db
         """
         self.env.playerDB.write(player)
+
+    def writePlayers(self, players: List[Player]):
+        self.env.playerDB.writeMany(players)
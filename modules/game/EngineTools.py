@@ -6,12 +6,15 @@ from modules.game.Game import Game
 from modules.game.Colour import Colour
 from modules.game.AnalysedGame import AnalysedGame
 from modules.game.EngineEval import EngineEval
-from modules.game.AnalysedPosition import AnalysedPosition, AnalysedPositionDB
+from modules.game.AnalysedPosition import AnalysedPosition, AnalysedPositionID, AnalysedPositionDB
 from modules.game.AnalysedMove import AnalysedMove, Analysis
 
 from modules.fishnet.fishnet import stockfish_command
 
-from chess.pgn import read_game
+from chess.pgn import read_game, GameNode
+from chess import Board
+
+import time
 
 from chess import uci
 from chess.uci import Engine
@@ -41,6 +44,52 @@ class EngineTools(NamedTuple('EngineTools', [
             infoHandler=infoHandler)
 
     def analyseGame(self, game: Game, colour: Colour, nodes: int) -> Opt[AnalysedGame]:
+        playerNodes = EngineTools.playerNodes(game, colour)
+        if playerNodes is None:
+            return None
+        analysedMoves = []
+
+        self.engine.ucinewgame()
+
+        for node, nextNode in playerNodes:
+            logging.info(f'analysing position\n{node.board()}\n')
+            analyses = self.analysePosition(node.board(), 5, nodes)
+            engineEval = self.analysePosition(nextNode.board(), 1, nodes)[0].engineEval.inverse() # flipped because analysing from other player side
+            analysedMoves.append(EngineTools.analysedMove(game, colour, node, analyses, engineEval))
+
+        playerId = game.white if colour else game.black
+        return AnalysedGame.new(game.id, colour, playerId, analysedMoves)
+
+    def analysePosition(self, board: Board, multipv: int, nodes: int) -> List[Analysis]:
+        """
+        the top `multipv` lines from board. Positions with no legal moves have
+        a single analysis with no move
+        """
+        self.engine.setoption({'multipv': multipv})
+        self.engine.position(board)
+        self.engine.go(nodes=nodes)
+
+        pvs = self.infoHandler.info['pv']
+        return [Analysis(
+                pvs[i][0].uci() if len(pvs.get(i, [])) > 0 else None,
+                EngineEval(score.cp, score.mate))
+            for i, score in sorted(self.infoHandler.info['score'].items())]
+
+    @staticmethod
+    def analysedMove(game: Game, colour: Colour, node: GameNode, analyses: List[Analysis], engineEval: EngineEval) -> AnalysedMove:
+        moveNumber = node.board().fullmove_number
+        return AnalysedMove(
+            uci = node.variation(0).move.uci(),
+            move = moveNumber,
+            emt = game.emts[EngineTools.ply(moveNumber, colour)],
+            engineEval = engineEval,
+            analyses = analyses)
+
+    @staticmethod
+    def playerNodes(game: Game, colour: Colour) -> Opt[List[Tuple[GameNode, GameNode]]]:
+        """
+        the nodes before and after each move by colour. None if the game can't be analysed
+        """
         gameLen = len(game.pgn)
         if gameLen < 40 or gameLen > 120:
             logging.warning(f'game too long/short to analyse ({gameLen} plys)')
@@ -48,7 +97,6 @@ class EngineTools(NamedTuple('EngineTools', [
         elif game.emts is None:
             logging.warning(f'game has no emts')
             return None
-        analysedMoves = []
 
         try:
             playableGame = read_game(StringIO(" ".join(game.pgn)))
@@ -61,45 +109,67 @@ class EngineTools(NamedTuple('EngineTools', [
             logging.warning(f"Not enough emts. len(emts): {len(game.emts)} vs len(node.main_line()): {len(mainline_moves)}")
             return None
 
-        self.engine.ucinewgame()
-
+        playerNodes = []
         while not node.is_end():
-            logging.info(f'analysing position\n{node.board()}\n')
             nextNode = node.variation(0)
             if colour == node.board().turn: ## if it is the turn of the player of interest
-                self.engine.setoption({'multipv': 5})
-                self.engine.position(node.board())
-                self.engine.go(nodes=nodes)
-
-                analyses = list([
-                    Analysis(
-                        pv[1][0].uci(),
-                        EngineEval(engineEval[1].cp, engineEval[1].mate)) for engineEval, pv in zip(
-                            self.infoHandler.info['score'].items(),
-                            self.infoHandler.info['pv'].items())])
-
-                self.engine.setoption({'multipv': 1})
-                self.engine.position(nextNode.board())
-                self.engine.go(nodes=nodes)
-
-                engineEval = EngineEval(
-                    self.infoHandler.info['score'][1].cp,
-                    self.infoHandler.info['score'][1].mate).inverse() # flipped because analysing from other player side
-
-                moveNumber = node.board().fullmove_number
-
-                analysedMoves.append(AnalysedMove(
-                    uci = node.variation(0).move.uci(),
-                    move = moveNumber,
-                    emt = game.emts[EngineTools.ply(moveNumber, colour)],
-                    engineEval = engineEval,
-                    analyses = analyses))
-
+                playerNodes.append((node, nextNode))
             node = nextNode
+        return playerNodes
+
+    @staticmethod
+    def positions(game: Game, colour: Colour) -> List[Tuple[AnalysedPositionID, Board, int]]:
+        """
+        the positions analyseGame searches for colour, with the multipv each is searched at.
+        The position before each move gets 5 lines, the position after it gets 1.
+        """
+        positions = []
+        for node, nextNode in (EngineTools.playerNodes(game, colour) or []):
+            for board, multipv in ((node.board(), 5), (nextNode.board(), 1)):
+                positions.append((AnalysedPosition.idFromBoard(board), board, multipv))
+        return positions
+
+    @staticmethod
+    def sufficient(analysedPosition: Opt[AnalysedPosition], board: Board, multipv: int) -> bool:
+        """does analysedPosition have as many lines as a search of board at multipv would give"""
+        if analysedPosition is None:
+            return False
+        return len(analysedPosition.analyses) >= max(1, min(multipv, board.legal_moves.count()))
+
+    @staticmethod
+    def assembleGame(game: Game, colour: Colour, analysedPositions: Dict[AnalysedPositionID, AnalysedPosition]) -> Opt[AnalysedGame]:
+        """
+        build the AnalysedGame that analyseGame would give from analysed positions.
+        None if any position is missing or the game can't be analysed.
+        """
+        playerNodes = EngineTools.playerNodes(game, colour)
+        if playerNodes is None:
+            return None
+
+        analysedMoves = []
+        for node, nextNode in playerNodes:
+            board, nextBoard = node.board(), nextNode.board()
+            before = analysedPositions.get(AnalysedPosition.idFromBoard(board))
+            after = analysedPositions.get(AnalysedPosition.idFromBoard(nextBoard))
+            if not (EngineTools.sufficient(before, board, 5) and EngineTools.sufficient(after, nextBoard, 1)):
+                return None
+            analysedMoves.append(EngineTools.analysedMove(game, colour, node, before.analyses[:5], after.analyses[0].engineEval.inverse()))
 
         playerId = game.white if colour else game.black
         return AnalysedGame.new(game.id, colour, playerId, analysedMoves)
 
+    def benchmark(self, nodes: int) -> int:
+        """
+        Measure the nodes per second of the engine by searching the start position.
+        """
+        self.engine.ucinewgame()
+        self.engine.setoption({'multipv': 1})
+        self.engine.position(Board())
+        start = time.time()
+        self.engine.go(nodes=nodes)
+        elapsed = time.time() - start
+        return int(nodes / elapsed) if elapsed > 0 else 0
+
     @staticmethod
     def ply(moveNumber, colour: Colour) -> int:
         return (2*(moveNumber-1)) + (0 if colour else 1)
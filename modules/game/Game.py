@@ -5,6 +5,7 @@ from modules.game.Player import PlayerID
 from modules.game.EngineEval import EngineEval, EngineEvalBSONHandler
 
 from pymongo.collection import Collection
+from pymongo import UpdateOne
 
 from multiprocessing import Pool
 
@@ -190,6 +191,14 @@ class GameDB(NamedTuple('GameDB', [
         return [self.byId(gid) for gid in ids]
         #return [GameBSONHandler.reads(g) for g in self.gameColl.find({'_id': {'$in': [i for i in ids]}})]
 
+    def byIdsUnordered(self, ids: List[GameID]) -> List[Game]:
+        """one query for all ids. Missing games are left out"""
+        return [GameBSONHandler.reads(g) for g in self.gameColl.find({'_id': {'$in': list(ids)}})]
+
+    def existingIds(self, ids: List[GameID]) -> List[GameID]:
+        """which of ids are already stored"""
+        return [bson['_id'] for bson in self.gameColl.find({'_id': {'$in': list(ids)}}, {'_id': 1})]
+
     def byPlayerId(self, playerId: PlayerID) -> List[Game]:
         return [GameBSONHandler.reads(g) for g in self.gameColl.find({"$or": [{"white": playerId}, {"black": playerId}]})]
 
@@ -200,4 +209,5 @@ class GameDB(NamedTuple('GameDB', [
         self.gameColl.update_one({'_id': game.id}, {'$set': GameBSONHandler.writes(game)}, upsert=True)
 
     def writeMany(self, games: List[Game]):
-        [self.write(g) for g in games]
+        if len(games) > 0:
+            self.gameColl.bulk_write([UpdateOne({'_id': g.id}, {'$set': GameBSONHandler.writes(g)}, upsert=True) for g in games], ordered=False)
@@ -79,4 +79,8 @@ class PlayerDB(NamedTuple('PlayerDB', [
         return [PlayerBSONHandler.reads(p) for p in self.playerColl.find({})]
 
     def write(self, player: Player):
-        self.playerColl.update_one({'_id': player.id}, {'$set': PlayerBSONHandler.writes(player)}, upsert=True)
\ No newline at end of file
+        self.playerColl.update_one({'_id': player.id}, {'$set': PlayerBSONHandler.writes(player)}, upsert=True)
+
+    def writeMany(self, players: List[Player]):
+        if len(players) > 0:
+            self.playerColl.bulk_write([pymongo.UpdateOne({'_id': p.id}, {'$set': PlayerBSONHandler.writes(p)}, upsert=True) for p in players], ordered=False)
\ No newline at end of file
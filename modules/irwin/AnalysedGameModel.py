@@ -10,12 +10,11 @@ from random import shuffle
 from math import ceil
 
 from modules.game.AnalysedGame import GameAnalysedGame
+from modules.irwin.InferenceBatcher import InferenceBatcher
+from modules.irwin.InferencePool import InferencePool
+from modules.irwin.ModelRegistry import ModelRegistry, modelRegistry
 
-from keras.models import load_model, Model
-from keras.layers import Dropout, Embedding, Reshape, Dense, LSTM, Input, concatenate, Conv1D, Flatten
-from keras.optimizers import Adam
-
-from keras.engine.training import Model
+from modules.irwin.NumpyModel import NumpyModel, Precision, npzPath, verify, allowedPrecision
 
 from numpy import ndarray
 
@@ -53,17 +52,58 @@ class AnalysedGamePrediction(NamedTuple('AnalysedGamePrediction', [
         return int(np.average([highest, topX, topY]))
 
 class AnalysedGameModel:
-    def __init__(self, config: ConfigWrapper, newmodel: bool = False):
+    fileKey = 'irwin model analysed file'
+    name = 'analysed'
+
+    def __init__(self, config: ConfigWrapper, newmodel: bool = False, runtime: Opt[str] = None, precision: Opt[Precision] = None):
+        """
+        runtime: 'keras', or 'numpy' to run the exported model without TensorFlow.
+        Defaults to 'irwin model runtime'. 'pool' runs it in InferencePool's worker processes
+        precision: of the numpy runtime's weights. Defaults to 'irwin model precision' if it has been calibrated
+        """
         self.config = config
+        self.runtime = runtime or config['irwin model runtime'] or 'keras'
+        self.precision = precision
         self.model = self.createModel(newmodel)
+        self.version = None if newmodel else self.modelVersion()
+        # pooled models can predict as many batches at once as there are workers
+        concurrency = InferencePool.size(config) if self.runtime == 'pool' else 1
+        self.batcher = InferenceBatcher.fromConfig(self.name, self.predictInputs, config, concurrency)
+
+    def modelVersion(self) -> Opt[str]:
+        """identifies the weights predictions are made with, for caching them. None if the model has no file"""
+        numpy = (self.model.runtime if self.runtime == 'pool' else self.runtime) == 'numpy'
+        version = ModelRegistry.version(npzPath(self.config[self.fileKey]) if numpy else self.config[self.fileKey])
+        if version is None:
+            return None
+        return f'{version}/{self.model.precision if numpy else "float32"}'
     
-    def createModel(self, newmodel: bool = False) -> Model:
-        if os.path.isfile(self.config["irwin model analysed file"]) and not newmodel:
+    def createModel(self, newmodel: bool = False):
+        if self.runtime == 'pool' and not newmodel:
+            return InferencePool.forModel(type(self), self.config, self.precision)
+
+        if self.runtime == 'numpy' and not newmodel:
+            logging.debug("opening exported model")
+            path = npzPath(self.config[self.fileKey])
+            precision = self.precision or allowedPrecision(path, self.config['irwin model precision'], self.config['irwin model precision_agreement'])
+            return NumpyModel.load(path, precision)
+
+        # keras is only imported by processes that use it
+        from keras.models import load_model
+
+        if os.path.isfile(self.config[self.fileKey]) and not newmodel:
             logging.debug("model already exists, opening from file")
-            m = load_model(self.config["irwin model analysed file"])
+            m = load_model(self.config[self.fileKey])
             m._make_predict_function()
             return m
         logging.debug('model does not exist, building from scratch')
+        return self.buildModel()
+
+    def buildModel(self):
+        from keras.models import Model
+        from keras.layers import Dropout, Embedding, Reshape, Dense, Input, concatenate, Conv1D, Flatten
+        from keras.optimizers import Adam
+
         inputGame = Input(shape=(60, 13), dtype='float32', name='game_input')
         pieceType = Input(shape=(60, 1), dtype='float32', name='piece_type')
 
@@ -88,23 +128,15 @@ class AnalysedGameModel:
         convNetOutput = Dense(16, activation='sigmoid')(dense5)
 
 
-        ### LSTM Block of Siamese Network
+        ### Sequence Block of Siamese Network
         # merge move stats with move options
         c1 = Conv1D(filters=128, kernel_size=5, name='conv1')(concats)
 
-        # analyse all the moves and come to a decision about the game
-        l1 = LSTM(128, return_sequences=True)(c1)
-        l2 = LSTM(128, return_sequences=True, activation='sigmoid')(l1)
-
-        c2 = Conv1D(filters=64, kernel_size=10, name='conv2')(l2)
-
-        l3 = LSTM(64, return_sequences=True)(c2)
-        l4 = LSTM(32, return_sequences=True, activation='sigmoid', name='position_words')(l3)
-        l5 = LSTM(32)(l4)
+        positionWords, l5 = self.sequenceBlock(c1)
         l6 = Dense(16, activation='sigmoid', name='game_word')(l5)
         d4 = Dropout(0.3)(l6)
 
-        s1 = Dense(16, activation='sigmoid')(l4)
+        s1 = Dense(16, activation='sigmoid')(positionWords)
         lstmMove = Dense(1, activation='sigmoid', name='lstm_move_output')(s1)
 
         # isolated consideration of move blocks
@@ -126,10 +158,75 @@ class AnalysedGameModel:
             metrics=['accuracy'])
         return model
 
-    def predict(self, gameAnalysedGames: List[GameAnalysedGame]) -> List[Opt[ndarray]]:
-        list_to_array = lambda l: None if l is None else [np.array([l[0]]), np.array([l[1]])]
-        arrs = ((list_to_array(ag.tensor()), ag.length()) for ag in gameAnalysedGames)
-        return [None if t is None else AnalysedGamePrediction.fromTensor(self.model.predict(t), l) for t, l in arrs]
+    def sequenceBlock(self, c1):
+        """
+        c1: (56, 128) move blocks
+        Returns position words, (47, 32) for the per move output, and a game vector of 32
+        """
+        from keras.layers import LSTM, Conv1D
+
+        # analyse all the moves and come to a decision about the game
+        l1 = LSTM(128, return_sequences=True)(c1)
+        l2 = LSTM(128, return_sequences=True, activation='sigmoid')(l1)
+
+        c2 = Conv1D(filters=64, kernel_size=10, name='conv2')(l2)
+
+        l3 = LSTM(64, return_sequences=True)(c2)
+        l4 = LSTM(32, return_sequences=True, activation='sigmoid', name='position_words')(l3)
+        l5 = LSTM(32)(l4)
+        return l4, l5
+
+    def predict(self, gameAnalysedGames: List[GameAnalysedGame]) -> List[Opt[AnalysedGamePrediction]]:
+        """
+        Predict many games with one model call per 'irwin model analysed predict_chunk' games (default 256),
+        which bounds the memory used by the stacked tensors.
+        Output is in input order, None where a game has no tensor.
+        """
+        chunk = self.config['irwin model analysed predict_chunk'] or 256
+        predictions = []
+        for i in range(0, len(gameAnalysedGames), chunk):
+            predictions.extend(self.predictChunk(gameAnalysedGames[i:i+chunk]))
+        return predictions
+
+    def predictChunk(self, gameAnalysedGames: List[GameAnalysedGame]) -> List[Opt[AnalysedGamePrediction]]:
+        tensors = [gag.tensor() for gag in gameAnalysedGames]
+        indexed = [(i, t) for i, t in enumerate(tensors) if t is not None]
+        predictions = len(tensors)*[None]
+        if len(indexed) > 0:
+            inputs = [np.array([t[0] for _, t in indexed]), np.array([t[1] for _, t in indexed])]
+            outputs = self.predictInputs(inputs) if self.batcher is None else self.batcher.predict(inputs)
+            for j, (i, _) in enumerate(indexed):
+                predictions[i] = AnalysedGamePrediction.fromTensor([o[j:j+1] for o in outputs], gameAnalysedGames[i].length())
+        return predictions
+
+    def predictInputs(self, inputs: List[ndarray]) -> List[ndarray]:
+        return self.model.predict(inputs, batch_size=len(inputs[0]))
+
+    @staticmethod
+    def randomInputs(amount: int) -> List[ndarray]:
+        return [
+            np.random.rand(amount, 60, 13).astype('float32'),
+            np.random.randint(0, 7, size=(amount, 60, 1)).astype('float32')]
+
+    def warm(self):
+        """run a prediction so the first real one doesn't pay for building the graph"""
+        self.predictInputs([np.zeros((1, 60, 13)), np.zeros((1, 60, 1))])
 
     def saveModel(self):
-        self.model.save(self.config["irwin model analysed file"])
\ No newline at end of file
+        self.model.save(self.config[self.fileKey])
+        try:
+            self.exportNumpy()
+        except (ValueError, NotImplementedError) as e:
+            logging.warning(f'model could not be exported for the numpy runtime: {e}')
+        ModelRegistry.stamp(self.config[self.fileKey])
+        self.version = self.modelVersion()
+        modelRegistry.saved(self)
+
+    def exportNumpy(self) -> float:
+        """
+        write the model for the numpy runtime, and check it against keras.
+        Returns the largest difference in output
+        """
+        path = npzPath(self.config[self.fileKey])
+        NumpyModel.export(self.model, path)
+        return verify(self.model, NumpyModel.load(path), AnalysedGameModel.randomInputs(64))
\ No newline at end of file
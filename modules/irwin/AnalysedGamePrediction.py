@@ -0,0 +1,54 @@
+"""Stored analysed game model predictions, so reports only run the model on games it hasn't seen"""
+from default_imports import *
+
+from modules.game.AnalysedGame import AnalysedGame, AnalysedGameID, AnalysedGameBSONHandler
+from modules.irwin.AnalysedGameModel import AnalysedGamePrediction
+
+import hashlib
+import json
+import pymongo
+from pymongo.collection import Collection
+
+class AnalysedGamePredictionBSONHandler:
+    @staticmethod
+    def reads(bson: Dict) -> AnalysedGamePrediction:
+        return AnalysedGamePrediction(
+            game = bson['game'],
+            lstmMoves = bson['lstmMoves'],
+            isolatedMoves = bson['isolatedMoves'])
+
+    @staticmethod
+    def digest(analysedGame: AnalysedGame) -> str:
+        """identifies the analysis of analysedGame, which changes if the game is analysed again"""
+        analysis = AnalysedGameBSONHandler.writes(analysedGame)['analysis']
+        return hashlib.sha1(json.dumps(analysis, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def writes(analysedGame: AnalysedGame, version: str, analysedGamePrediction: AnalysedGamePrediction) -> Dict:
+        return {
+            '_id': analysedGame.id,
+            'version': version, # AnalysedGameModel.version the prediction was made with
+            'digest': AnalysedGamePredictionBSONHandler.digest(analysedGame),
+            'game': analysedGamePrediction.game,
+            'lstmMoves': analysedGamePrediction.lstmMoves,
+            'isolatedMoves': analysedGamePrediction.isolatedMoves
+        }
+
+class AnalysedGamePredictionDB(NamedTuple('AnalysedGamePredictionDB', [
+        ('analysedGamePredictionColl', Collection)
+    ])):
+    """
+    one prediction per analysed game, for the model version and the analysis it was made from.
+    A prediction goes out of date with the model, or when the game is analysed again and
+    AnalysedGameDB.write replaces its moves, and is overwritten then.
+    """
+    def byAnalysedGames(self, analysedGames: List[AnalysedGame], version: str) -> Dict[AnalysedGameID, AnalysedGamePrediction]:
+        """the stored predictions of analysedGames that are still current"""
+        digests = {ag.id: AnalysedGamePredictionBSONHandler.digest(ag) for ag in analysedGames}
+        return {bson['_id']: AnalysedGamePredictionBSONHandler.reads(bson) for bson in self.analysedGamePredictionColl.find(
+            {'_id': {'$in': list(digests)}, 'version': version}) if bson.get('digest') == digests[bson['_id']]}
+
+    def writeMany(self, version: str, gamesAndPredictions: List[Tuple[AnalysedGame, AnalysedGamePrediction]]):
+        if len(gamesAndPredictions) > 0:
+            self.analysedGamePredictionColl.bulk_write([pymongo.ReplaceOne(
+                {'_id': ag.id}, AnalysedGamePredictionBSONHandler.writes(ag, version, agp), upsert=True) for ag, agp in gamesAndPredictions], ordered=False)
@@ -299,6 +299,14 @@ class PlayerReportDB(namedtuple('PlayerReportDB', ['playerReportColl'])):
             return None
         return datetime.now() - report.date
 
+    def newestDates(self, userIds):
+        """date of the newest report for each of userIds that has one"""
+        pipeline = [
+            {'$match': {'userId': {'$in': list(userIds)}}},
+            {'$group': {'_id': '$userId', 'date': {'$max': '$date'}}}
+        ]
+        return {bson['_id']: bson['date'] for bson in self.playerReportColl.aggregate(pipeline)}
+
 class GameReportDB(namedtuple('GameReportDB', ['gameReportColl'])):
     def byId(self, id):
         bson = self.gameReportColl.find_one({'_id': id})
@@ -12,26 +12,66 @@ from collections import namedtuple
 
 from modules.game.Player import PlayerID
 from modules.game.Game import Game
+from modules.irwin.InferenceBatcher import InferenceBatcher
+from modules.irwin.InferencePool import InferencePool
+from modules.irwin.ModelRegistry import ModelRegistry, modelRegistry
 
-from keras.models import load_model, Model
-from keras.layers import Dropout, Embedding, Reshape, Flatten, Dense, LSTM, Input, concatenate, Conv1D
-from keras.optimizers import Adam
-from keras.callbacks import TensorBoard
+from modules.irwin.NumpyModel import NumpyModel, Precision, npzPath, verify, allowedPrecision
 
 from functools import lru_cache
 
 class BasicGameModel:
-    def __init__(self, config: ConfigWrapper, newmodel: bool = False):
+    fileKey = 'irwin model basic file'
+    name = 'basic'
+
+    def __init__(self, config: ConfigWrapper, newmodel: bool = False, runtime: Opt[str] = None, precision: Opt[Precision] = None):
+        """
+        runtime: 'keras', or 'numpy' to run the exported model without TensorFlow.
+        Defaults to 'irwin model runtime'. 'pool' runs it in InferencePool's worker processes
+        precision: of the numpy runtime's weights. Defaults to 'irwin model precision' if it has been calibrated
+        """
         self.config = config
+        self.runtime = runtime or config['irwin model runtime'] or 'keras'
+        self.precision = precision
         self.model = self.createModel(newmodel)
+        self.version = None if newmodel else self.modelVersion()
+        # pooled models can predict as many batches at once as there are workers
+        concurrency = InferencePool.size(config) if self.runtime == 'pool' else 1
+        self.batcher = InferenceBatcher.fromConfig(self.name, self.predictInputs, config, concurrency)
+
+    def modelVersion(self) -> Opt[str]:
+        """identifies the weights predictions are made with, for caching them. None if the model has no file"""
+        numpy = (self.model.runtime if self.runtime == 'pool' else self.runtime) == 'numpy'
+        version = ModelRegistry.version(npzPath(self.config[self.fileKey]) if numpy else self.config[self.fileKey])
+        if version is None:
+            return None
+        return f'{version}/{self.model.precision if numpy else "float32"}'
 
     def createModel(self, newmodel: bool = False):
-        if os.path.isfile(self.config["irwin model basic file"]) and not newmodel:
+        if self.runtime == 'pool' and not newmodel:
+            return InferencePool.forModel(type(self), self.config, self.precision)
+
+        if self.runtime == 'numpy' and not newmodel:
+            logging.debug("opening exported model")
+            path = npzPath(self.config[self.fileKey])
+            precision = self.precision or allowedPrecision(path, self.config['irwin model precision'], self.config['irwin model precision_agreement'])
+            return NumpyModel.load(path, precision)
+
+        # keras is only imported by processes that use it
+        from keras.models import load_model
+
+        if os.path.isfile(self.config[self.fileKey]) and not newmodel:
             logging.debug("model already exists, opening from file")
-            m = load_model(self.config["irwin model basic file"])
+            m = load_model(self.config[self.fileKey])
             m._make_predict_function()
             return m
         logging.debug('model does not exist, building from scratch')
+        return self.buildModel()
+
+    def buildModel(self):
+        from keras.models import Model
+        from keras.layers import Dropout, Embedding, Reshape, Flatten, Dense, LSTM, Input, concatenate, Conv1D
+        from keras.optimizers import Adam
 
         moveStatsInput = Input(shape=(60, 8), dtype='float32', name='move_input')
         pieceType = Input(shape=(60, 1), dtype='float32', name='piece_type')
@@ -82,10 +122,60 @@ class BasicGameModel:
             metrics=['accuracy'])
         return model
 
-    def predict(self, playerId: PlayerID, games: List[Game]) -> Opt[int]:
-        tensors = [game.tensor(playerId) for game in games]
-        return [None if t is None else int(100*self.model.predict([np.array([t[0]]),np.array([t[1]])])[0][0]) for t in tensors]
+    def predict(self, playerId: PlayerID, games: List[Game]) -> List[Opt[int]]:
+        return self.predictMany([(playerId, game) for game in games])
+
+    def predictMany(self, playerIdsAndGames: List[Tuple[PlayerID, Game]]) -> List[Opt[int]]:
+        """
+        Predict games of many players with a single call to the model,
+        which runs in batches of 'irwin model basic predict_batch'.
+        Output is in input order, None where a game has no tensor.
+        """
+        tensors = [game.tensor(playerId) for playerId, game in playerIdsAndGames]
+        indexed = [(i, t) for i, t in enumerate(tensors) if t is not None]
+        predictions = len(tensors)*[None]
+        if len(indexed) > 0:
+            outputs = self.predictTensors(
+                np.array([t[0] for _, t in indexed]),
+                np.array([t[1] for _, t in indexed]))
+            for (i, _), output in zip(indexed, outputs):
+                predictions[i] = int(100*output[0])
+        return predictions
+
+    def predictTensors(self, moveStats: np.ndarray, pieceTypes: np.ndarray) -> np.ndarray:
+        if self.batcher is not None:
+            return self.batcher.predict([moveStats, pieceTypes])[0]
+        return self.predictInputs([moveStats, pieceTypes])
+
+    def predictInputs(self, inputs: List[np.ndarray]) -> np.ndarray:
+        return self.model.predict(inputs, batch_size=self.config['irwin model basic predict_batch'])
+
+    @staticmethod
+    def randomInputs(amount: int) -> List[np.ndarray]:
+        return [
+            np.random.rand(amount, 60, 8).astype('float32'),
+            np.random.randint(0, 7, size=(amount, 60, 1)).astype('float32')]
+
+    def warm(self):
+        """run a prediction so the first real one doesn't pay for building the graph"""
+        self.predictInputs([np.zeros((1, 60, 8)), np.zeros((1, 60, 1))])
 
     def saveModel(self):
         logging.debug("saving model")
-        self.model.save(self.config["irwin model basic file"])
\ No newline at end of file
+        self.model.save(self.config[self.fileKey])
+        try:
+            self.exportNumpy()
+        except (ValueError, NotImplementedError) as e:
+            logging.warning(f'model could not be exported for the numpy runtime: {e}')
+        ModelRegistry.stamp(self.config[self.fileKey])
+        self.version = self.modelVersion()
+        modelRegistry.saved(self)
+
+    def exportNumpy(self) -> float:
+        """
+        write the model for the numpy runtime, and check it against keras.
+        Returns the largest difference in output
+        """
+        path = npzPath(self.config[self.fileKey])
+        NumpyModel.export(self.model, path)
+        return verify(self.model, NumpyModel.load(path), BasicGameModel.randomInputs(64))
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""Cache of basic game model scores, so games seen in earlier requests are not scored again"""
+from default_imports import *
+
+from modules.game.Game import GameID, PlayerID
+
+import pymongo
+from pymongo.collection import Collection
+
+BasicGamePredictionID = NewType('BasicGamePredictionID', str)
+
+class BasicGamePrediction(NamedTuple('BasicGamePrediction', [
+        ('id', BasicGamePredictionID),
+        ('gameId', GameID),
+        ('playerId', PlayerID),
+        ('version', str), # BasicGameModel.version the prediction was made with
+        ('prediction', int)
+    ])):
+    @staticmethod
+    def new(gameId: GameID, playerId: PlayerID, version: str, prediction: int):
+        return BasicGamePrediction(
+            id = BasicGamePrediction.makeId(gameId, playerId),
+            gameId = gameId,
+            playerId = playerId,
+            version = version,
+            prediction = prediction)
+
+    @staticmethod
+    def makeId(gameId: GameID, playerId: PlayerID) -> BasicGamePredictionID:
+        return gameId + '/' + playerId
+
+class BasicGamePredictionBSONHandler:
+    @staticmethod
+    def reads(bson: Dict) -> BasicGamePrediction:
+        return BasicGamePrediction(
+            id = bson['_id'],
+            gameId = bson['gameId'],
+            playerId = bson['userId'],
+            version = bson['version'],
+            prediction = bson['prediction'])
+
+    @staticmethod
+    def writes(bgp: BasicGamePrediction) -> Dict:
+        return {
+            '_id': bgp.id,
+            'gameId': bgp.gameId,
+            'userId': bgp.playerId,
+            'version': bgp.version,
+            'prediction': bgp.prediction
+        }
+
+class BasicGamePredictionDB(NamedTuple('BasicGamePredictionDB', [
+        ('basicGamePredictionColl', Collection)
+    ])):
+    """one prediction per game and player. Predictions from an older model version are overwritten"""
+    def byIds(self, ids: List[BasicGamePredictionID], version: str) -> Dict[BasicGamePredictionID, int]:
+        return {bson['_id']: bson['prediction'] for bson in self.basicGamePredictionColl.find(
+            {'_id': {'$in': list(ids)}, 'version': version}, {'prediction': 1})}
+
+    def writeMany(self, bgps: List[BasicGamePrediction]):
+        if len(bgps) > 0:
+            self.basicGamePredictionColl.bulk_write([pymongo.ReplaceOne(
+                {'_id': bgp.id}, BasicGamePredictionBSONHandler.writes(bgp), upsert=True) for bgp in bgps], ordered=False)
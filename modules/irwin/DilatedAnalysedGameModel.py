@@ -0,0 +1,39 @@
+from default_imports import *
+
+from conf.ConfigWrapper import ConfigWrapper
+
+from modules.irwin.AnalysedGameModel import AnalysedGameModel
+
+class DilatedAnalysedGameModel(AnalysedGameModel):
+    """
+    AnalysedGameModel with its stack of LSTMs replaced by dilated convolutions, which run every
+    move at once instead of one after another. Inputs and outputs are the same as AnalysedGameModel's.
+    Used in its place when 'irwin model analysed architecture' is 'dilated'.
+    """
+    fileKey = 'irwin model analysed_dilated file'
+    name = 'analysed_dilated'
+
+    def modelVersion(self) -> Opt[str]:
+        """prefixed, so stored predictions from the two architectures are never mistaken for each other"""
+        version = super().modelVersion()
+        return None if version is None else f'{self.name}/{version}'
+
+    def sequenceBlock(self, c1):
+        from keras.layers import Conv1D, Dense, Flatten
+
+        # causal, so each move only sees the moves before it, as it did through the LSTMs.
+        # The receptive field doubles with each layer and covers 31 moves after the fourth
+        d1 = Conv1D(filters=64, kernel_size=3, dilation_rate=1, padding='causal', activation='relu')(c1)
+        d2 = Conv1D(filters=64, kernel_size=3, dilation_rate=2, padding='causal', activation='relu')(d1)
+        d3 = Conv1D(filters=64, kernel_size=3, dilation_rate=4, padding='causal', activation='relu')(d2)
+        d4 = Conv1D(filters=64, kernel_size=3, dilation_rate=8, padding='causal', activation='relu')(d3)
+
+        c2 = Conv1D(filters=64, kernel_size=10, name='conv2')(d4)
+
+        positionWords = Conv1D(filters=32, kernel_size=3, dilation_rate=16, padding='causal', activation='sigmoid', name='position_words')(c2)
+        gameVector = Dense(32, activation='relu')(Flatten()(positionWords))
+        return positionWords, gameVector
+
+def analysedGameModelClass(config: ConfigWrapper) -> type:
+    """the architecture selected by 'irwin model analysed architecture', 'lstm' (the default) or 'dilated'"""
+    return DilatedAnalysedGameModel if config['irwin model analysed architecture'] == 'dilated' else AnalysedGameModel
@@ -11,6 +11,10 @@ from modules.game.AnalysedGame import AnalysedGameDB
 from modules.irwin.training.BasicGameActivation import BasicGameActivationDB
 from modules.irwin.training.AnalysedGameActivation import AnalysedGameActivationDB
 
+from modules.irwin.PlayerReport import PlayerReportDB
+from modules.irwin.BasicGamePrediction import BasicGamePredictionDB
+from modules.irwin.AnalysedGamePrediction import AnalysedGamePredictionDB
+
 class Env:
     def __init__(self, config: ConfigWrapper, db: Database):
         self.config = config
@@ -20,4 +24,7 @@ class Env:
         self.playerDB = PlayerDB(db[self.config["game coll player"]])
         self.analysedGameDB = AnalysedGameDB(db[self.config["game coll analysed_game"]])
         self.analysedGameActivationDB = AnalysedGameActivationDB(db[self.config["irwin coll analysed_game_activation"]])
-        self.basicGameActivationDB = BasicGameActivationDB(db[self.config["irwin coll basic_game_activation"]])
\ No newline at end of file
+        self.basicGameActivationDB = BasicGameActivationDB(db[self.config["irwin coll basic_game_activation"]])
+        self.playerReportDB = PlayerReportDB(db[self.config["irwin coll player_report"]])
+        self.basicGamePredictionDB = BasicGamePredictionDB(db[self.config["irwin coll basic_game_prediction"]])
+        self.analysedGamePredictionDB = AnalysedGamePredictionDB(db[self.config["irwin coll analysed_game_prediction"]])
@@ -0,0 +1,137 @@
+"""Combines model predictions from concurrent callers into larger batches"""
+from default_imports import *
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+import queue
+import threading
+import time
+
+import numpy as np
+
+Inputs = List[np.ndarray] # one array per model input, first axis is the game
+
+class Histogram:
+    """counts of observations at or below each bucket bound"""
+    def __init__(self, bounds: List[Number]):
+        self.bounds = sorted(bounds)
+        self.counts = (len(self.bounds) + 1)*[0] # the last bucket is everything above the bounds
+        self.count = 0
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: Number):
+        with self.lock:
+            self.counts[next((i for i, b in enumerate(self.bounds) if value <= b), len(self.bounds))] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'buckets': {**{str(b): c for b, c in zip(self.bounds, self.counts)}, '+Inf': self.counts[-1]},
+                'count': self.count,
+                'sum': self.sum
+            }
+
+class InferenceBatcher:
+    """
+    Callers block in predict while their inputs are queued. A single thread takes everything
+    that arrives within `wait` seconds of the first request, up to `maxBatch` games,
+    makes one call to predictFn and hands each caller back its rows of the outputs.
+    Up to `concurrency` batches are predicted at once, for predictFns that can run in parallel.
+    """
+    def __init__(self, name: str, predictFn: Callable[[Inputs], List[np.ndarray]], wait: float, maxBatch: int, concurrency: int = 1):
+        self.name = name
+        self.predictFn = predictFn
+        self.wait = wait
+        self.maxBatch = maxBatch
+        self.slots = threading.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.latency = Histogram([0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]) # seconds
+        self.batchSize = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096]) # games
+
+    @staticmethod
+    def fromConfig(name: str, predictFn: Callable[[Inputs], List[np.ndarray]], config: 'ConfigWrapper', concurrency: int = 1) -> Opt['InferenceBatcher']:
+        """a batcher set up from 'irwin inference', or None if batch_wait is 0 and batching is off"""
+        wait = config['irwin inference batch_wait'] or 0 # milliseconds
+        if wait <= 0:
+            return None
+        return InferenceBatcher(name, predictFn, wait/1000, config['irwin inference max_batch'] or 256, concurrency)
+
+    def predict(self, inputs: Inputs) -> List[np.ndarray]:
+        """the outputs of the model for inputs, as if predictFn had been called directly"""
+        self.start()
+        future = Future()
+        self.requests.put((inputs, future, time.time()))
+        return future.result()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=f'InferenceBatcher {self.name}', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.slots.acquire() # released once the batch is predicted
+            batch = []
+            try:
+                self.collect(batch)
+            except Exception as e: # fail the callers, the thread carries on for everyone else
+                logging.exception(f'InferenceBatcher {self.name} failed to batch {len(batch)} requests')
+                self.slots.release()
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+    def collect(self, batch: List[Tuple[Inputs, Future, float]]):
+        """fill batch with requests and submit it. Requests are added to batch as they are taken"""
+        batch.append(self.requests.get())
+        games = len(batch[0][0][0])
+        deadline = time.time() + self.wait
+        while games < self.maxBatch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            games += len(request[0][0])
+        self.executor.submit(self.runBatch, batch, games)
+
+    def runBatch(self, batch: List[Tuple[Inputs, Future, float]], games: int):
+        try:
+            self.predictBatch(batch, games)
+        finally:
+            self.slots.release()
+
+    def predictBatch(self, batch: List[Tuple[Inputs, Future, float]], games: int):
+        try:
+            inputs = [np.concatenate([request[0][k] for request in batch]) for k in range(len(batch[0][0]))]
+            outputs = self.predictFn(inputs)
+            if not isinstance(outputs, list): # single output models
+                outputs = [outputs]
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.batchSize.observe(games)
+        offset = 0
+        for requestInputs, future, submitted in batch:
+            size = len(requestInputs[0])
+            future.set_result([o[offset:offset+size] for o in outputs])
+            offset += size
+            self.latency.observe(time.time() - submitted)
+
+    def stats(self) -> Dict:
+        return {
+            'latency': self.latency.snapshot(),
+            'batchSize': self.batchSize.snapshot(),
+            'queued': self.requests.qsize()
+        }
@@ -0,0 +1,282 @@
+"""Runs model inference in worker processes, each pinned to its own cores"""
+from default_imports import *
+
+from concurrent.futures import Future, TimeoutError
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+import numpy as np
+
+from modules.irwin.NumpyModel import Precision, npzPath, allowedPrecision
+
+# read by OpenMP, MKL and OpenBLAS when they are loaded
+threadVariables = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+def limitThreads(runtime: str, threads: int, interThreads: int = 1):
+    """
+    set the threads inference may use in this process. Must be called before the model is loaded,
+    and for the numpy runtime before numpy is first used to take effect on BLAS
+    """
+    for variable in threadVariables:
+        os.environ[variable] = str(threads)
+    if runtime == 'keras':
+        import tensorflow as tf
+        from keras import backend as K
+        K.set_session(tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=threads,
+            inter_op_parallelism_threads=interThreads)))
+
+def modelPath(modelClass: type, config: 'ConfigWrapper', runtime: str) -> str:
+    """the file runtime loads modelClass from"""
+    return config[modelClass.fileKey] if runtime == 'keras' else npzPath(config[modelClass.fileKey])
+
+def work(modelClass: type, config: 'ConfigWrapper', runtime: str, precision: Opt[Precision], cores: List[int], threads: int, interThreads: int,
+        requests: multiprocessing.Queue, results: multiprocessing.Queue, supervisor: int):
+    """
+    main of a worker process: load the model, then predict requests until None is received.
+    The model is loaded again before a request once its file has a new version.
+    Exits if the supervisor has gone
+    """
+    from modules.irwin.ModelRegistry import ModelRegistry
+    if len(cores) > 0 and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    limitThreads(runtime, threads, interThreads)
+    path = modelPath(modelClass, config, runtime)
+    version, model = ModelRegistry.version(path), modelClass(config, runtime=runtime, precision=precision)
+    failed = None
+    while os.getppid() == supervisor:
+        try:
+            request = requests.get(timeout=5)
+        except queue.Empty:
+            continue
+        if request is None:
+            return
+        latest = ModelRegistry.version(path)
+        if latest not in (version, failed, None):
+            try:
+                version, model = latest, modelClass(config, runtime=runtime, precision=precision)
+            except Exception as e: # keep predicting with the model that loaded
+                failed = latest
+                logging.warning(f'inference worker failed to load version {latest} of {path}, keeping {version}: {e}')
+        requestId, inputs = request
+        try:
+            results.put((requestId, model.predictInputs(inputs), None))
+        except Exception as e: # returned to the caller, the worker carries on
+            results.put((requestId, None, f'{type(e).__name__}: {e}'))
+
+def supervise(workerArgs: Tuple, coreSets: List[List[int]], threads: Opt[int], interThreads: int,
+        stopping: multiprocessing.Event, deaths: multiprocessing.Value, parent: int):
+    """
+    main of the supervisor process. It forks the workers and forks replacements for those that die,
+    so the serving process only forks once, before it has started any threads. deaths is counted
+    for the serving process, which fails the requests a dead worker may have taken
+    """
+    workers = {} # pid -> index
+
+    def startWorker(index: int):
+        cores = coreSets[index]
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                work(*workerArgs, cores, threads or max(1, len(cores)), interThreads, os.getppid())
+            except BaseException:
+                logging.exception('inference worker failed')
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = index
+        logging.info(f'started inference worker {index} ({pid}) on cores {cores} with {threads or max(1, len(cores))} threads')
+
+    for index in range(len(coreSets)):
+        startWorker(index)
+    while len(workers) > 0:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if os.getppid() != parent: # the serving process is gone
+                for pid in workers:
+                    os.kill(pid, signal.SIGTERM)
+                return
+            time.sleep(1)
+            continue
+        index = workers.pop(pid, None)
+        if index is None or stopping.is_set():
+            continue
+        logging.error(f'inference worker {index} ({pid}) died with status {status}. Restarting it')
+        with deaths.get_lock():
+            deaths.value += 1
+        startWorker(index)
+
+class InferencePool:
+    """
+    Stands in for a keras or numpy model in a serving process when 'irwin inference workers' is set.
+    predict is sent to one of the workers, which has the model loaded with the configured runtime
+    and loads new versions of it by itself.
+    Pools are forked by InferencePool.prefork when the serving process starts, before it has any threads,
+    as forking a process with running threads can deadlock the child on a lock held at the time.
+    Each pool forks a supervisor, which forks the workers and replaces any that die.
+    Available cores, less the first 'irwin inference reserved_cores' which are left to the web tier,
+    are split evenly between the workers. Each worker runs inference with as many threads as it has cores,
+    or 'irwin inference worker_threads'. numpy is already loaded when workers are forked, so the BLAS threads
+    of the numpy runtime are set by the environment the server is started with.
+    A request not answered within 'irwin inference timeout' seconds (default 60) raises TimeoutError.
+    """
+    pools = {} # (class name, path, precision) -> InferencePool
+
+    def __init__(self, modelClass: type, config: 'ConfigWrapper', runtime: str, precision: Opt[Precision]):
+        self.modelClass = modelClass
+        self.config = config
+        self.runtime = runtime
+        self.requested = precision
+        self.path = modelPath(modelClass, config, runtime)
+        self.workers = InferencePool.size(config)
+        self.timeout = config['irwin inference timeout'] or 60
+        self.closed = False
+        self.collector = None
+        self.pending = {} # request id -> Future
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(modelClass: type, config: 'ConfigWrapper', precision: Opt[Precision] = None) -> Tuple:
+        return (modelClass.__name__, modelPath(modelClass, config, config['irwin model runtime'] or 'keras'), precision)
+
+    @staticmethod
+    def prefork(config: 'ConfigWrapper', modelClasses: List[type]):
+        """
+        start a pool for each of modelClasses, with 'irwin model runtime'. Must be called as the
+        serving process starts, before anything starts a thread. Does nothing if 'irwin inference workers' is 0
+        """
+        if InferencePool.size(config) == 0:
+            return
+        if threading.active_count() > 1:
+            logging.warning(f'forking inference workers with {threading.active_count()} threads running')
+        for modelClass in modelClasses:
+            key = InferencePool.key(modelClass, config)
+            if key not in InferencePool.pools:
+                pool = InferencePool(modelClass, config, config['irwin model runtime'] or 'keras', None)
+                pool.start()
+                InferencePool.pools[key] = pool
+                atexit.register(pool.close, 0)
+
+    @staticmethod
+    def preforked(modelClass: type, config: 'ConfigWrapper', precision: Opt[Precision] = None) -> bool:
+        return InferencePool.key(modelClass, config, precision) in InferencePool.pools
+
+    @staticmethod
+    def forModel(modelClass: type, config: 'ConfigWrapper', precision: Opt[Precision] = None):
+        """the pool started for modelClass by prefork"""
+        try:
+            return InferencePool.pools[InferencePool.key(modelClass, config, precision)]
+        except KeyError:
+            raise RuntimeError(f'no inference pool was started for {modelClass.__name__}. Call InferencePool.prefork when the process starts')
+
+    @staticmethod
+    def size(config: 'ConfigWrapper') -> int:
+        """number of worker processes. 0 if models are run in the serving process"""
+        return config['irwin inference workers'] or 0
+
+    @property
+    def precision(self) -> Precision:
+        """the precision workers load the current export at"""
+        if self.runtime != 'numpy':
+            return 'float32'
+        return self.requested or allowedPrecision(self.path, self.config['irwin model precision'], self.config['irwin model precision_agreement'])
+
+    def coreSets(self) -> List[List[int]]:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        cores = cores[self.config['irwin inference reserved_cores'] or 0:]
+        if len(cores) < self.workers:
+            logging.warning(f'{len(cores)} cores for {self.workers} inference workers. Workers are not pinned')
+            return self.workers*[[]]
+        per = len(cores) // self.workers
+        return [cores[i*per:(i+1)*per] for i in range(self.workers)]
+
+    def start(self):
+        """fork the supervisor. Queues only start their feeder threads once used, so none are running yet"""
+        # fork, as the serving scripts can't be imported again by spawned processes
+        context = multiprocessing.get_context('fork')
+        self.requests, self.results = context.Queue(), context.Queue()
+        self.stopping = context.Event()
+        self.deaths = context.Value('i', 0)
+        workerArgs = (self.modelClass, self.config, self.runtime, self.requested, self.requests, self.results)
+        self.supervisor = context.Process(
+            target=supervise,
+            args=(workerArgs, self.coreSets(), self.config['irwin inference worker_threads'],
+                self.config['irwin inference inter_op_threads'] or 1, self.stopping, self.deaths, os.getpid()),
+            name=f'InferencePool {self.modelClass.__name__}',
+            daemon=True)
+        self.supervisor.start()
+
+    def predict(self, inputs: List[np.ndarray], batch_size: Opt[int] = None):
+        """as the model's predictInputs, which sets the batch size in the worker"""
+        if self.closed:
+            raise RuntimeError(f'inference pool {self.modelClass.__name__} is closed')
+        self.startCollector()
+        future = Future()
+        requestId = next(self.ids)
+        with self.lock:
+            self.pending[requestId] = future
+        self.requests.put((requestId, inputs))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self.lock:
+                self.pending.pop(requestId, None)
+            raise
+
+    def startCollector(self):
+        with self.lock:
+            if self.collector is None:
+                self.collector = threading.Thread(target=self.collect, name=f'InferencePool {self.modelClass.__name__}', daemon=True)
+                self.collector.start()
+
+    def collect(self):
+        """
+        hand results back to callers. The requests a dead worker had taken are lost, and can't be told
+        apart from those of other workers, so when one dies everything pending is failed for callers to retry
+        """
+        deaths = self.deaths.value
+        while not self.closed:
+            if self.deaths.value != deaths:
+                deaths = self.deaths.value
+                self.failPending(RuntimeError('inference worker died'))
+            try:
+                requestId, outputs, error = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self.lock:
+                future = self.pending.pop(requestId, None)
+            if future is None: # timed out or failed already
+                continue
+            if error is None:
+                future.set_result(outputs)
+            else:
+                future.set_exception(RuntimeError(f'inference worker failed: {error}'))
+
+    def failPending(self, error: Exception):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def close(self, grace: Number = 60):
+        """stop the workers once requests already made have had `grace` seconds to finish. Requests still pending then fail"""
+        def stop():
+            if self.closed:
+                return
+            self.closed = True
+            self.stopping.set()
+            for _ in range(self.workers):
+                self.requests.put(None)
+            self.failPending(RuntimeError(f'inference pool {self.modelClass.__name__} closed'))
+        if grace > 0:
+            threading.Timer(grace, stop).start()
+        else:
+            stop()
@@ -2,12 +2,17 @@ from default_imports import *
 
 from modules.auth.Auth import AuthID
 
-from modules.game.Player import Player
-from modules.game.AnalysedGame import GameAnalysedGame
+from modules.game.Player import Player, PlayerID
+from modules.game.Game import Game
+from modules.game.AnalysedGame import AnalysedGame, GameAnalysedGame
 
 from modules.irwin.PlayerReport import PlayerReport
-from modules.irwin.AnalysedGameModel import AnalysedGameModel
+from modules.irwin.AnalysedGameModel import AnalysedGameModel, AnalysedGamePrediction
+from modules.irwin.DilatedAnalysedGameModel import analysedGameModelClass
 from modules.irwin.BasicGameModel import BasicGameModel
+from modules.irwin.BasicGamePrediction import BasicGamePrediction
+from modules.irwin.TriageModel import TriageModel
+from modules.irwin.ModelRegistry import modelRegistry
 
 from modules.irwin.Env import Env
 
@@ -23,13 +28,98 @@ class Irwin:
     def __init__(self, env: Env, newmodel: bool = False):
         logging.debug('creating irwin instance')
         self.env = env
-        self.basicGameModel = BasicGameModel(env.config)
-        self.analysedGameModel = AnalysedGameModel(env.config)
         self.training = Training(env, newmodel)
         self.evaluation = Evaluation(self, self.env.config)
 
-    def createReport(self, player: Player, gameAnalysedGames: List[GameAnalysedGame], owner: AuthID = 'test'):
-        predictions = self.analysedGameModel.predict(gameAnalysedGames)
-        playerReport = PlayerReport.new(player, [(ag, p) for ag, p in zip(gameAnalysedGames, predictions) if p is not None], owner)
+    @property
+    def basicGameModel(self) -> BasicGameModel:
+        return modelRegistry.get(BasicGameModel, self.env.config)
 
-        return playerReport
\ No newline at end of file
+    @property
+    def analysedGameModel(self) -> AnalysedGameModel:
+        return modelRegistry.get(analysedGameModelClass(self.env.config), self.env.config)
+
+    @property
+    def triageModel(self) -> TriageModel:
+        return modelRegistry.get(TriageModel, self.env.config)
+
+    @staticmethod
+    def basicModelClass(config) -> type:
+        """the model basicPredictions uses. TriageModel if 'irwin model triage enabled' is set, BasicGameModel if it or its section is missing"""
+        return TriageModel if config['irwin model triage enabled'] is True else BasicGameModel
+
+    def basicPredictions(self, playerIdsAndGames: List[Tuple[PlayerID, Game]]) -> List[Opt[int]]:
+        """
+        basicGameModel.predictMany, reusing scores cached for the current model version.
+        Only the games without one are run through the model, and their scores are cached.
+        The triage model is used instead if 'irwin model triage enabled' is set.
+        """
+        model = modelRegistry.get(Irwin.basicModelClass(self.env.config), self.env.config)
+        if model.version is None: # a model that hasn't been saved
+            return model.predictMany(playerIdsAndGames)
+
+        ids = [BasicGamePrediction.makeId(game.id, playerId) for playerId, game in playerIdsAndGames]
+        cached = self.env.basicGamePredictionDB.byIds(ids, model.version)
+        missing = [i for i, _id in enumerate(ids) if _id not in cached]
+        predictions = dict(zip(missing, model.predictMany([playerIdsAndGames[i] for i in missing])))
+
+        self.env.basicGamePredictionDB.writeMany([BasicGamePrediction.new(
+            gameId = playerIdsAndGames[i][1].id,
+            playerId = playerIdsAndGames[i][0],
+            version = model.version,
+            prediction = p) for i, p in predictions.items() if p is not None])
+        logging.debug(f'basic predictions: {len(ids) - len(missing)} cached, {len(missing)} predicted')
+        return [cached[_id] if _id in cached else predictions[i] for i, _id in enumerate(ids)]
+
+    def gameAnalysedGames(self, playerId: PlayerID) -> List[GameAnalysedGame]:
+        """the analysed games of playerId the analysed game model can take, paired with their games"""
+        analysedGames = [ag for ag in self.env.analysedGameDB.byPlayerId(playerId) if ag.gameLength() <= 60]
+        games = self.env.gameDB.byIds([ag.gameId for ag in analysedGames])
+        return [GameAnalysedGame(ag, g) for ag, g in zip(analysedGames, games) if g is not None]
+
+    def analysedPredictions(self, analysedGames: List[AnalysedGame], model: Opt[AnalysedGameModel] = None) -> List[Opt[AnalysedGamePrediction]]:
+        """
+        model.predict, reusing predictions stored for the model's version.
+        Games are only loaded and run through the model for analysed games without one.
+        None where a game is missing or has no tensor.
+        model: defaults to analysedGameModel
+        """
+        model = model or self.analysedGameModel
+        cached = {} if model.version is None else self.env.analysedGamePredictionDB.byAnalysedGames(analysedGames, model.version)
+        missing = [ag for ag in analysedGames if ag.id not in cached]
+        games = self.env.gameDB.byIds([ag.gameId for ag in missing])
+        gameAnalysedGames = [GameAnalysedGame(ag, g) for ag, g in zip(missing, games) if g is not None]
+        predicted = [(gag.analysedGame, p) for gag, p in zip(gameAnalysedGames, model.predict(gameAnalysedGames))]
+        predictions = {ag.id: p for ag, p in predicted}
+
+        if model.version is not None:
+            self.env.analysedGamePredictionDB.writeMany(model.version, [(ag, p) for ag, p in predicted if p is not None])
+        logging.debug(f'analysed predictions: {len(cached)} stored, {len(predictions)} predicted')
+        return [cached.get(ag.id) or predictions.get(ag.id) for ag in analysedGames]
+
+    def createReport(self, player: Player, analysedGames: List[AnalysedGame], owner: AuthID = 'test') -> PlayerReport:
+        return self.createReports([(player, analysedGames, owner)])[0]
+
+    def createReports(self, reportRequests: List[Tuple[Player, List[AnalysedGame], AuthID]]) -> List[PlayerReport]:
+        """
+        Build a PlayerReport for each (player, analysedGames, owner).
+        Games without a stored prediction, from every player, are sent to the analysed game model together.
+        """
+        model = self.analysedGameModel # held, so every report is made with the same version
+        predictions = iter(self.analysedPredictions([ag for _, analysedGames, _ in reportRequests for ag in analysedGames], model))
+        playerReports = []
+        for player, analysedGames, owner in reportRequests:
+            playerPredictions = [next(predictions) for _ in analysedGames]
+            playerReports.append(PlayerReport.new(
+                player,
+                zip(analysedGames, playerPredictions),
+                owner,
+                model.version))
+        return playerReports
+
+    def verdictSettled(self, player: Player, analysedGames: List[AnalysedGame], remaining: int) -> bool:
+        """
+        Given the games analysed so far, will analysing `remaining` more games change the verdict on player?
+        """
+        predictions = self.analysedPredictions(analysedGames)
+        return PlayerReport.verdictSettled(player, [p.weightedGamePrediction() for p in predictions if p is not None], remaining)
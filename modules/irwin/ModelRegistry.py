@@ -0,0 +1,125 @@
+"""One instance of each model per process, shared by prediction, training and evaluation"""
+from default_imports import *
+
+from conf.ConfigWrapper import ConfigWrapper
+
+from modules.irwin.NumpyModel import npzPath
+from modules.irwin.InferencePool import InferencePool
+
+from datetime import datetime
+import os
+import random
+import threading
+import time
+
+ModelVersion = NewType('ModelVersion', str)
+
+def versionPath(path: str) -> str:
+    """the version file shared by a keras model and its numpy export"""
+    return os.path.splitext(path)[0] + '.version'
+
+class ModelRegistry:
+    """
+    Models are loaded the first time they are asked for. After that a watcher thread checks
+    the version of each model file every 'irwin model reload_interval' seconds. A new version is
+    loaded and warmed in the background, then swapped in, so callers keep using the old model
+    until the new one is ready.
+    Models are keyed by class, file, runtime and newmodel. A newmodel is built from scratch once per process
+    and is not reloaded, as its file is the one being trained.
+    """
+    def __init__(self):
+        self.models = {} # (class name, path, runtime, newmodel) -> (ModelVersion, model)
+        self.loaders = {} # key -> (modelClass, config) to load the model again
+        self.failed = {} # key -> version that could not be loaded, so it isn't retried
+        self.lock = threading.Lock()
+        self.watcher = None
+
+    def get(self, modelClass: type, config: ConfigWrapper, newmodel: bool = False, runtime: Opt[str] = None):
+        """
+        runtime: as for the model class. Defaults to 'pool' if the process started an InferencePool
+        for modelClass, otherwise 'irwin model runtime'
+        """
+        runtime = runtime or ('pool' if not newmodel and InferencePool.preforked(modelClass, config) else config['irwin model runtime'] or 'keras')
+        fileRuntime = (config['irwin model runtime'] or 'keras') if runtime == 'pool' else runtime
+        path = config[modelClass.fileKey] if fileRuntime == 'keras' else npzPath(config[modelClass.fileKey])
+        key = (modelClass.__name__, path, runtime, newmodel)
+        with self.lock:
+            entry = self.models.get(key)
+            if entry is None:
+                entry = self.load(key, modelClass, config)
+                self.models[key] = entry
+                if not newmodel:
+                    self.loaders[key] = (modelClass, config)
+                    self.watch(config['irwin model reload_interval'])
+            return entry[1]
+
+    def load(self, key: Tuple, modelClass: type, config: ConfigWrapper) -> Tuple[ModelVersion, object]:
+        name, path, runtime, newmodel = key
+        version = ModelRegistry.version(path)
+        logging.debug(f'loading {name} from {path} (version {version})')
+        model = modelClass(config, newmodel, runtime)
+        model.warm()
+        return (version, model)
+
+    def watch(self, interval: Opt[Number]):
+        """start the watcher, unless interval is 0 and models are not reloaded"""
+        if self.watcher is None and (interval is None or interval > 0):
+            self.watcher = threading.Thread(target=self.run, args=(interval or 30,), name='ModelRegistry', daemon=True)
+            self.watcher.start()
+
+    def run(self, interval: Number):
+        while True:
+            time.sleep(interval)
+            self.reload()
+
+    def reload(self):
+        """load every model whose file has a new version, and swap it in once warmed"""
+        with self.lock:
+            stale = [key for key, (version, _) in self.models.items()
+                if key in self.loaders and ModelRegistry.version(key[1]) not in (version, self.failed.get(key), None)]
+        for key in stale:
+            modelClass, config = self.loaders[key]
+            try:
+                entry = self.load(key, modelClass, config)
+            except Exception as e: # a broken deployment shouldn't take down the model being served
+                self.failed[key] = ModelRegistry.version(key[1])
+                logging.warning(f'failed to reload {key[0]} from {key[1]}, keeping version {self.models[key][0]}: {e}')
+                continue
+            with self.lock:
+                self.models[key] = entry
+            logging.warning(f'{key[0]} switched to version {entry[0]}')
+
+    def saved(self, model):
+        """record that model has written its own file, so it isn't loaded again"""
+        with self.lock:
+            for key, (_, m) in self.models.items():
+                if m is model:
+                    self.models[key] = (ModelRegistry.version(key[1]), m)
+
+    @staticmethod
+    def version(path: str) -> Opt[ModelVersion]:
+        """
+        the id in the version file next to path, or the modification time of path for
+        models saved without one. None if there is no model at path
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(versionPath(path)) as f:
+                return ModelVersion(f.read().strip())
+        except OSError:
+            return ModelVersion(f'{os.path.getmtime(path):.0f}')
+
+    @staticmethod
+    def stamp(path: str) -> ModelVersion:
+        """
+        give the model at path a new version. Written once the model files are complete,
+        so serving processes never load a half written model
+        """
+        version = ModelVersion(datetime.now().strftime('%Y%m%d%H%M%S') + '-%04x' % random.getrandbits(16))
+        with open(versionPath(path) + '.tmp', 'w') as f:
+            f.write(version)
+        os.replace(versionPath(path) + '.tmp', versionPath(path))
+        return version
+
+modelRegistry = ModelRegistry()
@@ -0,0 +1,273 @@
+"""Forward pass of exported Keras models in NumPy, so serving processes don't need TensorFlow"""
+from default_imports import *
+
+from typing import Union
+from datetime import datetime
+import json
+import os
+
+import numpy as np
+
+Precision = NewType('Precision', str) # 'float32', 'float16' or 'int8'
+
+def npzPath(path: str) -> str:
+    """where the export of the keras model at path is kept"""
+    return os.path.splitext(path)[0] + '.npz'
+
+def reduce(weight: np.ndarray, precision: Precision):
+    """
+    store a weight at precision. Only kernels are reduced, biases stay float32.
+    int8 kernels are quantized symmetrically per output unit, and kept with their scales
+    """
+    if weight.ndim < 2 or precision == 'float32':
+        return weight.astype(np.float32)
+    if precision == 'float16':
+        return weight.astype(np.float16)
+    if precision == 'int8':
+        scale = np.max(np.abs(weight), axis=tuple(range(weight.ndim - 1)), keepdims=True) / 127
+        scale[scale == 0] = 1
+        return (np.round(weight / scale).astype(np.int8), scale.astype(np.float32))
+    raise ValueError(f'unknown precision {precision}')
+
+def restore(weight) -> np.ndarray:
+    """a reduced weight as float32 for computation, while its layer runs"""
+    if isinstance(weight, tuple):
+        return weight[0].astype(np.float32) * weight[1]
+    return weight.astype(np.float32, copy=False)
+
+def reducedPath(path: str, precision: Precision) -> str:
+    """where the weights of the export at path are kept at precision"""
+    return os.path.splitext(path)[0] + f'.{precision}.npz'
+
+def calibrationPath(path: str) -> str:
+    return os.path.splitext(path)[0] + '.calibration.json'
+
+def readCalibration(path: str) -> Dict:
+    """calibration results for the export at path, by precision"""
+    try:
+        with open(calibrationPath(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def writeCalibration(path: str, precision: Precision, agreement: float):
+    calibration = readCalibration(path)
+    calibration[precision] = {
+        'agreement': agreement,
+        'version': os.path.getmtime(path),
+        'date': datetime.now().isoformat()
+    }
+    with open(calibrationPath(path), 'w') as f:
+        json.dump(calibration, f, indent=2)
+
+def allowedPrecision(path: str, precision: Precision, minAgreement: float) -> Precision:
+    """
+    precision if the export at path has been calibrated at it with enough agreement,
+    otherwise float32. Calibrations of an earlier export don't count
+    """
+    if precision in (None, 'float32'):
+        return 'float32'
+    record = readCalibration(path).get(precision)
+    if record is None or not os.path.isfile(path) or record['version'] != os.path.getmtime(path):
+        logging.warning(f'{path} has not been calibrated at {precision}. Using float32')
+        return 'float32'
+    if record['agreement'] < minAgreement:
+        logging.warning(f'{path} at {precision} agrees with float32 on {record["agreement"]:.3f} of players, below {minAgreement}. Using float32')
+        return 'float32'
+    return precision
+
+def first(value):
+    """Keras stores 1d conv settings as 1-tuples"""
+    return value[0] if isinstance(value, (list, tuple)) else value
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(x, -60, 60)))
+
+activations = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': sigmoid,
+    'hard_sigmoid': lambda x: np.clip(0.2*x + 0.5, 0, 1),
+    'tanh': np.tanh
+}
+
+def activation(name: str):
+    try:
+        return activations[name]
+    except KeyError:
+        raise NotImplementedError(f'activation {name} is not supported by NumpyModel')
+
+def embedding(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    return weights[0][x.astype(np.int64)]
+
+def reshape(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    return x.reshape((len(x),) + tuple(config['target_shape']))
+
+def flatten(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    return x.reshape((len(x), -1))
+
+def dense(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    y = x @ weights[0]
+    if config.get('use_bias', True):
+        y = y + weights[1]
+    return activation(config['activation'])(y)
+
+def conv1d(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    """x: (batch, steps, channels). Stride 1 only, which is all the models use"""
+    if first(config.get('strides', 1)) != 1:
+        raise NotImplementedError('Conv1D strides other than 1 are not supported by NumpyModel')
+    kernel = weights[0] # (kernel_size, channels, filters)
+    size = kernel.shape[0]
+    dilation = first(config.get('dilation_rate', 1))
+    span = dilation*(size - 1)
+
+    padding = config.get('padding', 'valid')
+    if padding == 'causal':
+        x = np.pad(x, ((0, 0), (span, 0), (0, 0)), 'constant')
+    elif padding == 'same':
+        x = np.pad(x, ((0, 0), (span//2, span - span//2), (0, 0)), 'constant')
+
+    steps = x.shape[1] - span
+    y = sum(x[:, j*dilation:j*dilation + steps] @ kernel[j] for j in range(size))
+    if config.get('use_bias', True):
+        y = y + weights[1]
+    return activation(config['activation'])(y)
+
+def lstm(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    """Keras gate order: input, forget, cell, output"""
+    if config.get('go_backwards') or config.get('stateful'):
+        raise NotImplementedError('backwards and stateful LSTMs are not supported by NumpyModel')
+    kernel, recurrentKernel = weights[0], weights[1]
+    units = recurrentKernel.shape[0]
+    act = activation(config.get('activation', 'tanh'))
+    recurrentAct = activation(config.get('recurrent_activation', 'hard_sigmoid'))
+
+    inputs = x @ kernel # every timestep at once, only the recurrent part is sequential
+    if config.get('use_bias', True):
+        inputs = inputs + weights[2]
+
+    h = np.zeros((len(x), units), dtype=inputs.dtype)
+    c = np.zeros((len(x), units), dtype=inputs.dtype)
+    sequence = []
+    for t in range(x.shape[1]):
+        z = inputs[:, t] + h @ recurrentKernel
+        i = recurrentAct(z[:, :units])
+        f = recurrentAct(z[:, units:2*units])
+        o = recurrentAct(z[:, 3*units:])
+        c = f*c + i*act(z[:, 2*units:3*units])
+        h = o*act(c)
+        sequence.append(h)
+    return np.stack(sequence, axis=1) if config.get('return_sequences') else h
+
+def identity(config: Dict, weights: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+    return x
+
+layers = {
+    'Embedding': embedding,
+    'Reshape': reshape,
+    'Flatten': flatten,
+    'Dense': dense,
+    'Conv1D': conv1d,
+    'LSTM': lstm,
+    'Dropout': identity # only active when training
+}
+
+class NumpyModel:
+    """
+    Runs the functional graph of an exported Keras model. Supports the layers used by
+    BasicGameModel and AnalysedGameModel. predict has the same signature and outputs as Keras'.
+    Kernels are kept at precision, in memory and in the reduced export written by saveReduced.
+    NumPy has no fast float16 or int8 matmul on CPU, so each layer restores its kernels to float32
+    while it runs: one cast per layer per batch, and only one layer's float32 kernels at a time.
+    """
+    def __init__(self, config: Dict, weights: Dict[str, List[np.ndarray]], precision: Precision = 'float32', reduced: bool = False):
+        """weights: float32, or already at precision if reduced"""
+        self.config = config
+        self.precision = precision
+        self.weights = weights if reduced else {name: [reduce(w, precision) for w in ws] for name, ws in weights.items()}
+        self.layers = {layer['name']: layer for layer in config['layers']}
+        self.inputNames = [name for name, _, _ in config['input_layers']]
+        self.outputNames = [name for name, _, _ in config['output_layers']]
+
+    @staticmethod
+    def load(path: str, precision: Precision = 'float32'):
+        """
+        the export at path, at precision. Read from its reduced export if that was written from the current export,
+        so the float32 weights are never loaded
+        """
+        if precision != 'float32' and os.path.isfile(reducedPath(path, precision)):
+            with np.load(reducedPath(path, precision), allow_pickle=False) as npz:
+                if float(npz['source']) == os.path.getmtime(path) and str(npz['precision']) == precision:
+                    return NumpyModel(json.loads(str(npz['config'])), NumpyModel.readWeights(npz), precision, reduced=True)
+            logging.warning(f'{reducedPath(path, precision)} is from an earlier export. Reducing {path}')
+        with np.load(path, allow_pickle=False) as npz:
+            return NumpyModel(json.loads(str(npz['config'])), NumpyModel.readWeights(npz), precision)
+
+    @staticmethod
+    def readWeights(npz) -> Dict[str, List]:
+        """weights are kept as layer/index, and the scales of int8 kernels as layer/index/scale"""
+        weights, scales = {}, {}
+        for key in npz.files:
+            if key in ('config', 'precision', 'source'):
+                continue
+            if key.endswith('/scale'):
+                scales[key[:-len('/scale')]] = npz[key]
+                continue
+            name, index = key.rsplit('/', 1)
+            weights.setdefault(name, {})[int(index)] = npz[key]
+        return {name: [(ws[i], scales[f'{name}/{i}']) if f'{name}/{i}' in scales else ws[i] for i in sorted(ws)]
+            for name, ws in weights.items()}
+
+    def saveReduced(self, path: str):
+        """write the weights, as kept at precision, next to the float32 export at path they were reduced from"""
+        arrays = {}
+        for name, ws in self.weights.items():
+            for i, w in enumerate(ws):
+                if isinstance(w, tuple):
+                    arrays[f'{name}/{i}'], arrays[f'{name}/{i}/scale'] = w
+                else:
+                    arrays[f'{name}/{i}'] = w
+        np.savez_compressed(reducedPath(path, self.precision), config=np.array(json.dumps(self.config)),
+            precision=np.array(self.precision), source=np.array(os.path.getmtime(path)), **arrays)
+
+    @staticmethod
+    def export(kerasModel, path: str):
+        """write the graph and weights of kerasModel to path (.npz)"""
+        arrays = {f'{layer.name}/{i}': w for layer in kerasModel.layers for i, w in enumerate(layer.get_weights())}
+        np.savez_compressed(path, config=np.array(json.dumps(kerasModel.get_config())), **arrays)
+
+    def predict(self, inputs: List[np.ndarray], batch_size: Opt[int] = None) -> Union[np.ndarray, List[np.ndarray]]:
+        batch_size = batch_size or len(inputs[0])
+        chunks = [self.forward([x[i:i+batch_size] for x in inputs]) for i in range(0, len(inputs[0]), batch_size)]
+        outputs = [np.concatenate([chunk[k] for chunk in chunks]) for k in range(len(self.outputNames))]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def forward(self, inputs: List[np.ndarray]) -> List[np.ndarray]:
+        values = {name: np.asarray(x, dtype=np.float32) for name, x in zip(self.inputNames, inputs)}
+        return [self.evaluate(name, values) for name in self.outputNames]
+
+    def evaluate(self, name: str, values: Dict[str, np.ndarray]) -> np.ndarray:
+        if name in values:
+            return values[name]
+        layer = self.layers[name]
+        inbound = [self.evaluate(node[0], values) for node in layer['inbound_nodes'][0]]
+        className, config = layer['class_name'], layer['config']
+        if className == 'Concatenate':
+            value = np.concatenate(inbound, axis=config.get('axis', -1))
+        elif className in layers:
+            value = layers[className](config, [restore(w) for w in self.weights.get(name, [])], inbound[0])
+        else:
+            raise NotImplementedError(f'{className} layers are not supported by NumpyModel')
+        values[name] = value
+        return value
+
+def verify(kerasModel, numpyModel: NumpyModel, inputs: List[np.ndarray], tolerance: float = 1e-4) -> float:
+    """largest difference between the outputs of the two models. Raises if it is above tolerance"""
+    expected = kerasModel.predict(inputs)
+    actual = numpyModel.predict(inputs)
+    if not isinstance(expected, list):
+        expected, actual = [expected], [actual]
+    difference = max(float(np.max(np.abs(e - a))) for e, a in zip(expected, actual))
+    if difference > tolerance:
+        raise ValueError(f'NumpyModel differs from the keras model by {difference}')
+    return difference
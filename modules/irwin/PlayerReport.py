@@ -12,6 +12,7 @@ from modules.game.Player import Player, PlayerID
 from modules.auth.Auth import AuthID
 from modules.irwin.AnalysedGameModel import AnalysedGamePrediction
 from modules.irwin.GameReport import GameReport
+from modules.irwin.AnalysisReport import PlayerReportDB as AnalysisReportDB
 
 PlayerReportID = NewType('PlayerReportID', str)
 
@@ -21,14 +22,15 @@ class PlayerReport(NamedTuple('PlayerReport', [
         ('owner', AuthID),
         ('activation', int),
         ('gameReports', List[GameReport]),
-        ('date', datetime)
+        ('date', datetime),
+        ('modelVersion', Opt[str]) # AnalysedGameModel.version the report was made with
     ])):
     @property
     def playerId(self):
         return self.userId
 
     @staticmethod
-    def new(player: Player, gamesAndPredictions: Iterable[Tuple[AnalysedGame, AnalysedGamePrediction]], owner: AuthID = 'test'):
+    def new(player: Player, gamesAndPredictions: Iterable[Tuple[AnalysedGame, AnalysedGamePrediction]], owner: AuthID = 'test', modelVersion: Opt[str] = None):
         reportId = PlayerReport.makeId()
         gamesAndPredictions = [(ag, agp) for ag, agp in gamesAndPredictions if agp is not None]
         gameReports = [GameReport.new(analysedGame, analysedGamePrediction, reportId) for analysedGame, analysedGamePrediction in gamesAndPredictions]
@@ -38,7 +40,8 @@ class PlayerReport(NamedTuple('PlayerReport', [
             owner=owner,
             activation=PlayerReport.playerPrediction(player, [agp for _, agp in gamesAndPredictions]),
             gameReports=gameReports,
-            date=datetime.now())
+            date=datetime.now(),
+            modelVersion=modelVersion)
 
     @staticmethod
     def makeId() -> PlayerReportID:
@@ -46,7 +49,11 @@ class PlayerReport(NamedTuple('PlayerReport', [
 
     @staticmethod
     def playerPrediction(player: Player, analysedGamePredictions: List[AnalysedGamePrediction]) -> int:
-        sortedGameActivations = sorted([gp.weightedGamePrediction() for gp in analysedGamePredictions], reverse=True)
+        return PlayerReport.playerActivation(player, [gp.weightedGamePrediction() for gp in analysedGamePredictions])
+
+    @staticmethod
+    def playerActivation(player: Player, gameActivations: List[int]) -> int:
+        sortedGameActivations = sorted(gameActivations, reverse=True)
         topGameActivations = sortedGameActivations[:ceil(0.15*len(sortedGameActivations))]
         topGameActivationsAvg = int(np.average(topGameActivations)) if len(topGameActivations) > 0 else 0
 
@@ -61,10 +68,64 @@ class PlayerReport(NamedTuple('PlayerReport', [
             result = min(62, topGameActivationsAvg)
         return result
 
+    @staticmethod
+    def verdict(activation: int, mark: int = 92, report: int = 64) -> int:
+        """2 if the player would be marked, 1 if reported, 0 otherwise. Thresholds as in Evaluation"""
+        if activation > mark:
+            return 2
+        if activation > report:
+            return 1
+        return 0
+
+    @staticmethod
+    def verdictSettled(player: Player, gameActivations: List[int], remaining: int) -> bool:
+        """
+        Can the verdict still change with `remaining` more games?
+        playerActivation never decreases when a game activation increases, so the
+        verdict is settled if it is the same when every remaining game scores 0 and 100.
+        """
+        lowest = PlayerReport.playerActivation(player, gameActivations + remaining*[0])
+        highest = PlayerReport.playerActivation(player, gameActivations + remaining*[100])
+        return PlayerReport.verdict(lowest) == PlayerReport.verdict(highest)
+
     def reportDict(self) -> Dict:
         return {
             'userId': self.userId,
             'owner': self.owner,
             'activation': int(self.activation),
             'games': [gameReport.reportDict() for gameReport in self.gameReports]
-        }
\ No newline at end of file
+        }
+
+class PlayerReportBSONHandler:
+    """
+    Game reports are posted to lichess but not stored, so they are not read back.
+    """
+    @staticmethod
+    def reads(bson: Dict) -> PlayerReport:
+        return PlayerReport(
+            id=bson['_id'],
+            userId=bson['userId'],
+            owner=bson['owner'],
+            activation=bson['activation'],
+            gameReports=[],
+            date=bson['date'],
+            modelVersion=bson.get('modelVersion'))
+
+    @staticmethod
+    def writes(playerReport: PlayerReport) -> Dict:
+        return {
+            '_id': playerReport.id,
+            'userId': playerReport.userId,
+            'owner': playerReport.owner,
+            'activation': playerReport.activation,
+            'date': playerReport.date,
+            'modelVersion': playerReport.modelVersion
+        }
+
+class PlayerReportDB(AnalysisReportDB):
+    """AnalysisReport's PlayerReportDB, writing reports with the model version they were made with"""
+    def write(self, playerReport: PlayerReport):
+        self.playerReportColl.update_one(
+            {'_id': playerReport.id},
+            {'$set': PlayerReportBSONHandler.writes(playerReport)},
+            upsert=True)
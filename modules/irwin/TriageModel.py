@@ -0,0 +1,46 @@
+from default_imports import *
+
+from modules.irwin.BasicGameModel import BasicGameModel
+
+class TriageModel(BasicGameModel):
+    """
+    A small convolutional model trained to reproduce BasicGameModel's scores on the same game tensors.
+    Used in place of BasicGameModel to score listener requests when 'irwin model triage enabled' is set,
+    as those scores only order the queue and pick the games to analyse.
+    """
+    fileKey = 'irwin model triage file'
+    name = 'triage'
+
+    def modelVersion(self) -> Opt[str]:
+        """prefixed, so cached scores from the two models are never mistaken for each other"""
+        version = super().modelVersion()
+        return None if version is None else f'{self.name}/{version}'
+
+    def buildModel(self):
+        from keras.models import Model
+        from keras.layers import Embedding, Reshape, Flatten, Dense, Input, concatenate, Conv1D
+        from keras.optimizers import Adam
+
+        moveStatsInput = Input(shape=(60, 8), dtype='float32', name='move_input')
+        pieceType = Input(shape=(60, 1), dtype='float32', name='piece_type')
+
+        pieceEmbed = Embedding(input_dim=7, output_dim=4)(pieceType)
+        rshape = Reshape((60,4))(pieceEmbed)
+
+        concats = concatenate(inputs=[moveStatsInput, rshape])
+
+        conv1 = Conv1D(filters=16, kernel_size=5, activation='relu')(concats)
+        conv2 = Conv1D(filters=16, kernel_size=5, dilation_rate=2, activation='relu')(conv1)
+        dense1 = Dense(4, activation='relu')(conv2)
+
+        f = Flatten()(dense1)
+        dense2 = Dense(16, activation='relu')(f)
+        mainOutput = Dense(1, activation='sigmoid', name='main_output')(dense2)
+
+        model = Model(inputs=[moveStatsInput, pieceType], outputs=mainOutput)
+
+        # the targets are the teacher's scores, which binary crossentropy takes as soft labels
+        model.compile(optimizer=Adam(lr=0.001),
+            loss='binary_crossentropy',
+            metrics=['mae'])
+        return model
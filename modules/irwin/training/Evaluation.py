@@ -4,9 +4,18 @@ from conf.ConfigWrapper import ConfigWrapper
 
 from modules.game.Player import Player
 from modules.game.GameStore import GameStore
-from modules.game.AnalysedGame import GameAnalysedGame
 
 from modules.irwin.PlayerReport import PlayerReport
+from modules.irwin.AnalysedGameModel import AnalysedGameModel
+from modules.irwin.DilatedAnalysedGameModel import DilatedAnalysedGameModel
+from modules.irwin.ModelRegistry import modelRegistry
+
+from modules.queue.EngineQueue import EngineQueue
+from modules.queue.Origin import OriginRandom
+
+import numpy as np
+import os
+import time
 
 class Evaluation(NamedTuple('Evaluation', [
         ('irwin', 'Irwin'),
@@ -14,10 +23,9 @@ class Evaluation(NamedTuple('Evaluation', [
     ])):
     def getPlayerOutcomes(self, engine: bool, batchSize: int) -> Opt[int]: # returns a generator for activations, player by player.
         for player in self.irwin.env.playerDB.engineSample(engine, batchSize):
-            analysedGames = self.irwin.env.analysedGameDB.byPlayerId(player.id)
-            games = self.irwin.env.gameDB.byIds([ag.gameId for ag in analysedGames])
-            predictions = self.irwin.analysedGameModel.predict([GameAnalysedGame(ag, g) for ag, g in zip(analysedGames, games) if ag.gameLength() <= 60])
-            playerReport = PlayerReport.new(player, zip(analysedGames, predictions))
+            gameAnalysedGames = self.irwin.gameAnalysedGames(player.id)
+            predictions = self.irwin.analysedGameModel.predict(gameAnalysedGames)
+            playerReport = PlayerReport.new(player, zip([gag.analysedGame for gag in gameAnalysedGames], predictions))
             if len(playerReport.gameReports) > 0:
                 yield Evaluation.outcome(
                     playerReport.activation,
@@ -29,6 +37,89 @@ class Evaluation(NamedTuple('Evaluation', [
         outcomes = []
         [[((outcomes.append(o) if o is not None else ...), Evaluation.performance(outcomes)) for o in self.getPlayerOutcomes(engine, self.config['irwin testing eval_size'])] for engine in (True, False)]
 
+    def compareArchitectures(self) -> Dict[str, Dict]:
+        """
+        Evaluate the lstm and dilated analysed game models on the same sample of players.
+        Logs the performance of each, as evaluate does, and the time they took to predict.
+        Both models must have been trained, as a missing model would be built with random weights
+        """
+        modelClasses = (AnalysedGameModel, DilatedAnalysedGameModel)
+        missing = [self.config[modelClass.fileKey] for modelClass in modelClasses if not os.path.isfile(self.config[modelClass.fileKey])]
+        if len(missing) > 0:
+            logging.error(f'not comparing architectures, there is no trained model at {", ".join(missing)}')
+            return {}
+        models = {modelClass.name: modelRegistry.get(modelClass, self.config) for modelClass in modelClasses}
+        outcomes = {name: [] for name in models}
+        seconds = {name: 0.0 for name in models}
+        games = 0
+        for engine in (True, False):
+            for player in self.irwin.env.playerDB.engineSample(engine, self.config['irwin testing eval_size']):
+                gameAnalysedGames = self.irwin.gameAnalysedGames(player.id)
+                if len(gameAnalysedGames) == 0:
+                    continue
+                games += len(gameAnalysedGames)
+                for name, model in models.items():
+                    start = time.perf_counter()
+                    predictions = model.predict(gameAnalysedGames)
+                    seconds[name] += time.perf_counter() - start
+                    playerReport = PlayerReport.new(player, zip([gag.analysedGame for gag in gameAnalysedGames], predictions))
+                    if len(playerReport.gameReports) > 0:
+                        outcomes[name].append(Evaluation.outcome(playerReport.activation, 92, 64, engine))
+
+        results = {}
+        for name in models:
+            logging.warning(f'{name}: {games} games in {seconds[name]:.2f}s ({games/max(seconds[name], 1e-9):.0f} games/sec)')
+            Evaluation.performance(outcomes[name])
+            results[name] = {'seconds': seconds[name], 'games': games, 'outcomes': outcomes[name]}
+        return results
+
+    def evaluateTriage(self) -> Dict[str, float]:
+        """
+        How closely does the triage model order the queue like the basic game model it was distilled from?
+        Both score the analysed games of a sample of players, which are compared on
+          gameRankCorrelation: spearman correlation of game scores
+          meanAbsoluteError: of game scores
+          pairwiseOrder: fraction of pairs of players given precedence in the same order
+          topDecileRecall: fraction of the basic model's top 10% of players also in the triage model's
+          requiredGamesOverlap: average fraction of the games picked for analysis that both pick
+        """
+        size = self.config['irwin testing eval_size']
+        teacherScores, studentScores, teacherPrecedences, studentPrecedences, overlaps = [], [], [], [], []
+        for player in self.irwin.env.playerDB.engineSample(True, size) + self.irwin.env.playerDB.engineSample(False, size):
+            games = self.irwin.env.gameDB.byPlayerIdAndAnalysed(player.id)
+            scored = [(g, t, s) for g, t, s in zip(games,
+                self.irwin.basicGameModel.predict(player.id, games),
+                self.irwin.triageModel.predict(player.id, games)) if t is not None and s is not None]
+            if len(scored) == 0:
+                continue
+            teacher = EngineQueue.new(player.id, OriginRandom, [(g, t) for g, t, _ in scored])
+            student = EngineQueue.new(player.id, OriginRandom, [(g, s) for g, _, s in scored])
+            teacherScores.extend([t for _, t, _ in scored])
+            studentScores.extend([s for _, _, s in scored])
+            teacherPrecedences.append(teacher.precedence)
+            studentPrecedences.append(student.precedence)
+            overlaps.append(len(set(teacher.requiredGameIds) & set(student.requiredGameIds)) / len(teacher.requiredGameIds))
+
+        if len(overlaps) < 2:
+            logging.warning('not enough players with analysed games to evaluate the triage model')
+            return {}
+
+        ranks = lambda x: np.argsort(np.argsort(x))
+        teacherPrecedences, studentPrecedences = np.array(teacherPrecedences), np.array(studentPrecedences)
+        teacherOrder = np.sign(teacherPrecedences[:, None] - teacherPrecedences[None, :])
+        studentOrder = np.sign(studentPrecedences[:, None] - studentPrecedences[None, :])
+        decile = max(1, len(overlaps)//10)
+        metrics = {
+            'gameRankCorrelation': float(np.corrcoef(ranks(teacherScores), ranks(studentScores))[0, 1]),
+            'meanAbsoluteError': float(np.mean(np.abs(np.array(teacherScores) - np.array(studentScores)))),
+            'pairwiseOrder': float(np.mean((teacherOrder == studentOrder)[teacherOrder != 0])) if np.any(teacherOrder != 0) else 1.0,
+            'topDecileRecall': len(set(np.argsort(-teacherPrecedences)[:decile]) & set(np.argsort(-studentPrecedences)[:decile])) / decile,
+            'requiredGamesOverlap': float(np.mean(overlaps))
+        }
+        for name, value in metrics.items():
+            logging.warning(f'{name}: {value:.3f}')
+        return metrics
+
     @staticmethod
     def performance(outcomes):
         tp = len([a for a in outcomes if a == 1])
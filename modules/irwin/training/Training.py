@@ -6,20 +6,41 @@ from modules.irwin.Env import Env
 
 from modules.irwin.training.AnalysedModelTraining import AnalysedModelTraining
 from modules.irwin.training.BasicModelTraining import BasicModelTraining
+from modules.irwin.training.TriageModelTraining import TriageModelTraining
 from modules.irwin.training.Evaluation import Evaluation
 
-from modules.irwin.AnalysedGameModel import AnalysedGameModel
+from modules.irwin.DilatedAnalysedGameModel import analysedGameModelClass
 from modules.irwin.BasicGameModel import BasicGameModel
+from modules.irwin.TriageModel import TriageModel
+from modules.irwin.ModelRegistry import modelRegistry
 
 
 class Training:
+    """
+    models are taken from the registry when first used, so they are shared with Irwin.
+    Training always uses the keras runtime
+    """
     def __init__(self, env: Env, newmodel: bool = False):
-        self.analysedModelTraining = AnalysedModelTraining(
-            env=env,
-            analysedGameModel=AnalysedGameModel(env.config, newmodel))
-
-        self.basicModelTraining = BasicModelTraining(
-            env=env,
-            basicGameModel=BasicGameModel(env.config, newmodel))
-
-        self.evaluation = Evaluation(env, env.config)
\ No newline at end of file
+        self.env = env
+        self.newmodel = newmodel
+        self.evaluation = Evaluation(env, env.config)
+
+    @property
+    def analysedModelTraining(self) -> AnalysedModelTraining:
+        return AnalysedModelTraining(
+            env=self.env,
+            analysedGameModel=modelRegistry.get(analysedGameModelClass(self.env.config), self.env.config, self.newmodel, runtime='keras'))
+
+    @property
+    def basicModelTraining(self) -> BasicModelTraining:
+        return BasicModelTraining(
+            env=self.env,
+            basicGameModel=modelRegistry.get(BasicGameModel, self.env.config, self.newmodel, runtime='keras'))
+
+    @property
+    def triageModelTraining(self) -> TriageModelTraining:
+        """newmodel only applies to the triage model. Its teacher is always the saved basic game model"""
+        return TriageModelTraining(
+            env=self.env,
+            triageModel=modelRegistry.get(TriageModel, self.env.config, self.newmodel, runtime='keras'),
+            basicGameModel=modelRegistry.get(BasicGameModel, self.env.config, runtime='keras'))
@@ -0,0 +1,47 @@
+from default_imports import *
+
+from modules.irwin.BasicGameModel import BasicGameModel
+from modules.irwin.TriageModel import TriageModel
+
+from modules.irwin.Env import Env
+from modules.irwin.training.BasicModelTraining import BasicModelTraining
+
+import numpy as np
+
+from random import shuffle
+
+class TriageModelTraining(NamedTuple('TriageModelTraining', [
+        ('env', Env),
+        ('triageModel', TriageModel),
+        ('basicGameModel', BasicGameModel)
+    ])):
+    def train(self, epochs: int):
+        """
+        distill basicGameModel into triageModel: fit the triage model to the basic model's
+        scores on games of engines and legit players. No labels are needed
+        """
+        logging.debug("getting dataset")
+        inputs = self.getTrainingInputs()
+
+        logging.debug("scoring games with the basic game model")
+        targets = self.basicGameModel.predictInputs(inputs)
+
+        logging.debug("training")
+        logging.debug("Batch Info: Games: {}".format(len(inputs[0])))
+
+        self.triageModel.model.fit(
+            inputs, targets,
+            epochs=epochs, batch_size=32, validation_split=0.2)
+
+        self.triageModel.saveModel()
+        logging.debug("complete")
+
+    def getTrainingInputs(self) -> List[np.ndarray]:
+        limit = self.env.config['irwin model triage training sample_size'] or self.env.config['irwin model basic training sample_size']
+        basicModelTraining = BasicModelTraining(self.env, self.basicGameModel)
+        tensors = basicModelTraining.getTensorsByEngine(True, limit) + basicModelTraining.getTensorsByEngine(False, limit)
+        shuffle(tensors)
+        return [
+            np.array([t[0] for t in tensors]),
+            np.array([t[1] for t in tensors])
+        ]
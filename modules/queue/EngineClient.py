@@ -0,0 +1,119 @@
+"""Hardware and measured speed of the clients that perform engine analysis"""
+from default_imports import *
+
+from modules.auth.Auth import AuthID
+
+from datetime import datetime, timedelta
+
+from pymongo.collection import Collection
+
+SearchSpeed = NewType('SearchSpeed', float) # engine searches per second
+
+class EngineClient(NamedTuple('EngineClient', [
+        ('id', AuthID),
+        ('cores', int),
+        ('engines', int),
+        ('threads', int),
+        ('nps', int), # benchmarked nodes per second, as reported by the client
+        ('nodes', int), # nodes per search the client is configured to use
+        ('speed', Opt[SearchSpeed]), # rolling speed measured from completed jobs
+        ('jobStarted', Opt[datetime]),
+        ('lastSeen', datetime)
+    ])):
+    @staticmethod
+    def new(id: AuthID, cores: int, engines: int, threads: int, nps: int, nodes: int):
+        return EngineClient(
+            id=id,
+            cores=cores,
+            engines=engines,
+            threads=threads,
+            nps=nps,
+            nodes=nodes,
+            speed=None,
+            jobStarted=None,
+            lastSeen=datetime.now())
+
+    def searchSpeed(self) -> Opt[SearchSpeed]:
+        """measured speed if we have it, otherwise the speed implied by the benchmark"""
+        if self.speed is not None:
+            return self.speed
+        if self.nps > 0 and self.nodes > 0:
+            return SearchSpeed(self.engines * self.nps / self.nodes)
+        return None
+
+class EngineClientBSONHandler:
+    @staticmethod
+    def reads(bson: Dict) -> EngineClient:
+        return EngineClient(
+            id=bson['_id'],
+            cores=bson.get('cores', 0),
+            engines=bson.get('engines', 1),
+            threads=bson.get('threads', 0),
+            nps=bson.get('nps', 0),
+            nodes=bson.get('nodes', 0),
+            speed=bson.get('speed'),
+            jobStarted=bson.get('jobStarted'),
+            lastSeen=bson.get('lastSeen'))
+
+    @staticmethod
+    def writes(engineClient: EngineClient) -> Dict:
+        return {
+            '_id': engineClient.id,
+            'cores': engineClient.cores,
+            'engines': engineClient.engines,
+            'threads': engineClient.threads,
+            'nps': engineClient.nps,
+            'nodes': engineClient.nodes,
+            'lastSeen': engineClient.lastSeen
+        }
+
+class EngineClientDB(NamedTuple('EngineClientDB', [
+        ('engineClientColl', Collection)
+    ])):
+    def register(self, engineClient: EngineClient):
+        """store the hardware of a client. Measured speed is retained"""
+        self.engineClientColl.update_one(
+            {'_id': engineClient.id},
+            {'$set': EngineClientBSONHandler.writes(engineClient)},
+            upsert=True)
+
+    def byId(self, _id: AuthID) -> Opt[EngineClient]:
+        bson = self.engineClientColl.find_one({'_id': _id})
+        return None if bson is None else EngineClientBSONHandler.reads(bson)
+
+    def active(self, window: timedelta) -> List[EngineClient]:
+        """clients that have requested work within window"""
+        return [EngineClientBSONHandler.reads(bson) for bson in self.engineClientColl.find({'lastSeen': {'$gt': datetime.now() - window}})]
+
+    def startJob(self, _id: AuthID):
+        now = datetime.now()
+        self.engineClientColl.update_one(
+            {'_id': _id},
+            {'$set': {'jobStarted': now, 'lastSeen': now}},
+            upsert=True)
+
+    def seen(self, _id: AuthID):
+        self.engineClientColl.update_one(
+            {'_id': _id},
+            {'$set': {'lastSeen': datetime.now()}},
+            upsert=True)
+
+    def completeJob(self, _id: AuthID, searches: int, elapsed: Opt[float] = None, weight: float = 0.3):
+        """
+        fold the speed of a completed job into the rolling speed of the client.
+        elapsed: analysis time reported by the client. Pipelined clients hold jobs before starting them,
+        so the time since handout overstates how long the analysis took.
+        """
+        engineClient = self.byId(_id)
+        if engineClient is None:
+            return
+        if elapsed is None:
+            if engineClient.jobStarted is None:
+                return
+            elapsed = (datetime.now() - engineClient.jobStarted).total_seconds()
+        update = {'$set': {'jobStarted': None}}
+        if searches > 0 and elapsed > 0:
+            measured = searches / elapsed
+            speed = measured if engineClient.speed is None else (1 - weight)*engineClient.speed + weight*measured
+            update['$set']['speed'] = speed
+        self.engineClientColl.update_one({'_id': _id}, update)
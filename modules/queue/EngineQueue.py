@@ -3,12 +3,13 @@ from default_imports import *
 
 from modules.auth.Auth import AuthID
 from modules.game.Game import Game, PlayerID, GameID
-from modules.queue.Origin import Origin, OriginReport, OriginModerator, OriginRandom, maxOrigin
+from modules.queue.Origin import Origin, OriginReport, OriginModerator, OriginRandom, maxOrigin, originRank, rankOrigin
 
 from datetime import datetime, timedelta
 
 import pymongo
 from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 import numpy as np
 from math import ceil
@@ -23,7 +24,9 @@ class EngineQueue(NamedTuple('EngineQueue', [
         ('precedence', Precedence),
         ('completed', bool),
         ('owner', AuthID),
-        ('date', datetime)
+        ('date', datetime),
+        ('cost', int), # estimated number of engine searches required
+        ('games', List[Game]) # snapshot of the required games, without analysis
     ])):
     @staticmethod
     def new(playerId: PlayerID, origin: Origin, gamesAndPredictions: List[Tuple[Game, int]]):
@@ -52,7 +55,9 @@ class EngineQueue(NamedTuple('EngineQueue', [
             precedence=precedence,
             owner=None,
             completed=False,
-            date=datetime.now())
+            date=datetime.now(),
+            cost=0,
+            games=[gap[0] for gap in gamesAndPredictions if gap[0].id in required])
 
     def complete(self):
         return EngineQueue(
@@ -62,7 +67,9 @@ class EngineQueue(NamedTuple('EngineQueue', [
             precedence=self.precedence,
             completed=True,
             owner=self.owner,
-            date=self.date)
+            date=self.date,
+            cost=self.cost,
+            games=self.games)
 
     @staticmethod
     def merge(engineQueueA, engineQueueB):
@@ -77,32 +84,84 @@ class EngineQueue(NamedTuple('EngineQueue', [
             precedence=max(engineQueueA.precedence, engineQueueB.precedence),
             completed=min(engineQueueA.completed, engineQueueB.completed),
             owner=engineQueueA.owner if engineQueueA.owner is not None else (engineQueueB.owner if engineQueueB.owner is not None else None),
-            date=min(engineQueueA.date, engineQueueB.date)) # retain the oldest datetime so the sorting doesn't mess up
+            date=min(engineQueueA.date, engineQueueB.date), # retain the oldest datetime so the sorting doesn't mess up
+            cost=max(engineQueueA.cost, engineQueueB.cost),
+            games=list({g.id: g for g in engineQueueA.games + engineQueueB.games}.values()))
+
+    def requiredGames(self) -> List[Game]:
+        """the snapshot of the games that are still required. Games required before snapshots were stored are missing"""
+        return [g for g in self.games if g.id in self.requiredGameIds]
 
 class EngineQueueBSONHandler:
     @staticmethod
     def reads(bson: Dict) -> EngineQueue:
         return EngineQueue(
             id=bson['_id'],
-            origin=bson['origin'],
+            # origin is set when the entry is created, later requests raise originRank
+            origin=maxOrigin(bson['origin'], rankOrigin(bson.get('originRank', 0))),
             precedence=bson['precedence'],
             requiredGameIds=list(set(bson.get('requiredGameIds', []))),
-            completed=bson.get('complete', False),
+            completed=bson.get('completed', False),
             owner=bson.get('owner'),
-            date=bson.get('date'))
+            date=bson.get('date'),
+            cost=bson.get('cost', 0),
+            games=[EngineQueueBSONHandler.readsGame(gid, g) for gid, g in bson.get('games', {}).items()])
+
+    @staticmethod
+    def readsGame(gameId: GameID, bson: Dict) -> Game:
+        return Game(
+            id=gameId,
+            white=bson.get('white'),
+            black=bson.get('black'),
+            pgn=bson['pgn'],
+            emts=bson.get('emts'),
+            analysis=[])
+
+    @staticmethod
+    def writesGame(game: Game) -> Dict:
+        return {
+            'white': game.white,
+            'black': game.black,
+            'pgn': game.pgn,
+            'emts': game.emts
+        }
 
     @staticmethod
     def writes(engineQueue: EngineQueue) -> Dict:
         return {
             '_id': engineQueue.id,
             'origin': engineQueue.origin,
+            'originRank': originRank(engineQueue.origin),
             'precedence': engineQueue.precedence,
             'requiredGameIds': list(set(engineQueue.requiredGameIds)),
             'completed': engineQueue.completed,
             'owner': engineQueue.owner,
-            'date': datetime.now()
+            'date': datetime.now(),
+            'cost': engineQueue.cost,
+            'games': {g.id: EngineQueueBSONHandler.writesGame(g) for g in engineQueue.games}
         }
 
+    @staticmethod
+    def merges(engineQueue: EngineQueue) -> Dict:
+        """update that merges engineQueue into a stored incomplete entry, as EngineQueue.merge would"""
+        update = {
+            '$max': {
+                'precedence': engineQueue.precedence,
+                'originRank': originRank(engineQueue.origin)
+            },
+            '$min': {'date': engineQueue.date},
+            '$addToSet': {'requiredGameIds': {'$each': list(set(engineQueue.requiredGameIds))}},
+            '$setOnInsert': {
+                'origin': engineQueue.origin,
+                'owner': None,
+                'completed': False,
+                'cost': engineQueue.cost # set once everything merged in is known, see setCosts
+            }
+        }
+        if len(engineQueue.games) > 0:
+            update['$set'] = {f'games.{g.id}': EngineQueueBSONHandler.writesGame(g) for g in engineQueue.games}
+        return update
+
 class EngineQueueDB(NamedTuple('EngineQueueDB', [
         ('engineQueueColl', Collection)
     ])):
@@ -111,6 +170,58 @@ class EngineQueueDB(NamedTuple('EngineQueueDB', [
             {'_id': engineQueue.id},
             {'$set': EngineQueueBSONHandler.writes(engineQueue)}, upsert=True)
 
+    def upsert(self, engineQueue: EngineQueue):
+        """
+        merge engineQueue into the stored entry with a single write.
+        If the stored entry is completed it is replaced instead.
+        """
+        try:
+            self.engineQueueColl.update_one(
+                {'_id': engineQueue.id, 'completed': False},
+                EngineQueueBSONHandler.merges(engineQueue), upsert=True)
+        except DuplicateKeyError: # a completed entry exists
+            self.reopen(engineQueue)
+
+    def upsertMany(self, engineQueues: List[EngineQueue]):
+        """upsert for many entries with different ids"""
+        if len(engineQueues) == 0:
+            return
+        try:
+            self.engineQueueColl.bulk_write([pymongo.UpdateOne(
+                {'_id': engineQueue.id, 'completed': False},
+                EngineQueueBSONHandler.merges(engineQueue), upsert=True) for engineQueue in engineQueues], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            for error in errors:
+                self.reopen(engineQueues[error['index']])
+
+    def setCosts(self, costs: List[Tuple[EngineQueueID, int]]):
+        """set the cost of incomplete entries, worked out from the entries as stored"""
+        if len(costs) > 0:
+            self.engineQueueColl.bulk_write([pymongo.UpdateOne(
+                {'_id': _id, 'completed': False},
+                {'$set': {'cost': cost}}) for _id, cost in costs], ordered=False)
+
+    def reopen(self, engineQueue: EngineQueue):
+        """replace a completed entry with engineQueue"""
+        result = self.engineQueueColl.replace_one(
+            {'_id': engineQueue.id, 'completed': True},
+            EngineQueueBSONHandler.writes(engineQueue))
+        if result.matched_count == 0: # reopened by another writer in the meantime
+            self.engineQueueColl.update_one(
+                {'_id': engineQueue.id, 'completed': False},
+                EngineQueueBSONHandler.merges(engineQueue))
+
+    def assign(self, ids: List[EngineQueueID], owner: AuthID) -> List[EngineQueueID]:
+        """give the unowned entries of ids to owner. Returns the ids owner now holds"""
+        self.engineQueueColl.update_many(
+            {'_id': {'$in': list(ids)}, 'owner': None, 'completed': False},
+            {'$set': {'owner': owner}})
+        return [bson['_id'] for bson in self.engineQueueColl.find(
+            {'_id': {'$in': list(ids)}, 'owner': owner, 'completed': False}, {'_id': 1})]
+
     def inProgress(self) -> List[EngineQueue]:
         return [EngineQueueBSONHandler.reads(bson) for bson in self.engineQueueColl.find({'owner': {'$ne': None}, 'completed': False})]
 
@@ -118,6 +229,9 @@ class EngineQueueDB(NamedTuple('EngineQueueDB', [
         bson = self.engineQueueColl.find_one({'_id': _id})
         return None if bson is None else EngineQueueBSONHandler.reads(bson)
 
+    def byIds(self, ids: List[EngineQueueID]) -> List[EngineQueue]:
+        return [EngineQueueBSONHandler.reads(bson) for bson in self.engineQueueColl.find({'_id': {'$in': list(ids)}})]
+
     def byPlayerId(self, playerId: str) -> Opt[EngineQueue]:
         return self.byId(playerId)
 
@@ -128,7 +242,30 @@ class EngineQueueDB(NamedTuple('EngineQueueDB', [
     def updateComplete(self, _id: EngineQueueID, complete: bool):
         self.engineQueueColl.update_one(
             {'_id': _id},
-            {'$set': {'completed': complete, 'owner': None}})
+            {'$set': {'completed': complete, 'owner': None}, '$unset': {'games': '', 'settleCheck': '', 'settled': ''}})
+
+    def requestSettleCheck(self, _id: EngineQueueID, remaining: int):
+        """ask for the verdict on an entry in progress to be checked, with `remaining` games left to analyse"""
+        self.engineQueueColl.update_one(
+            {'_id': _id, 'completed': False},
+            {'$set': {'settleCheck': remaining}})
+
+    def nextSettleCheck(self) -> Opt[Tuple[EngineQueueID, int]]:
+        """atomically take a requested check. (id, remaining)"""
+        bson = self.engineQueueColl.find_one_and_update(
+            filter={'settleCheck': {'$gt': 0}, 'completed': False},
+            update={'$unset': {'settleCheck': ''}},
+            projection={'settleCheck': 1})
+        return None if bson is None else (bson['_id'], bson['settleCheck'])
+
+    def setSettled(self, _id: EngineQueueID):
+        self.engineQueueColl.update_one(
+            {'_id': _id, 'completed': False},
+            {'$set': {'settled': True}})
+
+    def settled(self, _id: EngineQueueID) -> bool:
+        """has a check found that the remaining games of the entry can't change the verdict"""
+        return self.engineQueueColl.find_one({'_id': _id, 'settled': True}, {'_id': 1}) is not None
 
     def removePlayerId(self, playerId: PlayerID):
         """remove all jobs related to playerId"""
@@ -152,24 +289,73 @@ class EngineQueueDB(NamedTuple('EngineQueueDB', [
             sort=[('date', pymongo.ASCENDING)])
         return None if bson is None else EngineQueueBSONHandler.reads(bson)
 
-    def nextUnprocessed(self, name: AuthID) -> Opt[EngineQueue]:
-        """find the next job to process against owner's name"""
-        incompleteBSON = self.engineQueueColl.find_one({'owner': name, 'completed': {'$ne': True}})
+    def nextUnprocessed(self, name: AuthID, queries: List[Dict] = [{}], holding: List[EngineQueueID] = [], maxHeld: int = 1, index: Opt['QueueIndex'] = None, lookahead: int = 64) -> Opt[EngineQueue]:
+        """
+        find the next job to process against owner's name.
+        queries are tried in order of preference, the first that matches an unowned job wins.
+        holding: jobs the owner already has in hand, which are not handed out again.
+        maxHeld: the most incomplete jobs an owner may hold at once.
+        index: QueueIndex to take the order from instead of sorting the collection.
+        """
+        incompleteBSON = self.engineQueueColl.find_one({'owner': name, 'completed': {'$ne': True}, '_id': {'$nin': holding}})
         if incompleteBSON is not None: # owner has unfinished business
             logging.debug(f'{name} is returning to complete {incompleteBSON}')
             return EngineQueueBSONHandler.reads(incompleteBSON)
 
-        engineQueueBSON = self.engineQueueColl.find_one_and_update(
-            filter={'owner': None, 'completed': False},
+        if self.engineQueueColl.count_documents({'owner': name, 'completed': {'$ne': True}}) >= maxHeld:
+            logging.debug(f'{name} already holds {maxHeld} jobs')
+            return None
+
+        for query in queries:
+            engineQueueBSON = self.claim(name, query) if index is None else self.claimIndexed(name, query, index, lookahead)
+            if engineQueueBSON is not None:
+                return EngineQueueBSONHandler.reads(engineQueueBSON)
+        return None
+
+    def claim(self, name: AuthID, query: Dict = {}) -> Opt[Dict]:
+        """atomically take ownership of the highest precedence unowned job matching query"""
+        return self.engineQueueColl.find_one_and_update(
+            filter={'owner': None, 'completed': False, **query},
             update={'$set': {'owner': name}},
             sort=[("precedence", pymongo.DESCENDING),
                 ("date", pymongo.ASCENDING)])
-        return None if engineQueueBSON is None else EngineQueueBSONHandler.reads(engineQueueBSON)
+
+    def claimIndexed(self, name: AuthID, query: Dict, index: 'QueueIndex', lookahead: int) -> Opt[Dict]:
+        """
+        claim using the order from index, looking at most `lookahead` entries deep.
+        Falls back to claim if nothing in the window can be claimed, as the index may be missing entries.
+        """
+        candidates = index.top(lookahead)
+        if len(candidates) == 0:
+            return self.claim(name, query)
+        claimable = {bson['_id'] for bson in self.engineQueueColl.find(
+            {'_id': {'$in': candidates}, 'owner': None, 'completed': False}, {'_id': 1})}
+        for _id in candidates:
+            if _id not in claimable: # claimed or completed elsewhere
+                index.discard(_id)
+        if len(query) > 0 and len(claimable) > 0:
+            claimable = {bson['_id'] for bson in self.engineQueueColl.find(
+                {'_id': {'$in': list(claimable)}, **query}, {'_id': 1})}
+        for _id in candidates:
+            if _id in claimable:
+                bson = self.engineQueueColl.find_one_and_update(
+                    filter={'_id': _id, 'owner': None, 'completed': False},
+                    update={'$set': {'owner': name}})
+                index.discard(_id)
+                if bson is not None:
+                    return bson
+        return self.claim(name, query)
+
+    def unownedSummaries(self) -> Iterable[Dict]:
+        """the ranking fields of every entry that can be handed out"""
+        return self.engineQueueColl.find(
+            {'owner': None, 'completed': False},
+            {'precedence': 1, 'date': 1, 'originRank': 1, 'cost': 1})
 
     def top(self, amount: int = 20) -> List[EngineQueue]:
         """Return the top `amount` of players, ranked by precedence"""
         bsons = self.engineQueueColl.find(
-            filter={'complete': False},
+            filter={'completed': False},
             sort=[("precedence", pymongo.DESCENDING),
                 ("date", pymongo.ASCENDING)]).limit(amount)
         return [EngineQueueBSONHandler.reads(b) for b in bsons]
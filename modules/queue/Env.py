@@ -6,10 +6,20 @@ from pymongo.collection import Collection
 
 from modules.queue.EngineQueue import EngineQueueDB
 from modules.queue.IrwinQueue import IrwinQueueDB
+from modules.queue.EngineClient import EngineClientDB
+from modules.queue.QueueSignal import QueueSignalDB, QueueNotifier
+from modules.queue.QueueIndex import QueueIndex
+from modules.queue.PositionQueue import PositionQueueDB
 
 class Env:
     def __init__(self, config: ConfigWrapper, db: Collection):
+        self.config = config
         self.db = db
 
         self.engineQueueDB = EngineQueueDB(db[config['queue coll engine']])
-        self.irwinQueueDB = IrwinQueueDB(db[config['queue coll irwin']])
\ No newline at end of file
+        self.irwinQueueDB = IrwinQueueDB(db[config['queue coll irwin']])
+        self.positionQueueDB = PositionQueueDB(db[config['queue coll position']])
+        self.engineClientDB = EngineClientDB(db[config['queue coll engine_client']])
+        self.queueSignalDB = QueueSignalDB.new(db, config['queue coll signal'])
+        self.queueNotifier = QueueNotifier(self.queueSignalDB)
+        self.queueIndex = QueueIndex(self.engineQueueDB, self.queueNotifier, config['queue index rebuild'] or 300)
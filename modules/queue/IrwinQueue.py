@@ -1,16 +1,18 @@
 """Queue item for deep analysis by irwin"""
 from default_imports import *
 
+from modules.auth.Auth import AuthID
 from modules.queue.Origin import Origin
 from modules.game.Game import PlayerID
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import pymongo
 from pymongo.collection import Collection
 
 IrwinQueue = NamedTuple('IrwinQueue', [
         ('id', PlayerID),
-        ('origin', Origin)
+        ('origin', Origin),
+        ('owner', AuthID) # the client that completed the engine analysis
     ])
 
 class IrwinQueueBSONHandler:
@@ -18,13 +20,15 @@ class IrwinQueueBSONHandler:
     def reads(bson: Dict) -> IrwinQueue:
         return IrwinQueue(
             id=bson['_id'],
-            origin=bson['origin'])
+            origin=bson['origin'],
+            owner=bson.get('owner'))
 
     @staticmethod
     def writes(irwinQueue: IrwinQueue) -> Dict:
         return {
             '_id': irwinQueue.id,
             'origin': irwinQueue.origin,
+            'owner': irwinQueue.owner,
             'date': datetime.now()
         }
 
@@ -32,16 +36,37 @@ class IrwinQueueDB(NamedTuple('IrwinQueueDB', [
         ('irwinQueueColl', Collection)
     ])):
     def write(self, irwinQueue: IrwinQueue):
+        """queue irwinQueue. An entry a worker has claimed is released, so the worker doesn't complete the new request"""
         self.irwinQueueColl.update_one(
-            {'_id': irwinQueue.id}, 
-            {'$set': IrwinQueueBSONHandler.writes(irwinQueue)},
+            {'_id': irwinQueue.id},
+            {'$set': IrwinQueueBSONHandler.writes(irwinQueue), '$unset': {'worker': '', 'claimed': ''}},
             upsert=True)
 
     def removePlayerId(self, playerId: PlayerID):
         self.irwinQueueColl.remove({'_id': playerId})
 
-    def nextUnprocessed(self) -> Opt[IrwinQueue]:
-        irwinQueueBSON = self.irwinQueueColl.find_one_and_delete(
-            filter={},
+    def nextUnprocessed(self, worker: str, timeout: timedelta) -> Opt[IrwinQueue]:
+        """
+        claim the oldest entry for worker. Entries claimed more than `timeout` ago are claimed again,
+        as their worker has died. The entry stays on the queue until worker completes it
+        """
+        now = datetime.now()
+        irwinQueueBSON = self.irwinQueueColl.find_one_and_update(
+            filter={'$or': [{'claimed': None}, {'claimed': {'$lt': now - timeout}}]},
+            update={'$set': {'worker': worker, 'claimed': now}},
             sort=[("date", pymongo.ASCENDING)])
-        return None if irwinQueueBSON is None else IrwinQueueBSONHandler.reads(irwinQueueBSON)
\ No newline at end of file
+        return None if irwinQueueBSON is None else IrwinQueueBSONHandler.reads(irwinQueueBSON)
+
+    def complete(self, _id: PlayerID, worker: str):
+        """remove an entry worker has finished with, unless it was queued again since it was claimed"""
+        self.irwinQueueColl.delete_one({'_id': _id, 'worker': worker})
+
+    def nextUnprocessedBatch(self, worker: str, size: int, timeout: timedelta) -> List[IrwinQueue]:
+        """claim up to `size` of the oldest entries. Each claim is atomic so many workers can share the queue"""
+        irwinQueues = []
+        for _ in range(size):
+            irwinQueue = self.nextUnprocessed(worker, timeout)
+            if irwinQueue is None:
+                break
+            irwinQueues.append(irwinQueue)
+        return irwinQueues
@@ -12,4 +12,13 @@ def maxOrigin(a, b):
     if a == OriginReport or b == OriginReport:
         return OriginReport
 
-    return OriginRandom
\ No newline at end of file
+    return OriginRandom
+
+originRanks = {OriginRandom: 0, OriginReport: 1, OriginModerator: 2}
+
+def originRank(origin: Origin) -> int:
+    """origins ordered as in maxOrigin, so the database can merge them with $max"""
+    return originRanks.get(origin, 0)
+
+def rankOrigin(rank: int) -> Origin:
+    return next((origin for origin, r in originRanks.items() if r == rank), OriginRandom)
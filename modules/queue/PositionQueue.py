@@ -0,0 +1,128 @@
+"""Queue item for the analysis of a single position, shared by every queued player whose games reach it"""
+from default_imports import *
+
+from modules.auth.Auth import AuthID
+from modules.game.Player import PlayerID
+from modules.game.AnalysedPosition import AnalysedPositionID
+
+from datetime import datetime, timedelta
+
+import pymongo
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+# owner of engine queue entries that are being analysed position by position
+PositionSchedulerOwner = AuthID('positionScheduler')
+
+class PositionQueue(NamedTuple('PositionQueue', [
+        ('id', AnalysedPositionID), # zobrist hash of the position
+        ('fen', str),
+        ('multipv', int), # most lines any player needs from this position
+        ('playerIds', List[PlayerID]), # players waiting on this position
+        ('owner', Opt[AuthID]),
+        ('claimed', Opt[datetime]),
+        ('date', datetime)
+    ])):
+    @staticmethod
+    def new(positionId: AnalysedPositionID, fen: str, multipv: int, playerIds: List[PlayerID]):
+        return PositionQueue(
+            id=positionId,
+            fen=fen,
+            multipv=multipv,
+            playerIds=playerIds,
+            owner=None,
+            claimed=None,
+            date=datetime.now())
+
+    @staticmethod
+    def merge(positionQueueA, positionQueueB):
+        return PositionQueue(
+            id=positionQueueA.id,
+            fen=positionQueueA.fen,
+            multipv=max(positionQueueA.multipv, positionQueueB.multipv),
+            playerIds=list(set(positionQueueA.playerIds) | set(positionQueueB.playerIds)),
+            owner=positionQueueA.owner,
+            claimed=positionQueueA.claimed,
+            date=min(positionQueueA.date, positionQueueB.date))
+
+    def toJson(self) -> Dict:
+        """what a client needs to analyse the position"""
+        return {
+            'id': self.id,
+            'fen': self.fen,
+            'multipv': self.multipv
+        }
+
+class PositionQueueBSONHandler:
+    @staticmethod
+    def reads(bson: Dict) -> PositionQueue:
+        return PositionQueue(
+            id=bson['_id'],
+            fen=bson['fen'],
+            multipv=bson['multipv'],
+            playerIds=bson.get('playerIds', []),
+            owner=bson.get('owner'),
+            claimed=bson.get('claimed'),
+            date=bson['date'])
+
+    @staticmethod
+    def merges(positionQueue: PositionQueue) -> Dict:
+        return {
+            '$max': {'multipv': positionQueue.multipv},
+            '$addToSet': {'playerIds': {'$each': positionQueue.playerIds}},
+            '$setOnInsert': {
+                'fen': positionQueue.fen,
+                'owner': None,
+                'claimed': None,
+                'date': positionQueue.date
+            }
+        }
+
+class PositionQueueDB(NamedTuple('PositionQueueDB', [
+        ('positionQueueColl', Collection)
+    ])):
+    def upsertMany(self, positionQueues: List[PositionQueue]):
+        """merge positionQueues, which must have different ids, into the queue"""
+        if len(positionQueues) == 0:
+            return
+        updates = lambda pqs: [pymongo.UpdateOne(
+            {'_id': pq.id}, PositionQueueBSONHandler.merges(pq), upsert=True) for pq in pqs]
+        try:
+            self.positionQueueColl.bulk_write(updates(positionQueues), ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            # inserted by another process at the same time, so the retry updates
+            self.positionQueueColl.bulk_write(updates([positionQueues[error['index']] for error in errors]), ordered=False)
+
+    def claimBatch(self, name: AuthID, amount: int, timeout: timedelta) -> List[PositionQueue]:
+        """
+        take ownership of up to `amount` of the oldest unowned positions.
+        Positions claimed more than `timeout` ago are assumed abandoned and handed out again.
+        """
+        claimable = {'$or': [{'owner': None}, {'claimed': {'$lt': datetime.now() - timeout}}]}
+        ids = [bson['_id'] for bson in self.positionQueueColl.find(claimable, {'_id': 1}).sort('date', pymongo.ASCENDING).limit(amount)]
+        if len(ids) == 0:
+            return []
+        now = datetime.now()
+        self.positionQueueColl.update_many(
+            {'_id': {'$in': ids}, **claimable},
+            {'$set': {'owner': name, 'claimed': now}})
+        return [PositionQueueBSONHandler.reads(bson) for bson in self.positionQueueColl.find({'_id': {'$in': ids}, 'owner': name, 'claimed': now})]
+
+    def byIds(self, ids: List[AnalysedPositionID]) -> List[PositionQueue]:
+        return [PositionQueueBSONHandler.reads(bson) for bson in self.positionQueueColl.find({'_id': {'$in': list(ids)}})]
+
+    def complete(self, name: AuthID, idsAndMultipvs: List[Tuple[AnalysedPositionID, int]]):
+        """
+        remove positions analysed by name. Positions that were raised to a higher multipv
+        while they were being analysed are released to be analysed again.
+        """
+        if len(idsAndMultipvs) == 0:
+            return
+        self.positionQueueColl.bulk_write([pymongo.DeleteOne(
+            {'_id': _id, 'multipv': {'$lte': multipv}}) for _id, multipv in idsAndMultipvs], ordered=False)
+        self.positionQueueColl.update_many(
+            {'_id': {'$in': [_id for _id, _ in idsAndMultipvs]}, 'owner': name},
+            {'$set': {'owner': None, 'claimed': None}})
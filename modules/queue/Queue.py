@@ -2,26 +2,150 @@ from default_imports import *
 
 from modules.queue.Env import Env
 from modules.queue.EngineQueue import EngineQueue, EngineQueueID
+from modules.queue.IrwinQueue import IrwinQueue
+from modules.queue.PositionQueue import PositionQueue
+from modules.game.AnalysedPosition import AnalysedPositionID
+from modules.queue.EngineClient import EngineClient, SearchSpeed
+from modules.queue.Origin import OriginModerator, originRank
 from modules.game.Player import PlayerID
 
-from modules.auth.Auth import Authable
+from modules.auth.Auth import Authable, AuthID
+
+from datetime import datetime, timedelta
+from math import ceil
+import time
 
 class Queue(NamedTuple('Queue', [('env', Env)])):
-    def nextEngineAnalysis(self, id: EngineQueueID) -> Opt[EngineQueue]:
-        return self.env.engineQueueDB.nextUnprocessed(id)
+    def nextEngineAnalysis(self, id: AuthID, speed: Opt[SearchSpeed] = None, wait: Number = 0, holding: List[EngineQueueID] = []) -> Opt[EngineQueue]:
+        """
+        Hand out the next job to client `id`.
+        If there is nothing to do, block for up to `wait` seconds (capped at 'queue job long_poll',
+        0 and no long polling if unset), waking whenever new work is queued.
+        holding: jobs the client has already prefetched. At most 'queue job max_held' (default 2,
+        a job and a prefetched one) are handed out at once.
+        """
+        deadline = time.time() + min(wait, self.env.config['queue job long_poll'] or 0)
+        while True:
+            generation = self.env.queueNotifier.generation
+            engineQueue = self.dispatchEngineAnalysis(id, speed, holding)
+            remaining = deadline - time.time()
+            if engineQueue is not None or remaining <= 0:
+                return engineQueue
+            self.env.queueNotifier.wait(generation, remaining)
+
+    def dispatchEngineAnalysis(self, id: AuthID, speed: Opt[SearchSpeed] = None, holding: List[EngineQueueID] = []) -> Opt[EngineQueue]:
+        """
+        The server measured speed of the client is preferred over the speed it reports.
+        Fast clients get moderator requests first. Slow clients only get them once they
+        have waited 'queue dispatch urgent_grace' seconds, and otherwise get jobs sized to their speed.
+        """
+        engineClient = self.env.engineClientDB.byId(id)
+        if engineClient is not None and engineClient.searchSpeed() is not None:
+            speed = engineClient.searchSpeed()
+
+        self.env.queueIndex.start()
+        engineQueue = self.env.engineQueueDB.nextUnprocessed(id, self.dispatchQueries(speed), holding, self.env.config['queue job max_held'] or 2,
+            index=self.env.queueIndex, lookahead=self.env.config['queue index lookahead'] or 64)
+        if engineQueue is not None:
+            self.env.engineClientDB.startJob(id)
+        else:
+            self.env.engineClientDB.seen(id)
+        return engineQueue
+
+    def dispatchQueries(self, speed: Opt[SearchSpeed]) -> List[Dict]:
+        """engineQueue queries to try in order, for a client running at speed"""
+        if speed is None:
+            return [{}]
+
+        fitting = {'cost': {'$lte': int(speed * (self.env.config['queue job target_time'] or 300))}}
+
+        if self.isFast(speed):
+            return [{'originRank': originRank(OriginModerator)}, fitting, {}]
 
-    def completeEngineAnalysis(self, _id: EngineQueueID):
+        grace = datetime.now() - timedelta(seconds=self.env.config['queue dispatch urgent_grace'] or 60)
+        notUrgent = {'$or': [{'originRank': {'$ne': originRank(OriginModerator)}}, {'date': {'$lt': grace}}]}
+        return [{**notUrgent, **fitting}, notUrgent]
+
+    def isFast(self, speed: SearchSpeed) -> bool:
+        """is speed within the fastest 'queue dispatch fast_fraction' of active clients"""
+        window = timedelta(seconds=self.env.config['queue dispatch active_window'] or 600)
+        speeds = sorted([s for s in (c.searchSpeed() for c in self.env.engineClientDB.active(window)) if s is not None], reverse=True)
+        if len(speeds) == 0:
+            return True
+        fast = ceil((self.env.config['queue dispatch fast_fraction'] or 0.25) * len(speeds)) # the fastest client always counts
+        cutoff = speeds[min(len(speeds), max(1, fast)) - 1]
+        return speed >= cutoff
+
+    def registerEngineClient(self, engineClient: EngineClient):
+        return self.env.engineClientDB.register(engineClient)
+
+    def completeEngineAnalysis(self, _id: EngineQueueID, owner: Opt[AuthID] = None, searches: int = 0, elapsed: Opt[Number] = None):
+        if owner is not None:
+            self.env.engineClientDB.completeJob(owner, searches, elapsed)
         return self.env.engineQueueDB.updateComplete(_id, complete=True)
 
-    def nextIrwinAnalysis(self):
-        return None
-        #return self.env.irwinAnalysisQueueDB.
+    def requestSettleCheck(self, _id: EngineQueueID, remaining: int):
+        return self.env.engineQueueDB.requestSettleCheck(_id, remaining)
+
+    def nextSettleChecks(self, amount: int) -> List[Tuple[EngineQueueID, int]]:
+        checks = []
+        for _ in range(amount):
+            check = self.env.engineQueueDB.nextSettleCheck()
+            if check is None:
+                break
+            checks.append(check)
+        return checks
+
+    def settle(self, _id: EngineQueueID):
+        return self.env.engineQueueDB.setSettled(_id)
 
-    def queueNerualAnalysis(self, playerId: PlayerID):
-        ...
+    def settled(self, _id: EngineQueueID) -> bool:
+        return self.env.engineQueueDB.settled(_id)
+
+    def nextIrwinAnalyses(self, worker: str, amount: int) -> List[IrwinQueue]:
+        """
+        claim up to amount entries for worker. Claims held for 'irwin worker claim_timeout' seconds
+        (default 600) without being completed are taken by other workers
+        """
+        timeout = timedelta(seconds=self.env.config['irwin worker claim_timeout'] or 600)
+        return self.env.irwinQueueDB.nextUnprocessedBatch(worker, amount, timeout)
+
+    def completeIrwinAnalysis(self, worker: str, playerId: PlayerID):
+        return self.env.irwinQueueDB.complete(playerId, worker)
+
+    def queueNeuralAnalysis(self, irwinQueue: IrwinQueue):
+        return self.env.irwinQueueDB.write(irwinQueue)
 
     def queueEngineAnalysis(self, engineQueue: EngineQueue):
-        return self.env.engineQueueDB.write(engineQueue)
+        self.env.engineQueueDB.write(engineQueue)
+        self.env.queueSignalDB.signal(engineQueue)
+
+    def queueEngineAnalyses(self, engineQueues: List[EngineQueue]):
+        """merge engineQueues into the queue. Safe to call from several processes at once"""
+        self.env.engineQueueDB.upsertMany(engineQueues)
+        self.env.queueSignalDB.signalMany(engineQueues)
+
+    def setEngineAnalysisCosts(self, costs: List[Tuple[EngineQueueID, int]]):
+        self.env.engineQueueDB.setCosts(costs)
 
     def engineQueueById(self, playerId: PlayerID):
-        return self.env.engineQueueDB.byPlayerId(playerId)
\ No newline at end of file
+        return self.env.engineQueueDB.byPlayerId(playerId)
+
+    def engineQueuesByIds(self, playerIds: List[PlayerID]) -> List[EngineQueue]:
+        return self.env.engineQueueDB.byIds(playerIds)
+
+    def assignEngineAnalyses(self, ids: List[EngineQueueID], owner: AuthID) -> List[EngineQueueID]:
+        return self.env.engineQueueDB.assign(ids, owner)
+
+    def queuePositions(self, positionQueues: List[PositionQueue]):
+        self.env.positionQueueDB.upsertMany(positionQueues)
+
+    def nextPositions(self, id: AuthID, amount: int) -> List[PositionQueue]:
+        timeout = timedelta(seconds=self.env.config['queue position timeout'])
+        return self.env.positionQueueDB.claimBatch(id, amount, timeout)
+
+    def positionsByIds(self, ids: List[AnalysedPositionID]) -> List[PositionQueue]:
+        return self.env.positionQueueDB.byIds(ids)
+
+    def completePositions(self, id: AuthID, idsAndMultipvs: List[Tuple[AnalysedPositionID, int]]):
+        return self.env.positionQueueDB.complete(id, idsAndMultipvs)
@@ -0,0 +1,131 @@
+"""In memory priority index over the unowned entries of the engine queue"""
+from default_imports import *
+
+from modules.queue.EngineQueue import EngineQueueDB, EngineQueueID, Precedence
+from modules.queue.QueueSignal import QueueNotifier
+
+from datetime import datetime
+import heapq
+import threading
+import time
+
+import pymongo
+
+class IndexEntry(NamedTuple('IndexEntry', [
+        ('precedence', Precedence),
+        ('date', datetime),
+        ('originRank', int),
+        ('cost', int)
+    ])):
+    @staticmethod
+    def fromBSON(bson: Dict):
+        return IndexEntry(
+            precedence=bson.get('precedence', 0),
+            date=bson.get('date') or datetime.now(),
+            originRank=bson.get('originRank', 0),
+            cost=bson.get('cost', 0))
+
+    @staticmethod
+    def merge(a, b):
+        """as EngineQueueBSONHandler.merges"""
+        return IndexEntry(
+            precedence=max(a.precedence, b.precedence),
+            date=min(a.date, b.date),
+            originRank=max(a.originRank, b.originRank),
+            cost=a.cost)
+
+class QueueIndex:
+    """
+    Entries ordered by (precedence desc, date asc), the same as the sort in EngineQueueDB.claim.
+    Built from the collection the first time it is used and rebuilt every 'queue index rebuild' seconds.
+    In between it is kept current from queue signals. Mongo remains the record: an entry is only
+    handed out once it has been claimed there by _id, and entries that fail the claim are dropped.
+    """
+    def __init__(self, engineQueueDB: EngineQueueDB, queueNotifier: QueueNotifier, rebuildInterval: Number):
+        self.engineQueueDB = engineQueueDB
+        self.queueNotifier = queueNotifier
+        self.rebuildInterval = rebuildInterval
+        self.lock = threading.RLock()
+        self.entries = {} # EngineQueueID -> IndexEntry
+        self.heap = [] # (-precedence, date, id). Stale items are skipped when read
+        self.built = None # time of the last rebuild
+        self.pending = None # signals that arrive while a rebuild reads the collection
+        queueNotifier.subscribe(self.signal)
+
+    def start(self):
+        with self.lock:
+            if self.built is None:
+                self.queueNotifier.start() # before the rebuild, so no signal falls between the two
+                self.rebuild()
+                threading.Thread(target=self.run, name='QueueIndex', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.rebuildInterval)
+            try:
+                self.rebuild()
+            except pymongo.errors.PyMongoError as e:
+                logging.warning(f'QueueIndex failed to rebuild: {e}')
+
+    def rebuild(self):
+        """read the index from the collection. Signals that arrive during the read are merged into it"""
+        with self.lock:
+            self.pending = {}
+        try:
+            entries = {bson['_id']: IndexEntry.fromBSON(bson) for bson in self.engineQueueDB.unownedSummaries()}
+            with self.lock:
+                for _id, entry in self.pending.items():
+                    entries[_id] = entry if _id not in entries else IndexEntry.merge(entries[_id], entry)
+                heap = [(-e.precedence, e.date, _id) for _id, e in entries.items()]
+                heapq.heapify(heap)
+                self.entries, self.heap = entries, heap
+                self.built = time.time()
+        finally:
+            with self.lock:
+                self.pending = None
+        logging.debug(f'QueueIndex rebuilt with {len(entries)} entries')
+
+    def signal(self, bson: Dict):
+        """a queue signal. Signals without a precedence come from older writers and are left to the rebuild"""
+        if 'precedence' not in bson:
+            return
+        self.update(bson['engineQueueId'], IndexEntry.fromBSON(bson))
+
+    def update(self, _id: EngineQueueID, entry: IndexEntry):
+        with self.lock:
+            if self.pending is not None:
+                self.pending[_id] = entry if _id not in self.pending else IndexEntry.merge(self.pending[_id], entry)
+            if _id in self.entries:
+                entry = IndexEntry.merge(self.entries[_id], entry)
+            self.entries[_id] = entry
+            heapq.heappush(self.heap, (-entry.precedence, entry.date, _id))
+            if len(self.heap) > 2*len(self.entries) + 1024:
+                self.compact()
+
+    def discard(self, _id: EngineQueueID):
+        with self.lock:
+            self.entries.pop(_id, None)
+
+    def compact(self):
+        self.heap = [(-e.precedence, e.date, _id) for _id, e in self.entries.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, amount: int) -> List[EngineQueueID]:
+        """ids of the `amount` highest ranked entries, best first"""
+        with self.lock:
+            taken = []
+            while len(self.heap) > 0 and len(taken) < amount:
+                item = heapq.heappop(self.heap)
+                # stale and duplicate items are dropped for good
+                if self.current(item) and all(item[2] != t[2] for t in taken):
+                    taken.append(item)
+            for item in taken:
+                heapq.heappush(self.heap, item)
+            return [item[2] for item in taken]
+
+    def current(self, item: Tuple) -> bool:
+        entry = self.entries.get(item[2])
+        return entry is not None and entry.precedence == -item[0] and entry.date == item[1]
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,113 @@
+"""Signals that new work has been queued. Lets the web tier wake waiting clients without polling the queue"""
+from default_imports import *
+
+from modules.queue.EngineQueue import EngineQueue
+from modules.queue.Origin import originRank
+
+from typing import Callable
+import threading
+import time
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo.collection import Collection
+from pymongo.cursor import CursorType
+from pymongo.database import Database
+from pymongo.errors import CollectionInvalid
+
+class QueueSignalDB(NamedTuple('QueueSignalDB', [
+        ('queueSignalColl', Collection)
+    ])):
+    """
+    The signal collection is capped, so it can be tailed and never needs cleaning up.
+    """
+    @staticmethod
+    def new(db: Database, name: str, size: int = 2**20):
+        try:
+            db.create_collection(name, capped=True, size=size)
+        except CollectionInvalid: # already exists
+            pass
+        return QueueSignalDB(db[name])
+
+    @staticmethod
+    def writes(engineQueue: EngineQueue) -> Dict:
+        """the ranking fields are included so listeners can index the entry without reading it"""
+        return {
+            'engineQueueId': engineQueue.id,
+            'precedence': engineQueue.precedence,
+            'date': engineQueue.date,
+            'originRank': originRank(engineQueue.origin),
+            'cost': engineQueue.cost
+        }
+
+    def signal(self, engineQueue: EngineQueue):
+        self.queueSignalColl.insert_one(QueueSignalDB.writes(engineQueue))
+
+    def signalMany(self, engineQueues: List[EngineQueue]):
+        if len(engineQueues) > 0:
+            self.queueSignalColl.insert_many([QueueSignalDB.writes(engineQueue) for engineQueue in engineQueues])
+
+    def lastId(self) -> Opt[ObjectId]:
+        """_id of the newest signal, to tail from"""
+        last = self.queueSignalColl.find_one(sort=[('$natural', pymongo.DESCENDING)])
+        return None if last is None else last['_id']
+
+    def tail(self, after: Opt[ObjectId]) -> Iterable[Dict]:
+        """yield signals written after the signal with _id after, or every signal if it is None. Never returns"""
+        query = {} if after is None else {'_id': {'$gt': after}}
+        while True:
+            cursor = self.queueSignalColl.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                for bson in cursor:
+                    query = {'_id': {'$gt': bson['_id']}}
+                    yield bson
+            time.sleep(1) # cursor dies if the collection is empty
+
+class QueueNotifier:
+    """
+    Wakes threads that are waiting for work whenever a signal arrives.
+    One thread per process tails the signal collection, started the first time something waits.
+    """
+    def __init__(self, queueSignalDB: QueueSignalDB):
+        self.queueSignalDB = queueSignalDB
+        self.condition = threading.Condition()
+        self.generation = 0 # number of signals seen
+        self.thread = None
+        self.subscribers = []
+
+    def subscribe(self, subscriber: Callable[[Dict], None]):
+        """call subscriber with every signal, before waiting threads are woken"""
+        self.subscribers.append(subscriber)
+
+    def wait(self, since: int, timeout: float) -> bool:
+        """
+        block until a signal newer than generation `since` arrives, or timeout.
+        Returns True if woken by a signal.
+        """
+        self.start()
+        with self.condition:
+            return self.condition.wait_for(lambda: self.generation > since, timeout)
+
+    def start(self):
+        """
+        start tailing. The position to tail from is read before returning,
+        so every signal written after start returns is seen
+        """
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=(self.queueSignalDB.lastId(),), name='QueueNotifier', daemon=True)
+                self.thread.start()
+
+    def run(self, after: Opt[ObjectId]):
+        while True:
+            try:
+                for bson in self.queueSignalDB.tail(after):
+                    after = bson['_id']
+                    for subscriber in self.subscribers:
+                        subscriber(bson)
+                    with self.condition:
+                        self.generation += 1
+                        self.condition.notify_all()
+            except pymongo.errors.PyMongoError as e:
+                logging.warning(f'QueueNotifier lost the signal collection: {e}. Retrying in 5 sec')
+                time.sleep(5)
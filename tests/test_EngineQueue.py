@@ -0,0 +1,95 @@
+from default_imports import *
+
+from modules.game.Game import Game
+from modules.queue.EngineQueue import EngineQueue, EngineQueueBSONHandler, EngineQueueDB
+from modules.queue.Origin import OriginRandom, OriginReport, OriginModerator, originRank
+
+from pymongo.errors import DuplicateKeyError
+
+from datetime import datetime
+
+def game(gameId):
+    return Game(id=gameId, white='a', black='b', pgn=['e4', 'e5'], emts=[10, 20], analysis=[])
+
+def entry(origin, gameIds, precedence, date, cost=0):
+    return EngineQueue(
+        id='player',
+        origin=origin,
+        requiredGameIds=gameIds,
+        precedence=precedence,
+        completed=False,
+        owner=None,
+        date=date,
+        cost=cost,
+        games=[game(g) for g in gameIds])
+
+class Collection:
+    """stands in for the engine queue collection, recording the writes made to it"""
+    def __init__(self, completed=False):
+        self.completed = completed
+        self.writes = []
+
+    def update_one(self, filter, update, upsert=False):
+        self.writes.append(('update_one', filter, update, upsert))
+        if upsert and self.completed: # the filter misses the completed entry, and the insert clashes with it
+            raise DuplicateKeyError('E11000')
+
+    def bulk_write(self, requests, ordered=True):
+        self.writes.append(('bulk_write', [(r._filter, r._doc) for r in requests]))
+
+    def replace_one(self, filter, replacement):
+        self.writes.append(('replace_one', filter, replacement))
+        return type('UpdateResult', (), {'matched_count': 1})
+
+def test_merges():
+    b = entry(OriginReport, ['g2', 'g3', 'g2'], 5100, datetime(2020, 1, 1), cost=20)
+    update = EngineQueueBSONHandler.merges(b)
+    assert update['$max'] == {'precedence': 5100, 'originRank': originRank(OriginReport)}
+    assert update['$min'] == {'date': datetime(2020, 1, 1)}
+    assert sorted(update['$addToSet']['requiredGameIds']['$each']) == ['g2', 'g3']
+    assert update['$setOnInsert'] == {'origin': OriginReport, 'owner': None, 'completed': False, 'cost': 20}
+    assert update['$set'] == {f'games.{g}': EngineQueueBSONHandler.writesGame(game(g)) for g in ('g2', 'g3')}
+
+def test_merges_without_games_sets_nothing():
+    assert '$set' not in EngineQueueBSONHandler.merges(entry(OriginRandom, [], 0, datetime(2020, 1, 1)))
+
+def test_games_are_read_back_by_id():
+    bson = EngineQueueBSONHandler.writes(entry(OriginRandom, ['g1', 'g2'], 10, datetime(2020, 1, 1)))
+    engineQueue = EngineQueueBSONHandler.reads({**bson, 'requiredGameIds': ['g2']})
+    assert [g.id for g in engineQueue.requiredGames()] == ['g2']
+
+def test_merges_does_not_set_fields_it_merges():
+    update = EngineQueueBSONHandler.merges(entry(OriginModerator, ['g1'], 100000, datetime(2020, 1, 1)))
+    merged = set(update['$max']) | set(update['$min']) | set(update['$addToSet']) | set(update['$set'])
+    assert merged.isdisjoint(update['$setOnInsert'])
+
+def test_origin_is_raised_by_origin_rank():
+    bson = EngineQueueBSONHandler.writes(entry(OriginRandom, ['g1'], 10, datetime(2020, 1, 1)))
+    bson['originRank'] = originRank(OriginModerator) # as a later $max would leave it
+    assert EngineQueueBSONHandler.reads(bson).origin == OriginModerator
+    bson['originRank'] = 0
+    assert EngineQueueBSONHandler.reads(bson).origin == OriginRandom
+
+def test_upsert_merges_into_an_incomplete_entry():
+    coll = Collection()
+    b = entry(OriginReport, ['g1'], 5000, datetime(2020, 1, 1))
+    EngineQueueDB(coll).upsert(b)
+    assert coll.writes == [('update_one', {'_id': 'player', 'completed': False}, EngineQueueBSONHandler.merges(b), True)]
+
+def test_upsert_replaces_a_completed_entry():
+    coll = Collection(completed=True)
+    b = entry(OriginReport, ['g1'], 5000, datetime(2020, 1, 1))
+    EngineQueueDB(coll).upsert(b)
+    method, filter, replacement = coll.writes[1]
+    assert (method, filter) == ('replace_one', {'_id': 'player', 'completed': True})
+    assert replacement['completed'] is False
+    assert replacement['requiredGameIds'] == ['g1']
+
+def test_set_costs_replaces_the_stored_cost():
+    coll = Collection()
+    EngineQueueDB(coll).setCosts([('a', 12), ('b', 0)])
+    assert coll.writes == [('bulk_write', [
+        ({'_id': 'a', 'completed': False}, {'$set': {'cost': 12}}),
+        ({'_id': 'b', 'completed': False}, {'$set': {'cost': 0}})])]
+    EngineQueueDB(coll).setCosts([])
+    assert len(coll.writes) == 1
@@ -0,0 +1,79 @@
+from default_imports import *
+
+from conf.ConfigWrapper import ConfigWrapper
+from modules.irwin.InferenceBatcher import InferenceBatcher, Histogram
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy as np
+import pytest
+
+class Model:
+    """doubles its first input and sums the rows of its second, recording the batch sizes it is called with"""
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def predict(self, inputs):
+        with self.lock:
+            self.batches.append(len(inputs[0]))
+        return [2*inputs[0], inputs[1].sum(axis=1)]
+
+def inputs(start, size):
+    return [np.arange(start, start + size, dtype=np.float32), np.ones((size, 3), dtype=np.float32)*start]
+
+def test_callers_get_their_own_rows():
+    model = Model()
+    batcher = InferenceBatcher('test', model.predict, wait=0.05, maxBatch=1000)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: batcher.predict(inputs(10*i, i + 1)), range(8)))
+    for i, (doubled, summed) in enumerate(results):
+        np.testing.assert_array_equal(doubled, 2*np.arange(10*i, 10*i + i + 1))
+        np.testing.assert_array_equal(summed, np.full(i + 1, 30*i))
+    assert sum(model.batches) == sum(range(1, 9))
+    assert len(model.batches) < 8 # some calls were combined
+
+def test_batches_stop_at_max_batch():
+    model = Model()
+    batcher = InferenceBatcher('test', model.predict, wait=0.05, maxBatch=4)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: batcher.predict(inputs(i, 2)), range(8)))
+    assert max(model.batches) <= 4
+
+def test_single_output_models():
+    batcher = InferenceBatcher('test', lambda x: x[0] + 1, wait=0.001, maxBatch=8)
+    (outputs,) = batcher.predict(inputs(0, 3))
+    np.testing.assert_array_equal(outputs, [1, 2, 3])
+
+def test_prediction_errors_go_to_callers():
+    def fail(x):
+        raise ValueError('broken model')
+    batcher = InferenceBatcher('test', fail, wait=0.001, maxBatch=8)
+    with pytest.raises(ValueError):
+        batcher.predict(inputs(0, 2))
+    with pytest.raises(ValueError):
+        batcher.predict(inputs(0, 2))
+
+def test_bad_requests_fail_without_stopping_the_batcher():
+    model = Model()
+    batcher = InferenceBatcher('test', model.predict, wait=0.001, maxBatch=8)
+    with pytest.raises(TypeError):
+        batcher.predict([5]) # no games axis
+    doubled, _ = batcher.predict(inputs(1, 2))
+    np.testing.assert_array_equal(doubled, [2, 4])
+
+def test_from_config():
+    assert InferenceBatcher.fromConfig('test', None, ConfigWrapper({'irwin': {'inference': {}}})) is None
+    assert InferenceBatcher.fromConfig('test', None, ConfigWrapper({'irwin': {}})) is None # configs from before batching
+    batcher = InferenceBatcher.fromConfig('test', Model().predict, ConfigWrapper({'irwin': {'inference': {'batch_wait': 2}}}))
+    assert batcher.wait == 0.002
+    assert batcher.maxBatch == 256
+    doubled, _ = batcher.predict(inputs(3, 1))
+    np.testing.assert_array_equal(doubled, [6])
+
+def test_histogram():
+    histogram = Histogram([1, 10])
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    assert histogram.snapshot() == {'buckets': {'1': 2, '10': 1, '+Inf': 1}, 'count': 4, 'sum': 56.5}
@@ -0,0 +1,168 @@
+from default_imports import *
+
+from modules.irwin.NumpyModel import NumpyModel, reduce, restore, reducedPath, embedding, reshape, flatten, dense, conv1d, lstm
+
+from math import tanh
+import json
+import os
+
+import numpy as np
+import pytest
+
+def array(values):
+    return np.array(values, dtype=np.float32)
+
+def test_embedding():
+    weights = [array([[0, 0], [1, 2], [3, 4]])]
+    np.testing.assert_array_equal(embedding({}, weights, array([[1, 2], [0, 1]])),
+        [[[1, 2], [3, 4]], [[0, 0], [1, 2]]])
+
+def test_reshape_and_flatten():
+    x = array(np.arange(12).reshape(2, 6))
+    assert reshape({'target_shape': [3, 2]}, [], x).shape == (2, 3, 2)
+    np.testing.assert_array_equal(flatten({}, [], reshape({'target_shape': [3, 2]}, [], x)), x)
+
+def test_dense():
+    weights = [array([[1, 2], [3, 4]]), array([1, -1])]
+    np.testing.assert_array_equal(dense({'activation': 'linear'}, weights, array([[1, 1]])), [[5, 5]])
+    np.testing.assert_array_equal(dense({'activation': 'relu'}, [weights[0], array([-10, 0])], array([[1, 1]])), [[0, 6]])
+    np.testing.assert_array_equal(dense({'activation': 'linear', 'use_bias': False}, weights[:1], array([[1, 0]])), [[1, 2]])
+
+def kernel(values):
+    """a (size, 1, 1) kernel for a single channel and filter"""
+    return array(values).reshape(len(values), 1, 1)
+
+def sequence(values):
+    return array(values).reshape(1, len(values), 1)
+
+def test_conv1d_valid():
+    y = conv1d({'activation': 'linear'}, [kernel([1, 2]), array([0])], sequence([1, 2, 3]))
+    np.testing.assert_array_equal(y.ravel(), [1 + 2*2, 2 + 2*3])
+
+def test_conv1d_same():
+    y = conv1d({'activation': 'linear', 'padding': 'same'}, [kernel([1, 1, 1]), array([1])], sequence([1, 2, 3]))
+    np.testing.assert_array_equal(y.ravel(), [1 + 3, 1 + 6, 1 + 5])
+
+def test_conv1d_causal_dilated():
+    # output t is 1*x[t-2] + 2*x[t], with zeros before the sequence
+    config = {'activation': 'linear', 'padding': 'causal', 'dilation_rate': [2]}
+    y = conv1d(config, [kernel([1, 2]), array([0])], sequence([1, 2, 3]))
+    np.testing.assert_array_equal(y.ravel(), [2*1, 2*2, 1 + 2*3])
+
+def test_conv1d_channels_and_filters():
+    # 2 channels in, 2 filters out, kernel size 1: a dense layer at every step
+    weights = [array([[[1, 0], [0, 2]]]), array([0, 1])]
+    y = conv1d({'activation': 'linear'}, weights, array([[[1, 1], [2, 3]]]))
+    np.testing.assert_array_equal(y, [[[1, 3], [2, 7]]])
+
+def test_conv1d_strides_are_not_supported():
+    with pytest.raises(NotImplementedError):
+        conv1d({'activation': 'linear', 'strides': [2]}, [kernel([1]), array([0])], sequence([1, 2]))
+
+# gates in keras order: input, forget, cell, output. A bias of 2.5 opens a hard sigmoid gate, -2.5 closes it
+def lstmWeights(recurrent, forget):
+    return [array([[0, 0, 1, 0]]), array([[0, 0, recurrent, 0]]), array([2.5, forget, 0, 2.5])]
+
+def test_lstm_without_memory():
+    y = lstm({'return_sequences': True}, lstmWeights(0, -2.5), sequence([0.5, -1]))
+    np.testing.assert_allclose(y.ravel(), [tanh(tanh(0.5)), tanh(tanh(-1))], rtol=1e-6)
+
+def test_lstm_forget_gate_keeps_the_cell():
+    y = lstm({'return_sequences': True}, lstmWeights(0, 2.5), sequence([0.5, 0.5]))
+    np.testing.assert_allclose(y.ravel(), [tanh(tanh(0.5)), tanh(2*tanh(0.5))], rtol=1e-6)
+
+def test_lstm_recurrent_kernel():
+    h1 = tanh(tanh(0.5))
+    y = lstm({}, lstmWeights(0.5, -2.5), sequence([0.5, 0.2]))
+    assert y.shape == (1, 1) # the last step only, without return_sequences
+    np.testing.assert_allclose(y.ravel(), [tanh(tanh(0.2 + 0.5*h1))], rtol=1e-6)
+
+def test_lstm_backwards_is_not_supported():
+    with pytest.raises(NotImplementedError):
+        lstm({'go_backwards': True}, lstmWeights(0, 0), sequence([1]))
+
+def layer(name, className, config, inbound):
+    return {'name': name, 'class_name': className, 'config': config, 'inbound_nodes': [[[i, 0, 0, {}] for i in inbound]]}
+
+def graph():
+    """two inputs, a dense layer on each, concatenated and summed by a final dense layer"""
+    return {
+        'layers': [
+            layer('a', 'InputLayer', {}, []),
+            layer('b', 'InputLayer', {}, []),
+            layer('da', 'Dense', {'activation': 'linear'}, ['a']),
+            layer('db', 'Dense', {'activation': 'relu'}, ['b']),
+            layer('drop', 'Dropout', {}, ['db']),
+            layer('join', 'Concatenate', {'axis': -1}, ['da', 'drop']),
+            layer('out', 'Dense', {'activation': 'linear'}, ['join'])
+        ],
+        'input_layers': [['a', 0, 0], ['b', 0, 0]],
+        'output_layers': [['out', 0, 0], ['da', 0, 0]]
+    }
+
+def weights():
+    return {
+        'da': [array([[2]]), array([0])],
+        'db': [array([[1]]), array([-1])],
+        'out': [array([[1], [1]]), array([0])]
+    }
+
+def test_model_graph():
+    model = NumpyModel(graph(), weights())
+    out, da = model.predict([array([[1], [2]]), array([[0], [3]])])
+    np.testing.assert_array_equal(out, [[2 + 0], [4 + 2]])
+    np.testing.assert_array_equal(da, [[2], [4]])
+
+def test_model_batch_size_does_not_change_outputs():
+    model = NumpyModel(graph(), weights())
+    a, b = array(np.arange(10).reshape(10, 1)), array(np.arange(10, 0, -1).reshape(10, 1))
+    for expected, actual in zip(model.predict([a, b]), model.predict([a, b], batch_size=3)):
+        np.testing.assert_array_equal(expected, actual)
+
+def test_unsupported_layers():
+    config = graph()
+    config['layers'][2]['class_name'] = 'GRU'
+    with pytest.raises(NotImplementedError):
+        NumpyModel(config, weights()).predict([array([[1]]), array([[1]])])
+
+def test_reduce_and_restore():
+    kernel = array([[1, -0.5], [0.25, 2]])
+    np.testing.assert_array_equal(restore(reduce(kernel, 'float16')), kernel)
+    quantized, scale = reduce(kernel, 'int8')
+    assert quantized.dtype == np.int8
+    np.testing.assert_array_equal(quantized, [[127, -32], [32, 127]]) # per output unit
+    np.testing.assert_allclose(restore((quantized, scale)), kernel, atol=0.5*scale.max())
+    assert reduce(array([1.5, 2]), 'int8').dtype == np.float32 # biases are kept
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_reduced_weights_are_kept_reduced(precision):
+    model = NumpyModel(graph(), weights(), precision)
+    kernel = model.weights['da'][0]
+    assert (kernel[0] if precision == 'int8' else kernel).dtype == np.dtype(precision)
+    assert model.weights['da'][1].dtype == np.float32 # biases are kept
+    out, _ = model.predict([array([[1], [2]]), array([[0], [3]])])
+    np.testing.assert_allclose(out, [[2], [6]], rtol=1e-2)
+
+def export(path):
+    np.savez_compressed(str(path), config=np.array(json.dumps(graph())),
+        **{f'{name}/{i}': w for name, ws in weights().items() for i, w in enumerate(ws)})
+    return str(path)
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_reduced_export_is_loaded_without_float32_weights(tmp_path, precision):
+    path = export(tmp_path / 'model.npz')
+    NumpyModel.load(path, precision).saveReduced(path)
+    assert os.path.getsize(reducedPath(path, precision)) > 0
+    loaded = NumpyModel.load(path, precision)
+    expected = NumpyModel(graph(), weights(), precision)
+    for name, ws in expected.weights.items():
+        for w, l in zip(ws, loaded.weights[name]):
+            for a, b in zip(w if isinstance(w, tuple) else (w,), l if isinstance(l, tuple) else (l,)):
+                assert a.dtype == b.dtype
+                np.testing.assert_array_equal(a, b)
+
+def test_stale_reduced_export_is_not_used(tmp_path):
+    path = export(tmp_path / 'model.npz')
+    NumpyModel(graph(), {**weights(), 'da': [array([[100]]), array([0])]}, 'float16').saveReduced(path)
+    os.utime(path, (0, 1)) # a newer export replaced the one reduced
+    np.testing.assert_array_equal(restore(NumpyModel.load(path, 'float16').weights['da'][0]), [[2]])
@@ -0,0 +1,38 @@
+from default_imports import *
+
+from conf.ConfigWrapper import ConfigWrapper
+from modules.queue.Queue import Queue
+
+class Client:
+    def __init__(self, speed):
+        self.speed = speed
+
+    def searchSpeed(self):
+        return self.speed
+
+class EngineClientDB:
+    """stands in for EngineClientDB, with the clients that are active"""
+    def __init__(self, speeds):
+        self.clients = [Client(s) for s in speeds]
+
+    def active(self, window):
+        return self.clients
+
+class Env:
+    def __init__(self, speeds, fastFraction):
+        self.config = ConfigWrapper({'queue': {'dispatch': {'fast_fraction': fastFraction}}})
+        self.engineClientDB = EngineClientDB(speeds)
+
+def fast(speeds, fastFraction):
+    queue = Queue(Env(speeds, fastFraction))
+    return [s for s in speeds if queue.isFast(s)]
+
+def test_fast_fraction_admits_only_that_share_of_clients():
+    assert fast([100, 400, 200, 300], 0.25) == [400]
+    assert fast([100, 400, 200, 300], 0.5) == [400, 300]
+    assert fast([100, 200, 300], 0.5) == [200, 300]
+
+def test_the_fastest_client_is_always_fast():
+    assert fast([100, 200], 0.01) == [200]
+    assert fast([100, 200], 1) == [100, 200]
+    assert Queue(Env([], 0.25)).isFast(1)
@@ -0,0 +1,120 @@
+from default_imports import *
+
+from modules.queue.EngineQueue import EngineQueueDB
+from modules.queue.QueueIndex import QueueIndex, IndexEntry
+
+from datetime import datetime
+
+class Summaries:
+    """stands in for EngineQueueDB, with the summaries the index is built from"""
+    def __init__(self, bsons):
+        self.bsons = bsons
+
+    def unownedSummaries(self):
+        return list(self.bsons)
+
+class Notifier:
+    def __init__(self):
+        self.subscribers = []
+        self.started = False
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def start(self):
+        self.started = True
+
+class SignalledSummaries(Summaries):
+    """signals arrive while the summaries are being read"""
+    def __init__(self, bsons, notifier, signals):
+        super().__init__(bsons)
+        self.notifier = notifier
+        self.signals = signals
+        self.startedFirst = None
+
+    def unownedSummaries(self):
+        self.startedFirst = self.notifier.started
+        for signal in self.signals:
+            for subscriber in self.notifier.subscribers:
+                subscriber(signal)
+        return super().unownedSummaries()
+
+class Collection:
+    """stands in for the engine queue collection. Claims through the collection take `claimable`"""
+    def __init__(self, claimable):
+        self.claimable = claimable
+        self.claims = []
+
+    def find(self, filter, projection=None):
+        return []
+
+    def find_one_and_update(self, filter, update, sort=None):
+        self.claims.append(filter)
+        return self.claimable
+
+def summary(_id, precedence, day):
+    return {'_id': _id, 'precedence': precedence, 'date': datetime(2020, 1, day), 'originRank': 0, 'cost': 0}
+
+def index(bsons):
+    queueIndex = QueueIndex(Summaries(bsons), Notifier(), rebuildInterval=60)
+    queueIndex.rebuild()
+    return queueIndex
+
+def test_top_orders_by_precedence_then_date():
+    queueIndex = index([summary('a', 10, 3), summary('b', 50, 2), summary('c', 10, 1)])
+    assert queueIndex.top(3) == ['b', 'c', 'a']
+    assert queueIndex.top(2) == ['b', 'c']
+
+def test_top_does_not_remove_entries():
+    queueIndex = index([summary('a', 10, 1), summary('b', 20, 1)])
+    assert queueIndex.top(1) == ['b']
+    assert queueIndex.top(1) == ['b']
+    assert len(queueIndex) == 2
+
+def test_discard_drops_the_entry():
+    queueIndex = index([summary('a', 10, 1), summary('b', 20, 1)])
+    queueIndex.discard('b')
+    assert queueIndex.top(2) == ['a']
+    assert len(queueIndex) == 1
+
+def test_update_merges_and_skips_stale_items():
+    queueIndex = index([summary('a', 10, 1), summary('b', 20, 1)])
+    queueIndex.update('a', IndexEntry(precedence=30, date=datetime(2020, 1, 5), originRank=1, cost=0))
+    assert queueIndex.top(2) == ['a', 'b']
+    # merged as the database would: highest precedence, oldest date
+    assert queueIndex.entries['a'] == IndexEntry(precedence=30, date=datetime(2020, 1, 1), originRank=1, cost=0)
+    assert len(queueIndex.top(10)) == 2
+
+def test_signals_update_the_index():
+    notifier = Notifier()
+    queueIndex = QueueIndex(Summaries([summary('a', 10, 1)]), notifier, rebuildInterval=60)
+    queueIndex.rebuild()
+    for subscriber in notifier.subscribers:
+        subscriber({'engineQueueId': 'b', 'precedence': 100, 'date': datetime(2020, 1, 2)})
+        subscriber({'engineQueueId': 'c'}) # from an older writer, left to the rebuild
+    assert queueIndex.top(3) == ['b', 'a']
+
+def test_compact_keeps_the_order():
+    queueIndex = index([summary(str(i), i, 1) for i in range(10)])
+    for i in range(10):
+        queueIndex.update(str(i), IndexEntry(precedence=i + 100, date=datetime(2020, 1, 1), originRank=0, cost=0))
+    queueIndex.compact()
+    assert len(queueIndex.heap) == 10
+    assert queueIndex.top(3) == ['9', '8', '7']
+
+def test_start_tails_before_the_rebuild_and_keeps_signals_from_during_it():
+    notifier = Notifier()
+    summaries = SignalledSummaries([summary('a', 10, 1)], notifier,
+        [{'engineQueueId': 'b', 'precedence': 100, 'date': datetime(2020, 1, 2)}])
+    queueIndex = QueueIndex(summaries, notifier, rebuildInterval=60)
+    queueIndex.start()
+    assert summaries.startedFirst
+    assert queueIndex.top(2) == ['b', 'a']
+    assert queueIndex.pending is None
+
+def test_claim_falls_back_to_the_collection_when_the_index_comes_up_short():
+    coll = Collection({'_id': 'z'})
+    assert EngineQueueDB(coll).claimIndexed('client', {}, index([]), lookahead=64) == {'_id': 'z'}
+    # fewer candidates than the lookahead, none of them claimable
+    assert EngineQueueDB(coll).claimIndexed('client', {}, index([summary('a', 10, 1)]), lookahead=64) == {'_id': 'z'}
+    assert coll.claims == [{'owner': None, 'completed': False}] * 2
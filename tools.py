@@ -4,6 +4,7 @@ from default_imports import *
 from conf.ConfigWrapper import ConfigWrapper
 
 import argparse
+import os
 import sys
 import logging
 import json
@@ -11,6 +12,10 @@ import json
 from utils.updatePlayerDatabase import updatePlayerDatabase
 from utils.buildAnalysedPositionTable import buildAnalysedPositionTable
 from utils.buildAverageReport import buildAverageReport
+from utils.benchmarkModels import benchmarkModels, exportNumpyModels
+from utils.calibratePrecision import calibratePrecision
+
+from modules.irwin.ModelRegistry import ModelRegistry
 
 from Env import Env
 
@@ -22,6 +27,8 @@ parser.add_argument("--trainbasic", dest="trainbasic", nargs="?",
                 default=False, const=True, help="train basic game model")
 parser.add_argument("--trainanalysed", dest="trainanalysed", nargs="?",
                 default=False, const=True, help="train analysed game model")
+parser.add_argument("--traintriage", dest="traintriage", nargs="?",
+                default=False, const=True, help="distill the basic game model into the triage model")
 parser.add_argument("--filtered", dest="filtered", nargs="?",
                 default=False, const=True , help="use filtered dataset for training")
 parser.add_argument("--newmodel", dest="newmodel", nargs="?",
@@ -48,8 +55,26 @@ parser.add_argument("--buildaveragereport", dest="buildaveragereport", nargs="?"
 parser.add_argument("--eval", dest="eval", nargs="?",
                 default=False, const=True,
                     help="evaluate the performance of neural networks")
+parser.add_argument("--comparearchitectures", dest="comparearchitectures", nargs="?",
+                default=False, const=True,
+                    help="compare the accuracy and speed of the lstm and dilated analysed game models")
+parser.add_argument("--evaltriage", dest="evaltriage", nargs="?",
+                default=False, const=True,
+                    help="compare how the triage and basic game models order the queue")
 parser.add_argument("--test", dest="test", nargs="?",
                 default=False, const=True, help="test on a single player")
+parser.add_argument("--benchmark", dest="benchmark", nargs="?",
+                default=None, const="benchmark.json",
+                    help="measure model latency, throughput and memory across batch sizes, threads and runtimes. Results are written to the given json file")
+parser.add_argument("--exportnumpy", dest="exportnumpy", nargs="?",
+                default=False, const=True,
+                    help="export the models for the numpy runtime")
+parser.add_argument("--calibrate", dest="calibrate", nargs="?",
+                default=None, const="int8", choices=["float16", "int8"],
+                    help="compare a reduced precision numpy runtime with float32 so it can be enabled")
+parser.add_argument("--stamp", dest="stamp", nargs="?",
+                default=False, const=True,
+                    help="give the model files a new version, so running servers reload them. Run once they are copied in")
 parser.add_argument("--discover", dest="discover", nargs="?",
                 default=False, const=True,
                     help="search for cheaters in the database that haven't been marked")
@@ -76,6 +101,10 @@ if args.trainbasic:
         config['irwin model basic training epochs'],
         args.filtered)
 
+if args.traintriage:
+    env.irwin.training.triageModelTraining.train(
+        config['irwin model triage training epochs'] or config['irwin model basic training epochs'])
+
 if args.buildbasictable:
     env.irwin.training.basicModelTraining.buildTable()
 
@@ -104,6 +133,28 @@ if args.test:
 if args.eval:
     env.irwin.evaluation.evaluate()
 
+if args.comparearchitectures:
+    env.irwin.evaluation.compareArchitectures()
+
+if args.evaltriage:
+    env.irwin.evaluation.evaluateTriage()
+
+if args.benchmark:
+    benchmarkModels(args.benchmark)
+
+if args.exportnumpy:
+    exportNumpyModels(env)
+
+if args.calibrate:
+    calibratePrecision(env, args.calibrate)
+
+if args.stamp:
+    for section in ['basic', 'analysed', 'analysed_dilated', 'triage']:
+        modelConfig = config[f'irwin model {section}'] # None if the model has no section
+        if modelConfig is None or modelConfig.file is None or not os.path.isfile(modelConfig.file):
+            continue
+        logging.info(f'{modelConfig.file} is now version {ModelRegistry.stamp(modelConfig.file)}')
+
 if args.discover:
     env.irwin.discover()
 
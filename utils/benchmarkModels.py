@@ -0,0 +1,202 @@
+""" measure how fast the models predict on this machine, across batch sizes, thread counts and runtimes """
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import chess
+import numpy as np
+
+from modules.game.Game import Game
+from modules.game.EngineEval import EngineEval
+from modules.game.AnalysedMove import AnalysedMove, Analysis
+from modules.game.AnalysedGame import AnalysedGame, GameAnalysedGame
+from modules.irwin.BasicGameModel import BasicGameModel
+from modules.irwin.InferencePool import limitThreads, threadVariables
+
+# (runtime, precision) of each backend that is benchmarked
+backends = {
+    'keras': ('keras', None),
+    'numpy': ('numpy', 'float32'),
+    'numpy-float16': ('numpy', 'float16'),
+    'numpy-int8': ('numpy', 'int8')
+}
+
+def syntheticGame(gameId, rng):
+    """
+    a game of random legal moves with a drifting evaluation and move times,
+    so its tensors go through the same code as real games
+    """
+    board = chess.Board()
+    pgn, plies = [], rng.randint(40, 120)
+    while len(pgn) < plies and not board.is_game_over():
+        move = rng.choice(list(board.legal_moves))
+        pgn.append(board.san(move))
+        board.push(move)
+    cp, analysis = 0, []
+    for _ in pgn:
+        cp = max(-1500, min(1500, cp + int(rng.gauss(0, 60))))
+        analysis.append(EngineEval(cp, None))
+    return Game(
+        id=gameId,
+        white='white',
+        black='black',
+        pgn=pgn,
+        emts=[int(rng.expovariate(1/300)) for _ in pgn],
+        analysis=analysis)
+
+def syntheticAnalysedGame(game, rng):
+    """white's moves of game, each with up to 5 engine lines that the played move is usually among"""
+    board = chess.Board()
+    analysedMoves = []
+    for ply, (san, emt, engineEval) in enumerate(zip(game.pgn, game.emts, game.analysis)):
+        move = board.parse_san(san)
+        if board.turn:
+            others = [m for m in board.legal_moves if m != move]
+            lines = rng.sample(others, min(len(others), 4))
+            lines.insert(min(len(lines), int(rng.expovariate(1))), move)
+            cps = sorted([engineEval.cp + int(abs(rng.gauss(0, 80))) for _ in lines[1:]] + [engineEval.cp], reverse=True)
+            analysedMoves.append(AnalysedMove(
+                uci=move.uci(),
+                move=ply//2 + 1,
+                emt=emt,
+                engineEval=engineEval,
+                analyses=[Analysis(m.uci(), EngineEval(c, None)) for m, c in zip(lines, cps)]))
+        board.push(move)
+    return AnalysedGame.new(game.id, True, 'white', analysedMoves[:60])
+
+def syntheticGames(amount, seed=0):
+    rng = random.Random(seed)
+    games = [syntheticGame(f'bench{i:05d}', rng) for i in range(amount)]
+    return [GameAnalysedGame(syntheticAnalysedGame(g, rng), g) for g in games]
+
+def inputs(modelName, gameAnalysedGames):
+    """the model inputs for gameAnalysedGames, as the models build them"""
+    if modelName in ('basic', 'triage'):
+        tensors = [gag.game.tensor('white') for gag in gameAnalysedGames]
+    else:
+        tensors = [gag.tensor() for gag in gameAnalysedGames]
+    return [np.array([t[0] for t in tensors]), np.array([t[1] for t in tensors])]
+
+def peakMemory():
+    """peak resident memory of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def timeCalls(call, minCalls=5, minSeconds=1):
+    """seconds taken by each of at least minCalls calls, running for at least minSeconds"""
+    call() # the first call builds the graph
+    times, start = [], time.time()
+    while len(times) < minCalls or time.time() - start < minSeconds:
+        before = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - before)
+    return times
+
+def benchmarkRun(config, spec):
+    """
+    benchmark one model at one backend and thread count in this process.
+    spec: {'model': 'basic', 'triage', 'analysed' or 'analysed_dilated', 'backend', 'threads', 'batchSizes'}
+    """
+    from modules.irwin.AnalysedGameModel import AnalysedGameModel
+    from modules.irwin.DilatedAnalysedGameModel import DilatedAnalysedGameModel
+    from modules.irwin.TriageModel import TriageModel
+    modelClass = {
+        'basic': BasicGameModel,
+        'triage': TriageModel,
+        'analysed': AnalysedGameModel,
+        'analysed_dilated': DilatedAnalysedGameModel
+    }[spec['model']]
+    runtime, precision = backends[spec['backend']]
+    limitThreads(runtime, spec['threads'], spec['threads'])
+
+    gameAnalysedGames = syntheticGames(max(spec['batchSizes']))
+    start = time.perf_counter()
+    modelInputs = inputs(spec['model'], gameAnalysedGames)
+    tensorsPerSecond = len(gameAnalysedGames) / (time.perf_counter() - start)
+
+    baseMemory = peakMemory()
+    model = modelClass(config, newmodel=runtime == 'keras' and not os.path.isfile(config[modelClass.fileKey]), runtime=runtime, precision=precision)
+
+    results = []
+    for batchSize in sorted(spec['batchSizes']):
+        batch = [x[:batchSize] for x in modelInputs]
+        times = timeCalls(lambda: model.model.predict(batch, batch_size=batchSize))
+        results.append({
+            'model': spec['model'],
+            'backend': spec['backend'],
+            'threads': spec['threads'],
+            'batchSize': batchSize,
+            'calls': len(times),
+            'latency': {
+                'mean': float(np.mean(times)),
+                'p50': float(np.percentile(times, 50)),
+                'p95': float(np.percentile(times, 95)),
+                'p99': float(np.percentile(times, 99))
+            },
+            'gamesPerSecond': batchSize / float(np.mean(times)),
+            'tensorsPerSecond': tensorsPerSecond,
+            'baseMemoryMB': baseMemory,
+            'peakMemoryMB': peakMemory()
+        })
+    return results
+
+def machine():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__
+    }
+
+def benchmarkModels(path, models=['basic', 'triage', 'analysed', 'analysed_dilated'], backendNames=list(backends),
+        threadCounts=None, batchSizes=[1, 8, 32, 128, 512]):
+    """
+    Run every combination of models, backends and threadCounts in its own process, so thread
+    settings take effect and peak memory is the run's own, and write the results to path as json.
+    Backends whose model can't be loaded, like numpy before the models are exported, are recorded with their error.
+    """
+    threadCounts = threadCounts or sorted({1, os.cpu_count()})
+    runs = []
+    for model in models:
+        for backend in backendNames:
+            for threads in threadCounts:
+                spec = {'model': model, 'backend': backend, 'threads': threads, 'batchSizes': batchSizes}
+                logging.info(f'benchmarking {model} model, {backend} backend, {threads} threads')
+                env = {**os.environ, **{var: str(threads) for var in threadVariables}}
+                process = subprocess.run([sys.executable, '-m', 'utils.benchmarkModels', json.dumps(spec)],
+                    env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                if process.returncode != 0:
+                    error = (process.stderr.strip().splitlines() or ['exited with ' + str(process.returncode)])[-1]
+                    logging.warning(f'{model} model on {backend} failed: {error}')
+                    runs.append({**spec, 'error': error})
+                    continue
+                for result in json.loads(process.stdout.strip().splitlines()[-1]):
+                    logging.info(f"  batch {result['batchSize']}: {result['gamesPerSecond']:.0f} games/sec, "
+                        f"p95 {1000*result['latency']['p95']:.1f}ms, peak {result['peakMemoryMB']:.0f}MB")
+                    runs.append(result)
+
+    with open(path, 'w') as f:
+        json.dump({'date': datetime.now().isoformat(), 'machine': machine(), 'runs': runs}, f, indent=2)
+    logging.info(f'benchmark results written to {path}')
+    return runs
+
+def exportNumpyModels(env):
+    """export both models for the numpy runtime and report how closely they match keras"""
+    from modules.irwin.DilatedAnalysedGameModel import analysedGameModelClass
+    from modules.irwin.ModelRegistry import modelRegistry
+    for modelClass in (BasicGameModel, analysedGameModelClass(env.config)):
+        difference = modelRegistry.get(modelClass, env.config, runtime='keras').exportNumpy()
+        logging.info(f'exported {modelClass.__name__}. Largest difference from keras: {difference:.2e}')
+
+if __name__ == '__main__':
+    # a single run, started by benchmarkModels. Results are the last line of stdout
+    from conf.ConfigWrapper import ConfigWrapper
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    print(json.dumps(benchmarkRun(ConfigWrapper.new('conf/server_config.json'), json.loads(sys.argv[1]))))
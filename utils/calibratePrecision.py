@@ -0,0 +1,64 @@
+""" check reduced precision models against float32 on a sample of players before they may be used """
+import logging
+
+import numpy as np
+
+from modules.irwin.DilatedAnalysedGameModel import analysedGameModelClass
+from modules.irwin.BasicGameModel import BasicGameModel
+from modules.irwin.NumpyModel import npzPath, writeCalibration
+from modules.irwin.PlayerReport import PlayerReport
+
+def samplePlayers(env, size):
+    """engines and legit players, like Evaluation"""
+    return env.irwinEnv.playerDB.engineSample(True, size) + env.irwinEnv.playerDB.engineSample(False, size)
+
+def calibratePrecision(env, precision, size=None):
+    """
+    Compare `precision` with float32 on a sample of players. Agreement is the fraction of players
+    given the same verdict from their PlayerReport activation, and for the basic model the fraction
+    of games scored within 5 points. A precision is recorded as calibrated for each model, and is
+    only used while its agreement is at least 'irwin model precision_agreement'. The weights of
+    a precision that is good enough are written at that precision, which is what serving loads.
+    """
+    config = env.config
+    size = size or config['irwin testing eval_size']
+    minAgreement = config['irwin model precision_agreement']
+
+    analysedClass = analysedGameModelClass(config)
+    analysed = {p: analysedClass(config, runtime='numpy', precision=p) for p in ('float32', precision)}
+    basic = {p: BasicGameModel(config, runtime='numpy', precision=p) for p in ('float32', precision)}
+
+    verdicts, activationDifferences, basicDifferences = [], [], []
+    for player in samplePlayers(env, size):
+        gameAnalysedGames = env.irwin.gameAnalysedGames(player.id)
+        if len(gameAnalysedGames) == 0:
+            continue
+
+        activations = [PlayerReport.new(player, zip([gag.analysedGame for gag in gameAnalysedGames], analysed[p].predict(gameAnalysedGames))).activation
+            for p in ('float32', precision)]
+        verdicts.append(PlayerReport.verdict(activations[0]) == PlayerReport.verdict(activations[1]))
+        activationDifferences.append(abs(activations[0] - activations[1]))
+
+        full, reduced = (basic[p].predict(player.id, [gag.game for gag in gameAnalysedGames]) for p in ('float32', precision))
+        basicDifferences.extend([abs(f - r) for f, r in zip(full, reduced) if f is not None and r is not None])
+
+    if len(verdicts) == 0:
+        logging.warning('no players with analysed games to calibrate on')
+        return
+
+    agreements = {
+        analysedClass: float(np.mean(verdicts)),
+        BasicGameModel: float(np.mean([d <= 5 for d in basicDifferences])) if len(basicDifferences) > 0 else 1.0
+    }
+    reduced = {analysedClass: analysed[precision], BasicGameModel: basic[precision]}
+    logging.info(f'{precision} over {len(verdicts)} players: mean activation difference {np.mean(activationDifferences):.2f}, '
+        f'mean basic score difference {np.mean(basicDifferences or [0]):.2f}')
+
+    for modelClass, agreement in agreements.items():
+        path = npzPath(config[modelClass.fileKey])
+        writeCalibration(path, precision, agreement)
+        if agreement < minAgreement:
+            logging.warning(f'{modelClass.__name__} at {precision} agrees on {agreement:.3f}, below {minAgreement}. It will stay at float32')
+        else:
+            reduced[modelClass].model.saveReduced(path) # served from without loading the float32 weights
+            logging.info(f'{modelClass.__name__} at {precision} agrees on {agreement:.3f}. It can be enabled with "irwin model precision"')
@@ -0,0 +1,107 @@
+"""Turns analysis requests from lichess into engine queue entries"""
+from default_imports import *
+
+from modules.game.Player import PlayerID
+from modules.lichess.Request import Request
+from modules.queue.EngineQueue import EngineQueue
+from modules.queue.Origin import Origin, OriginReport, OriginModerator, OriginRandom
+
+from datetime import datetime, timedelta
+
+class Enqueue(NamedTuple('Enqueue', [
+        ('env', 'Env')
+    ])):
+    def request(self, request: Request) -> Dict:
+        return self.requests([request])
+
+    def requests(self, requests: List[Request]) -> Dict:
+        """
+        Store the players and games of requests, score every game with one call to the basic game model,
+        and merge the results into the engine queue. Entries are merged by the database, so
+        any number of listeners can enqueue at once.
+        Returns a summary of what was queued.
+        """
+        env = self.env
+        requests, suppressed = self.suppressFresh(requests)
+
+        env.gameApi.writePlayers([r.player for r in requests])
+        env.gameApi.writeGames([g for r in requests for g in r.games])
+
+        playerIdsAndGames = [(r.player.id, g) for r in requests for g in r.games]
+        predictions = iter(env.irwin.basicPredictions(playerIdsAndGames))
+
+        # several requests in one batch may be for the same player
+        engineQueues = {}
+        for r in requests:
+            gamesAndPredictions = [(g, next(predictions)) for g in r.games]
+            engineQueue = EngineQueue.new(
+                playerId=r.player.id,
+                origin=r.origin,
+                gamesAndPredictions=[(g, p) for g, p in gamesAndPredictions if p is not None])
+            engineQueues[r.player.id] = engineQueue if r.player.id not in engineQueues else EngineQueue.merge(engineQueues[r.player.id], engineQueue)
+
+        engineQueues = list(engineQueues.values())
+        gamesById = {g.id: g for r in requests for g in r.games}
+        requiredGames = env.gameApi.unanalysedGames([(eq.id, [gamesById[gid] for gid in eq.requiredGameIds]) for eq in engineQueues])
+
+        queued = [eq._replace(requiredGameIds=[g.id for g in games], games=games)
+            for eq, games in zip(engineQueues, requiredGames) if len(games) > 0]
+        env.queue.queueEngineAnalyses(queued)
+        self.updateCosts([eq.id for eq in queued])
+        if env.positionScheduler.enabled():
+            env.positionScheduler.schedule(queued)
+
+        return {
+            'players': len(engineQueues),
+            'games': len(playerIdsAndGames),
+            'queued': [eq.id for eq in queued],
+            'skipped': [eq.id for eq, games in zip(engineQueues, requiredGames) if len(games) == 0],
+            'suppressed': suppressed
+        }
+
+    def updateCosts(self, playerIds: List[PlayerID]):
+        """
+        Work out the cost of the stored entries of playerIds from every game they require,
+        including games merged in by earlier requests, less the positions already analysed.
+        """
+        env = self.env
+        engineQueues = [eq for eq in env.queue.engineQueuesByIds(playerIds) if not eq.completed]
+        costs = env.gameApi.analysisCosts([(eq.id, env.gameApi.completeSnapshot(eq.id, eq.requiredGames(), eq.requiredGameIds))
+            for eq in engineQueues])
+        env.queue.setEngineAnalysisCosts([(eq.id, cost) for eq, cost in zip(engineQueues, costs)])
+
+    def suppressFresh(self, requests: List[Request]) -> Tuple[List[Request], List[PlayerID]]:
+        """
+        A player reported on recently with no new games would get the same report again.
+        Drop random requests for them and downgrade reports to random. Moderator requests always go through.
+        Returns the requests to queue and the ids of players that were dropped.
+        Off unless 'queue fresh_report' is set.
+        """
+        env = self.env
+        if not env.config['queue fresh_report']:
+            return requests, []
+        fresh = timedelta(seconds=env.config['queue fresh_report'])
+        candidates = [r for r in requests if r.origin != OriginModerator]
+        if len(candidates) == 0:
+            return requests, []
+
+        reportDates = env.irwinEnv.playerReportDB.newestDates([r.player.id for r in candidates])
+        now = datetime.now()
+        recent = {playerId for playerId, date in reportDates.items() if now - date < fresh}
+        if len(recent) == 0:
+            return requests, []
+
+        known = set(env.gameApi.existingGameIds([g.id for r in candidates if r.player.id in recent for g in r.games]))
+        stale = {r.player.id for r in candidates if r.player.id in recent and all(g.id in known for g in r.games)}
+
+        kept, suppressed = [], []
+        for r in requests:
+            if r.origin == OriginModerator or r.player.id not in stale:
+                kept.append(r)
+            elif r.origin == OriginReport:
+                kept.append(r._replace(origin=OriginRandom))
+            else:
+                suppressed.append(r.player.id)
+        if len(suppressed) > 0:
+            logging.info(f'Suppressed requests for recently reported players {suppressed}')
+        return kept, suppressed
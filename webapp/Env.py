@@ -14,6 +14,9 @@ from modules.irwin.Irwin import Irwin
 
 from modules.lichess.Api import Api as LichessApi
 
+from webapp.Enqueue import Enqueue
+from webapp.PositionScheduler import PositionScheduler
+
 import logging
 
 class Env:
@@ -36,3 +39,5 @@ class Env:
         self.queue = Queue(self.queueEnv)
         self.irwin = Irwin(self.irwinEnv)
         self.lichessApi = LichessApi(self.config['api url'], self.config['api token'])
+        self.enqueue = Enqueue(self)
+        self.positionScheduler = PositionScheduler(self)
@@ -0,0 +1,92 @@
+"""Analyses queued players position by position, so positions shared between players are only searched once"""
+from default_imports import *
+
+from modules.auth.Auth import AuthID
+from modules.game.Game import Game
+from modules.game.Player import PlayerID
+from modules.game.AnalysedPosition import AnalysedPosition, AnalysedPositionID
+from modules.game.EngineTools import EngineTools
+from modules.queue.EngineQueue import EngineQueue
+from modules.queue.IrwinQueue import IrwinQueue
+from modules.queue.PositionQueue import PositionQueue, PositionSchedulerOwner
+
+from chess import Board
+
+class PositionScheduler(NamedTuple('PositionScheduler', [
+        ('env', 'Env')
+    ])):
+    """
+    Used when 'queue scheduler' is 'position'. Engine queue entries are held by PositionSchedulerOwner
+    while their positions are on the position queue. Once every position a player needs is analysed,
+    their analysed games are assembled and they are passed on to irwin.
+    """
+    def enabled(self) -> bool:
+        return self.env.config['queue scheduler'] == 'position'
+
+    def schedule(self, engineQueues: List[EngineQueue]):
+        """
+        put the positions of the required games of engineQueues on the position queue.
+        Entries are read back once held, as the stored entry may require games merged in by earlier requests
+        """
+        env = self.env
+        held = env.queue.assignEngineAnalyses([eq.id for eq in engineQueues], PositionSchedulerOwner) # the rest are taken by clients
+        engineQueues = env.queue.engineQueuesByIds(held)
+
+        positions = {}
+        for engineQueue in engineQueues:
+            for positionId, board, multipv in self.positions(engineQueue.id, self.requiredGames(engineQueue)):
+                positionQueue = PositionQueue.new(positionId, board.fen(), multipv, [engineQueue.id])
+                positions[positionId] = positionQueue if positionId not in positions else PositionQueue.merge(positions[positionId], positionQueue)
+
+        # positions from earlier sweeps don't need searching again
+        analysed = env.gameApi.analysedPositionsByIds(list(positions.keys()))
+        queued = [pq for pq in positions.values() if not self.sufficient(analysed.get(pq.id), pq)]
+        env.queue.queuePositions(queued)
+        logging.info(f'Scheduled {len(queued)} of {len(positions)} positions for {len(held)} players')
+
+        self.assemble(held)
+
+    def request(self, owner: AuthID) -> List[PositionQueue]:
+        return self.env.queue.nextPositions(owner, self.env.config['queue position batch_size'])
+
+    def complete(self, owner: AuthID, results: List[Tuple[AnalysedPosition, int]]):
+        """
+        results: analysed positions with the multipv they were searched at
+        """
+        env = self.env
+        positionQueues = env.queue.positionsByIds([ap.id for ap, _ in results])
+        env.gameApi.writeAnalysedPositions([ap for ap, _ in results])
+        env.queue.completePositions(owner, [(ap.id, multipv) for ap, multipv in results])
+        self.assemble(list({playerId for pq in positionQueues for playerId in pq.playerIds}))
+
+    def assemble(self, playerIds: List[PlayerID]):
+        """complete the engine analysis of each of playerIds whose positions are all analysed"""
+        env = self.env
+        for engineQueue in env.queue.engineQueuesByIds(playerIds):
+            if engineQueue.completed or engineQueue.owner != PositionSchedulerOwner:
+                continue
+            # games that can't be analysed have no positions and are left out, as they are by the clients
+            games = [g for g in self.requiredGames(engineQueue) if EngineTools.playerNodes(g, g.white == engineQueue.id) is not None]
+            analysedPositions = env.gameApi.analysedPositionsByIds([pid for pid, _, _ in self.positions(engineQueue.id, games)])
+            analysedGames = [EngineTools.assembleGame(g, g.white == engineQueue.id, analysedPositions) for g in games]
+            if None in analysedGames:
+                continue # still waiting on positions
+
+            env.gameApi.writeAnalysedGames([ag.toJson() for ag in analysedGames])
+            env.queue.completeEngineAnalysis(engineQueue.id)
+            env.queue.queueNeuralAnalysis(IrwinQueue(
+                id = engineQueue.id,
+                origin = engineQueue.origin,
+                owner = PositionSchedulerOwner))
+            logging.warning(f'Assembled {len(analysedGames)} analysed games for {engineQueue.id}')
+
+    def requiredGames(self, engineQueue: EngineQueue) -> List[Game]:
+        return self.env.gameApi.completeSnapshot(engineQueue.id, engineQueue.requiredGames(), engineQueue.requiredGameIds)
+
+    @staticmethod
+    def positions(playerId: PlayerID, games: List[Game]) -> List[Tuple[AnalysedPositionID, Board, int]]:
+        return [position for g in games for position in EngineTools.positions(g, g.white == playerId)]
+
+    @staticmethod
+    def sufficient(analysedPosition: Opt[AnalysedPosition], positionQueue: PositionQueue) -> bool:
+        return EngineTools.sufficient(analysedPosition, Board(positionQueue.fen), positionQueue.multipv)
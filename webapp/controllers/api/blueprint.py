@@ -2,11 +2,14 @@ import logging
 from flask import Blueprint, Response, request, jsonify, json
 from webapp.DefaultResponse import Success, BadRequest, NotAvailable
 
-from modules.game.AnalysedGame import GameAnalysedGame
-from modules.irwin.PlayerReport import PlayerReport
 from modules.auth.Priv import RequestJob, CompleteJob, PostJob
 from modules.queue.Origin import OriginReport, OriginModerator, OriginRandom
+from modules.queue.IrwinQueue import IrwinQueue
+from modules.queue.EngineClient import EngineClient
 from modules.client.Job import Job
+from modules.game.AnalysedPosition import AnalysedPosition
+from modules.game.AnalysedMove import AnalysisBSONHandler
+from modules.lichess.Request import Request
 import traceback
 
 def buildApiBlueprint(env):
@@ -15,10 +18,15 @@ def buildApiBlueprint(env):
     @apiBlueprint.route('/request_job', methods=['GET'])
     @env.auth.authoriseRoute(RequestJob)
     def apiRequestJob(authable):
-        engineQueue = env.queue.nextEngineAnalysis(authable.id)
+        req = request.get_json(silent=True)
+        engineQueue = env.queue.nextEngineAnalysis(
+            authable.id,
+            speed = req.get('speed'),
+            wait = float(req.get('wait') or 0),
+            holding = list(req.get('holding') or []))
         logging.debug(f'EngineQueue for req {engineQueue}')
         if engineQueue is not None:
-            requiredGames = env.gameApi.gamesForAnalysis(engineQueue.id, engineQueue.requiredGameIds)
+            requiredGames = env.gameApi.completeSnapshot(engineQueue.id, engineQueue.requiredGames(), engineQueue.requiredGameIds)
             requiredGameIds = [g.id for g in requiredGames]
 
             logging.warning(f'Requesting {authable.name} analyses {requiredGameIds} for {engineQueue.id}')
@@ -36,6 +44,123 @@ def buildApiBlueprint(env):
                 mimetype = 'application/json')
         return NotAvailable
 
+    @apiBlueprint.route('/request_positions', methods=['GET'])
+    @env.auth.authoriseRoute(RequestJob)
+    def apiRequestPositions(authable):
+        """a batch of positions for clients running with --positions"""
+        positionQueues = env.positionScheduler.request(authable.id)
+        if len(positionQueues) > 0:
+            logging.info(f'Requesting {authable.name} analyses {len(positionQueues)} positions')
+            return Response(
+                response = json.dumps({'positions': [pq.toJson() for pq in positionQueues]}),
+                status = 200,
+                mimetype = 'application/json')
+        return NotAvailable
+
+    @apiBlueprint.route('/complete_positions', methods=['POST'])
+    @env.auth.authoriseRoute(CompleteJob)
+    def apiCompletePositions(authable):
+        req = request.get_json(silent=True)
+        try:
+            results = [(AnalysedPosition(
+                    id = p['id'],
+                    analyses = [AnalysisBSONHandler.reads(a) for a in p['analyses']]),
+                int(p['multipv'])) for p in req['positions']]
+            env.positionScheduler.complete(authable.id, results)
+            return Success
+        except (KeyError, TypeError, ValueError):
+            tb = traceback.format_exc()
+            logging.warning(f'Error completing positions: {tb}')
+
+        return BadRequest
+
+    @apiBlueprint.route('/inference_stats', methods=['GET'])
+    @env.auth.authoriseRoute(RequestJob)
+    def apiInferenceStats(authable):
+        """latency and batch size histograms of the model inference batchers"""
+        batchers = {
+            'basic': env.irwin.basicGameModel.batcher,
+            'analysed': env.irwin.analysedGameModel.batcher
+        }
+        return Response(
+            response = json.dumps({name: None if b is None else b.stats() for name, b in batchers.items()}),
+            status = 200,
+            mimetype = 'application/json')
+
+    @apiBlueprint.route('/queue_players', methods=['POST'])
+    @env.auth.authoriseRoute(PostJob)
+    def apiQueuePlayers(authable):
+        """
+        Queue many players at once, e.g. for a moderator sweep.
+        'requests' has the same format as the requests on the lichess stream.
+        """
+        req = request.get_json(silent=True)
+        try:
+            requests = [Request.fromJson(r) for r in req['requests']]
+            if None not in requests:
+                summary = env.enqueue.requests(requests)
+                logging.warning(f'{authable.name} queued {len(summary["queued"])} of {summary["players"]} players')
+                return Response(
+                    response = json.dumps({'success': True, **summary}),
+                    status = 200,
+                    mimetype = 'application/json')
+        except (KeyError, TypeError):
+            tb = traceback.format_exc()
+            logging.warning(f'Error queueing players: {tb}')
+
+        return BadRequest
+
+    @apiBlueprint.route('/register_client', methods=['POST'])
+    @env.auth.authoriseRoute(RequestJob)
+    def apiRegisterClient(authable):
+        req = request.get_json(silent=True)
+        try:
+            hardware = req['hardware']
+            env.queue.registerEngineClient(EngineClient.new(
+                id = authable.id,
+                cores = int(hardware['cores']),
+                engines = int(hardware['engines']),
+                threads = int(hardware['threads']),
+                nps = int(hardware['nps']),
+                nodes = int(hardware['nodes'])))
+            logging.info(f'{authable.name} registered {hardware}')
+            return Success
+        except (KeyError, TypeError, ValueError):
+            tb = traceback.format_exc()
+            logging.warning(f'Error registering client: {tb}')
+        return BadRequest
+
+    @apiBlueprint.route('/progress_job', methods=['POST'])
+    @env.auth.authoriseRoute(CompleteJob)
+    def apiProgressJob(authable):
+        """
+        Store games as they are analysed, and tell the client whether the
+        remaining games could still change the verdict on the player.
+        The verdict is checked by irwin-worker.py, so the answer is that of the last
+        check finished, and a check is requested for the games posted so far.
+        """
+        req = request.get_json(silent=True)
+        try:
+            job = Job.fromJson(req['job'])
+            remaining = int(req['remaining'])
+            if env.gameApi.writeAnalysedGames(req['analysedGames']):
+                settled = False
+                if env.config['irwin early_stop'] and remaining > 0:
+                    settled = env.queue.settled(job.playerId)
+                    if not settled:
+                        env.queue.requestSettleCheck(job.playerId, remaining)
+                if settled:
+                    logging.warning(f'Verdict on {job.playerId} is settled. Cancelling {remaining} games')
+                return Response(
+                    response = json.dumps({'success': True, 'settled': settled}),
+                    status = 200,
+                    mimetype = 'application/json')
+        except (KeyError, TypeError, ValueError):
+            tb = traceback.format_exc()
+            logging.warning(f'Error progressing job: {tb}')
+
+        return BadRequest
+
     @apiBlueprint.route('/complete_job', methods=['POST'])
     @env.auth.authoriseRoute(CompleteJob)
     def apiCompleteJob(authable):
@@ -44,16 +169,18 @@ def buildApiBlueprint(env):
             job = Job.fromJson(req['job'])
             insertRes = env.gameApi.writeAnalysedGames(req['analysedGames'])
             if insertRes:
-                env.queue.completeEngineAnalysis(job.playerId)
-
-                player = env.irwin.env.playerDB.byId(job.playerId)
-                analysedGames = env.irwin.env.analysedGameDB.byPlayerId(job.playerId)
-                games = env.irwin.env.gameDB.byIds([ag.gameId for ag in analysedGames])
-                predictions = env.irwin.analysedGameModel.predict([GameAnalysedGame(ag, g) for ag, g in zip(analysedGames, games) if ag.gameLength() <= 60])
+                engineQueue = env.queue.engineQueueById(job.playerId)
+                env.queue.completeEngineAnalysis(
+                    job.playerId,
+                    owner = authable.id,
+                    searches = req.get('searches') or sum(2*len(ag['analysis']) for ag in req['analysedGames']),
+                    elapsed = req.get('elapsed'))
 
-                playerReport = PlayerReport.new(player, zip(analysedGames, predictions), owner = authable.name)
-                logging.warning(f'Sending player report for {playerReport.playerId}, activation {playerReport.activation}%')
-                env.lichessApi.postReport(playerReport)
+                # the player report is built and posted by irwin-worker.py
+                env.queue.queueNeuralAnalysis(IrwinQueue(
+                    id = job.playerId,
+                    origin = OriginRandom if engineQueue is None else engineQueue.origin,
+                    owner = authable.name))
 
                 return Success
         except KeyError as e: